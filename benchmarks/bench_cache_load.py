@@ -0,0 +1,97 @@
+"""Compare the legacy iterrows() cache refresh with the bulk Arrow load path
+
+Usage:
+    python benchmarks/bench_cache_load.py --rows 100000
+    DATABASE_URL=postgresql://localhost/compensation_db python benchmarks/bench_cache_load.py
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web'))
+
+from models import db, CachedRate  # noqa: E402
+from bulk_load import replace_cached_rates  # noqa: E402
+
+STATE = 'GA'
+PROCEDURE_CODE = '99213'
+
+
+def make_parquet(rows, seed=42):
+    """Build a synthetic rates parquet file in memory"""
+    rng = np.random.default_rng(seed)
+    start = date(2024, 1, 1)
+    df = pd.DataFrame({
+        'provider': [f"Provider {i:06d}" for i in range(rows)],
+        'rate': np.round(rng.uniform(20, 900, rows), 2),
+        'date': [start + timedelta(days=int(d)) for d in rng.integers(0, 365, rows)],
+    })
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def legacy_load(parquet_data):
+    """The original update_cache_from_s3 body: pandas + iterrows + one ORM object per row"""
+    df = pd.read_parquet(io.BytesIO(parquet_data))
+    CachedRate.query.filter_by(state=STATE, procedure_code=PROCEDURE_CODE).delete()
+    for _, row in df.iterrows():
+        db.session.add(CachedRate(
+            state=STATE,
+            procedure_code=PROCEDURE_CODE,
+            provider=row.get('provider'),
+            rate=row.get('rate'),
+            effective_date=row.get('date')
+        ))
+    db.session.commit()
+    return len(df)
+
+
+def bulk_load(parquet_data):
+    table = pq.read_table(pa.BufferReader(parquet_data))
+    return replace_cached_rates(STATE, PROCEDURE_CODE, table)
+
+
+def timed(label, fn, parquet_data):
+    start = time.perf_counter()
+    rows = fn(parquet_data)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} {rows:>9,} rows  {elapsed:8.2f} s  {rows / elapsed:>12,.0f} rows/s")
+    return rows / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the CachedRate refresh path')
+    parser.add_argument('--rows', type=int, default=100_000, help='Number of synthetic parquet rows')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv(
+            'DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+        )
+        db.init_app(app)
+
+        parquet_data = make_parquet(args.rows)
+        with app.app_context():
+            CachedRate.__table__.create(db.engine, checkfirst=True)
+            print(f"Backend: {db.engine.dialect.name}, parquet size: {len(parquet_data) / 1e6:.1f} MB")
+            before = timed('legacy', legacy_load, parquet_data)
+            after = timed('bulk', bulk_load, parquet_data)
+            print(f"Speedup: {after / before:.1f}x")
+            db.session.remove()
+            db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Compare the row-by-row and staging-table paths of import_data_wcfs
+
+Both paths import the same synthetic state schedule into fresh databases built
+by create_db.py; the resulting procedure_code, region and fee_schedule_rate
+rows are compared before throughput is reported.
+
+Usage:
+    python benchmarks/bench_import.py --rows 50000
+"""
+import argparse
+import csv
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'utils'))
+sys.path.insert(0, os.path.join(ROOT, 'builder_scripts'))
+
+from create_db import create_database  # noqa: E402
+from import_data_wcfs import import_file_to_database, import_file_to_database_bulk  # noqa: E402
+
+MODIFIERS = ['', '', '26', 'TC']
+
+
+def write_schedule(path, rows, seed=7):
+    """Write a synthetic fee schedule CSV mixing statewide and county rates"""
+    rng = random.Random(seed)
+    counties = [f"county_{i:02d}" for i in range(20)]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['proc_cd', 'modifier', 'description', 'rate', 'rate_unit',
+                         'is_by_report', 'region_type', 'region_value'])
+        for i in range(rows):
+            code = f"{70000 + (i // 8) % 30000:05d}"
+            if rng.random() < 0.5:
+                region_type, region_value = 'state', 'ZZ'
+            else:
+                region_type, region_value = 'county', rng.choice(counties)
+            writer.writerow([
+                code,
+                rng.choice(MODIFIERS),
+                f"PROCEDURE {code}",
+                f"{rng.uniform(10, 2000):.2f}" if rng.random() > 0.02 else '',
+                1,
+                'True' if rng.random() < 0.02 else 'False',
+                region_type,
+                region_value
+            ])
+
+
+def snapshot(db_path):
+    conn = sqlite3.connect(db_path)
+    result = {
+        'procedure_code': sorted(conn.execute(
+            "SELECT procedure_code, description, code_type FROM procedure_code").fetchall()),
+        'region': sorted(conn.execute(
+            "SELECT state_code, region_type, region_code, region_name FROM region").fetchall()),
+        'fee_schedule_rate': sorted(conn.execute("""
+            SELECT r.procedure_code, IFNULL(r.modifier, ''), IFNULL(g.region_code, ''), r.rate,
+                   r.rate_unit, r.is_by_report, r.effective_date
+            FROM fee_schedule_rate r LEFT JOIN region g ON g.region_id = r.region_id
+        """).fetchall()),
+    }
+    conn.close()
+    return result
+
+
+def run(label, import_fn, csv_path, db_path, rows, passes):
+    with redirect_stdout(StringIO()):
+        create_database(db_path)
+    timings = []
+    for _ in range(passes):
+        conn = sqlite3.connect(db_path)
+        start = time.perf_counter()
+        with redirect_stdout(StringIO()):
+            ok = import_fn(conn, csv_path)
+        timings.append(time.perf_counter() - start)
+        conn.close()
+        if not ok:
+            raise RuntimeError(f"{label} import failed")
+    for i, elapsed in enumerate(timings):
+        kind = 'insert' if i == 0 else 'update'
+        print(f"{label:<10} {kind:<7} {rows:>9,} rows  {elapsed:8.2f} s  {rows / elapsed:>12,.0f} rows/s")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the fee schedule CSV importer')
+    parser.add_argument('--rows', type=int, default=50_000, help='Number of synthetic CSV lines')
+    parser.add_argument('--passes', type=int, default=2,
+                        help='Import the file this many times (later passes exercise the update path)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_path = os.path.join(tmpdir, 'db_import_bench_ZZ.csv')
+        write_schedule(csv_path, args.rows)
+
+        row_db = os.path.join(tmpdir, 'row.db')
+        bulk_db = os.path.join(tmpdir, 'bulk.db')
+        row_times = run('row', import_file_to_database, csv_path, row_db, args.rows, args.passes)
+        bulk_times = run('bulk', import_file_to_database_bulk, csv_path, bulk_db, args.rows, args.passes)
+
+        print(f"Speedup (first pass): {row_times[0] / bulk_times[0]:.1f}x")
+        if snapshot(row_db) == snapshot(bulk_db):
+            print("Results identical: procedure_code, region, fee_schedule_rate")
+        else:
+            print("Results DIFFER between row-by-row and bulk imports")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
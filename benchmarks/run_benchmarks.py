@@ -0,0 +1,357 @@
+"""Repeatable benchmark suite over deterministic synthetic data
+
+Generates (or reuses) a data set with synthetic_data.py, then times:
+  create_db      builder_scripts/create_db.py schema creation
+  import_row     import_file_to_database on one state's drop files
+  import_bulk    import_file_to_database_bulk on the same files
+  schema_queries representative lookups on the create_db.py schema, with their query plans
+  get_rates      /api/rates/<state>/<procedure_code>, cold (response cache cleared) and warm
+  get_stats      /api/stats against the rate_query history rollups
+  medicare       medicare_rates.materialize for the synthetic CMS inputs
+
+Results are written as JSON (one object per benchmark, timings in seconds)
+and, with --baseline, compared against an earlier run; the exit status is 1
+if any benchmark got slower than the tolerance allows.
+
+Usage:
+    python benchmarks/run_benchmarks.py --scale small
+    python benchmarks/run_benchmarks.py --data /tmp/bench-data --scale full --output full.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/results/previous.json --tolerance 0.25
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic_data  # noqa: E402  (puts utils/, builder_scripts/ and web/ on sys.path)
+from create_db import create_database  # noqa: E402
+from import_data_wcfs import import_file_to_database, import_file_to_database_bulk  # noqa: E402
+import medicare_rates  # noqa: E402
+
+# Representative lookups on the create_db.py schema; each runs once per sampled (state, code, zip)
+SCHEMA_QUERIES = {
+    'rate_by_state_code': """
+        SELECT r.rate, r.modifier, r.region_id FROM fee_schedule_rate r
+        JOIN fee_schedule f ON f.id = r.fee_schedule_id
+        WHERE f.state_code = :state AND r.procedure_code = :code
+    """,
+    'published_rate_by_state_code': """
+        SELECT rate, modifier, region_id FROM published_fee_schedule_rate
+        WHERE state_code = :state AND procedure_code = :code
+    """,
+    'rate_by_zip': """
+        SELECT r.rate, r.modifier FROM fee_schedule_rate r
+        JOIN fee_schedule f ON f.id = r.fee_schedule_id
+        WHERE f.state_code = :state AND r.procedure_code = :code
+          AND (r.region_id IS NULL OR r.region_id IN (SELECT region_id FROM zip_region_map WHERE zip_code = :zip))
+    """,
+    'medicare_by_zip': """
+        SELECT m.rate FROM medicare_rate m
+        JOIN medicare_locality_map l ON l.locality_code = m.locality_code AND l.carrier_code = m.carrier_code
+        WHERE l.zip_code = :zip AND m.procedure_code = :code AND m.year = :year
+    """,
+}
+
+
+def summarize(timings):
+    """min/median/p95/mean seconds of a list of timings"""
+    ordered = sorted(timings)
+    return {
+        'runs': len(ordered),
+        'min_s': ordered[0],
+        'median_s': statistics.median(ordered),
+        'p95_s': ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        'mean_s': statistics.fmean(ordered),
+    }
+
+
+def timed(fn, repeat, setup=None):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        with redirect_stdout(StringIO()):
+            result = fn()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def bench_create_db(ctx):
+    path = os.path.join(ctx['tmp'], 'create_db.db')
+    timings, _ = timed(lambda: create_database(path), ctx['repeat'])
+    return summarize(timings)
+
+
+def _state_files(ctx):
+    state = ctx['params']['state_codes'][0]
+    return sorted(glob.glob(os.path.join(ctx['data'], 'drop', f"db_import_*_{state}.csv")))
+
+
+def _bench_import(ctx, import_fn):
+    files = _state_files(ctx)
+    rows = sum(sum(1 for _ in open(path, encoding='utf-8')) - 1 for path in files)
+    path = os.path.join(ctx['tmp'], 'import.db')
+
+    def setup():
+        shutil.copy(ctx['empty_db'], path)
+
+    def run():
+        conn = sqlite3.connect(path)
+        try:
+            for csv_path in files:
+                if not import_fn(conn, csv_path):
+                    raise RuntimeError(f"Import failed: {csv_path}")
+        finally:
+            conn.close()
+
+    timings, _ = timed(run, ctx['repeat'], setup)
+    result = summarize(timings)
+    result.update(files=len(files), rows=rows, rows_per_s=rows / result['median_s'])
+    return result
+
+
+def bench_import_row(ctx):
+    return _bench_import(ctx, import_file_to_database)
+
+
+def bench_import_bulk(ctx):
+    return _bench_import(ctx, import_file_to_database_bulk)
+
+
+def _samples(ctx, count):
+    """Deterministic (state, code, zip) samples drawn from the rates database"""
+    rng = random.Random(ctx['params']['seed'])
+    conn = sqlite3.connect(ctx['rates_db'])
+    keys = conn.execute("SELECT DISTINCT f.state_code, r.procedure_code FROM fee_schedule_rate r "
+                        "JOIN fee_schedule f ON f.id = r.fee_schedule_id").fetchall()
+    zips = {}
+    for zip_code, state in conn.execute("SELECT zip_code, state_code FROM zip_code"):
+        zips.setdefault(state, []).append(zip_code)
+    conn.close()
+    samples = []
+    for state, code in rng.sample(keys, min(count, len(keys))):
+        samples.append({'state': state, 'code': code, 'zip': rng.choice(zips.get(state, ['00000'])),
+                        'year': synthetic_data.MEDICARE_YEAR})
+    return samples
+
+
+def bench_schema_queries(ctx):
+    conn = sqlite3.connect(ctx['rates_db'])
+    samples = _samples(ctx, ctx['samples'])
+    results = {}
+    for name, sql in SCHEMA_QUERIES.items():
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", samples[0])]
+        timings = []
+        for params in samples:
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append(time.perf_counter() - start)
+        results[name] = dict(summarize(timings), plan=plan)
+    conn.close()
+    return results
+
+
+def _web_app(ctx):
+    if 'app' not in ctx:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.abspath(ctx['app_db'])}"
+        os.environ['RATES_DATABASE'] = os.path.abspath(ctx['rates_db'])
+        os.environ['CACHE_REFRESH_AGE_HOURS'] = str(10 ** 6)  # synthetic rows must never look stale
+        import app as web_app
+        ctx['app'] = web_app
+    return ctx['app']
+
+
+def bench_get_rates(ctx):
+    web_app = _web_app(ctx)
+    conn = sqlite3.connect(ctx['app_db'])
+    keys = conn.execute("SELECT DISTINCT state, procedure_code FROM cached_rate ORDER BY state, procedure_code").fetchall()
+    conn.close()
+    keys = random.Random(ctx['params']['seed']).sample(keys, min(ctx['samples'], len(keys)))
+    client = web_app.app.test_client()
+
+    results = {}
+    for label, clear in (('cold', True), ('warm', False)):
+        if not clear:
+            for state, code in keys:  # fill the response cache
+                client.get(f"/api/rates/{state}/{code}")
+        timings = []
+        for state, code in keys:
+            if clear:
+                web_app.rate_cache.clear()
+            start = time.perf_counter()
+            response = client.get(f"/api/rates/{state}/{code}")
+            timings.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"get_rates {state}/{code} returned {response.status_code}")
+        results[label] = summarize(timings)
+    web_app.access_counter.shutdown()  # flush the buffered hits outside the timings
+    return results
+
+
+def bench_get_stats(ctx):
+    web_app = _web_app(ctx)
+    client = web_app.app.test_client()
+
+    def run():
+        response = client.get('/api/stats')
+        if response.status_code != 200:
+            raise RuntimeError(f"get_stats returned {response.status_code}")
+
+    timings, _ = timed(run, max(ctx['repeat'], 20))
+    return summarize(timings)
+
+
+def bench_medicare(ctx):
+    path = os.path.join(ctx['tmp'], 'medicare.db')
+    shutil.copy(ctx['rates_db'], path)
+    conn = sqlite3.connect(path)
+    try:
+        timings, written = timed(lambda: medicare_rates.materialize(conn, force=True), ctx['repeat'])
+    finally:
+        conn.close()
+    result = summarize(timings)
+    rows = sum(written.values())
+    result.update(rows=rows, rows_per_s=rows / result['median_s'])
+    return result
+
+
+BENCHMARKS = {
+    'create_db': bench_create_db,
+    'import_row': bench_import_row,
+    'import_bulk': bench_import_bulk,
+    'schema_queries': bench_schema_queries,
+    'get_rates': bench_get_rates,
+    'get_stats': bench_get_stats,
+    'medicare': bench_medicare,
+}
+
+
+def _medians(results, prefix=''):
+    """Flatten every median_s in a results tree to {'name.sub': seconds}"""
+    medians = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            if 'median_s' in value:
+                medians[prefix + name] = value['median_s']
+            else:
+                medians.update(_medians(value, f"{prefix}{name}."))
+    return medians
+
+
+def compare(results, baseline, tolerance):
+    """Print median changes against a baseline run; returns the names that regressed"""
+    current, previous = _medians(results), _medians(baseline['results'])
+    regressions = []
+    for name in sorted(current):
+        if name not in previous:
+            continue
+        change = current[name] / previous[name] - 1 if previous[name] else 0.0
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f"{name:<45} {previous[name] * 1000:10.3f} ms -> {current[name] * 1000:10.3f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark suite and write machine-readable results')
+    parser.add_argument('--data', help='Data directory to reuse or create (default: a temporary directory)')
+    parser.add_argument('--scale', choices=sorted(synthetic_data.SCALES), default='small', help='Data set size')
+    parser.add_argument('--seed', type=int, default=7, help='Data set and sampling seed')
+    parser.add_argument('--regenerate', action='store_true', help='Rebuild --data even if it already exists')
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS), help='Run only this benchmark (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each whole-operation benchmark')
+    parser.add_argument('--samples', type=int, default=200, help='Sampled keys for per-request benchmarks')
+    parser.add_argument('--output', help='Results JSON path (default: benchmarks/results/<timestamp>.json)')
+    parser.add_argument('--baseline', help='Earlier results JSON to compare medians against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed median slowdown vs baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = args.data or os.path.join(tmp, 'data')
+        params_path = os.path.join(data, 'params.json')
+        if args.regenerate or not os.path.exists(params_path):
+            params = synthetic_data.generate(data, args.scale, args.seed)
+            with open(params_path, 'w') as f:
+                json.dump(params, f, indent=2)
+        else:
+            with open(params_path) as f:
+                params = json.load(f)
+            print(f"Reusing {params['scale']} data set in {data}")
+
+        empty_db = os.path.join(tmp, 'empty.db')
+        with redirect_stdout(StringIO()):
+            create_database(empty_db)
+        ctx = {
+            'data': data, 'tmp': tmp, 'params': params, 'repeat': args.repeat, 'samples': args.samples,
+            'rates_db': os.path.join(data, 'rates.db'), 'app_db': os.path.join(data, 'app.db'),
+            'empty_db': empty_db,
+        }
+
+        results = {}
+        for name in args.only or BENCHMARKS:
+            start = time.perf_counter()
+            results[name] = BENCHMARKS[name](ctx)
+            print(f"{name:<16} done in {time.perf_counter() - start:8.2f} s")
+        if 'app' in ctx:
+            ctx['app'].access_counter.shutdown()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_commit': _git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'data': params,
+            'repeat': args.repeat,
+            'samples': args.samples,
+        },
+        'results': results,
+    }
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results', f"{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than baseline by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
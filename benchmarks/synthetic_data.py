@@ -0,0 +1,300 @@
+"""Deterministic synthetic data for the benchmark suite
+
+Builds, for a given scale and seed:
+  - drop-folder CSVs in the import_data_wcfs format, one per state and
+    schedule type (db_import_<type>_<ST>.csv), with statewide and county rates
+  - a rates database (create_db.py schema) with those schedules imported,
+    ZIP codes, ZIP-to-region and ZIP-to-locality maps and CMS RVU/GPCI inputs
+  - a web app database (models.py schema) with CachedRate rows for hot keys
+    and a Zipf-distributed rate_query history, plus its rollups
+
+The same scale and seed always produce the same rows.
+
+Usage:
+    python benchmarks/synthetic_data.py --out /tmp/bench-data --scale full
+    python benchmarks/synthetic_data.py --out /tmp/bench-data --states 10 --rate-queries 2000000
+"""
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from io import StringIO
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'utils'))
+sys.path.insert(0, os.path.join(ROOT, 'builder_scripts'))
+sys.path.insert(0, os.path.join(ROOT, 'web'))
+
+from create_db import create_database  # noqa: E402
+from import_data_wcfs import import_file_to_database_bulk  # noqa: E402
+from reference_ingest import ensure_tables as ensure_reference_tables  # noqa: E402
+
+STATES = [
+    'AL', 'AK', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'HI', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY',
+    'LA', 'ME', 'MD', 'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND',
+    'OH', 'OK', 'OR', 'PA', 'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY',
+]
+
+# Schedule files split CPT codes by section, like the real state drop files
+SCHEDULE_TYPES = [
+    ('anesthesia', 100, 1999),
+    ('surgery', 2000, 69999),
+    ('radiology', 70000, 79999),
+    ('pathology', 80000, 89999),
+    ('general_medicine', 90000, 99199),
+    ('evaluation_and_management', 99200, 99499),
+]
+# Sections priced with professional/technical component modifiers
+COMPONENT_SECTIONS = {'radiology', 'pathology'}
+
+SCALES = {
+    'small': dict(states=5, codes=2000, regions=5, zips_per_state=100, rate_queries=100_000,
+                  cached_keys=500, rows_per_key=10),
+    'medium': dict(states=20, codes=6000, regions=10, zips_per_state=400, rate_queries=1_000_000,
+                   cached_keys=5000, rows_per_key=20),
+    'full': dict(states=50, codes=10000, regions=20, zips_per_state=800, rate_queries=5_000_000,
+                 cached_keys=20000, rows_per_key=20),
+}
+
+MEDICARE_YEAR = 2025
+CONVERSION_FACTOR = 32.7442
+ZIP_BLOCK = 1900  # ZIPs reserved per state: state i owns 01000 + i * 1900 onwards
+
+
+def procedure_codes(count):
+    """`count` five-digit codes spread evenly over the CPT range"""
+    values = np.unique(np.linspace(100, 99499, count).astype(int))
+    return [f"{value:05d}" for value in values]
+
+
+def schedule_type(code):
+    number = int(code)
+    for name, low, high in SCHEDULE_TYPES:
+        if low <= number <= high:
+            return name
+    return 'general_medicine'
+
+
+def state_zips(state_index, count):
+    start = 1000 + state_index * ZIP_BLOCK
+    return [f"{start + i:05d}" for i in range(min(count, ZIP_BLOCK))]
+
+
+def write_drop_folder(folder, states, codes, regions, regional_share=0.2, seed=7):
+    """Write one CSV per (state, schedule type); returns the file paths"""
+    os.makedirs(folder, exist_ok=True)
+    by_type = {}
+    for code in codes:
+        by_type.setdefault(schedule_type(code), []).append(code)
+
+    paths = []
+    for state_index, state in enumerate(states):
+        rng = np.random.default_rng([seed, state_index])
+        counties = [f"county_{i:02d}" for i in range(regions)]
+        for name, type_codes in by_type.items():
+            path = os.path.join(folder, f"db_import_{name}_{state}.csv")
+            modifiers = ['', '26', 'TC'] if name in COMPONENT_SECTIONS else ['']
+            base_rates = rng.uniform(15, 2500, len(type_codes))
+            regional = rng.random(len(type_codes)) < regional_share
+            by_report = rng.random(len(type_codes)) < 0.02
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['proc_cd', 'modifier', 'description', 'rate', 'rate_unit',
+                                 'is_by_report', 'region_type', 'region_value'])
+                for i, code in enumerate(type_codes):
+                    areas = [('county', county) for county in counties] if regional[i] and counties else [('state', state)]
+                    for modifier in modifiers:
+                        share = {'': 1.0, '26': 0.4, 'TC': 0.6}[modifier]
+                        for area_index, (region_type, region_value) in enumerate(areas):
+                            rate = base_rates[i] * share * (1 + 0.03 * area_index)
+                            writer.writerow([
+                                code, modifier, f"SYNTHETIC {name.upper()} {code}",
+                                '' if by_report[i] else f"{rate:.2f}", 1,
+                                'True' if by_report[i] else 'False', region_type, region_value,
+                            ])
+            paths.append(path)
+    return paths
+
+
+def build_rates_database(path, drop_files, states, codes, zips_per_state, seed=7):
+    """create_db.py schema with the drop files imported and ZIP/Medicare reference data"""
+    with redirect_stdout(StringIO()):
+        create_database(path)
+    conn = sqlite3.connect(path)
+    with redirect_stdout(StringIO()):
+        for drop_file in drop_files:
+            if not import_file_to_database_bulk(conn, drop_file):
+                raise RuntimeError(f"Import failed: {drop_file}")
+        ensure_reference_tables(conn)
+
+    rng = np.random.default_rng(seed)
+    zip_rows, region_rows, locality_rows, gpci_rows = [], [], [], []
+    for state_index, state in enumerate(states):
+        zips = state_zips(state_index, zips_per_state)
+        region_ids = [row[0] for row in conn.execute(
+            "SELECT region_id FROM region WHERE state_code = ? AND region_type = 'county' ORDER BY region_code", (state,)
+        )]
+        carrier = f"{10000 + state_index * 100:05d}"
+        localities = [f"{i + 1:02d}" for i in range(1 + state_index % 4)]
+        for locality in localities:
+            gpci_rows.append((carrier, state, locality, MEDICARE_YEAR, *np.round(rng.uniform(0.85, 1.25, 3), 3),
+                              f"{state} LOCALITY {locality}"))
+        for i, zip_code in enumerate(zips):
+            zip_rows.append((zip_code, f"CITY {zip_code}", state, f"county_{i % max(len(region_ids), 1):02d}"))
+            if region_ids:
+                region_rows.append((zip_code, region_ids[i % len(region_ids)]))
+            locality_rows.append((zip_code, state, carrier, localities[i % len(localities)], f"{MEDICARE_YEAR}1"))
+
+    conn.executemany("INSERT INTO zip_code (zip_code, city, state_code, county) VALUES (?, ?, ?, ?)", zip_rows)
+    conn.executemany("INSERT INTO zip_region_map (zip_code, region_id) VALUES (?, ?)", region_rows)
+    conn.executemany(
+        "INSERT INTO medicare_locality_map (zip_code, state_code, carrier_code, locality_code, year_qtr) VALUES (?, ?, ?, ?, ?)",
+        locality_rows
+    )
+    conn.executemany(
+        "INSERT INTO cms_gpci (mac_code, state, locality_code, year, work_gpci, pe_gpci, mp_gpci, locality_name) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", gpci_rows
+    )
+
+    rvu_rows = []
+    for code in codes:
+        work, pe, mp = np.round(rng.uniform(0.1, 20, 3) * [1, 1.2, 0.1], 2)
+        modifiers = [None, '26', 'TC'] if schedule_type(code) in COMPONENT_SECTIONS else [None]
+        for modifier in modifiers:
+            rvu_rows.append((code, MEDICARE_YEAR, work, pe, mp, pe * 0.6, work + pe + mp, modifier))
+    conn.executemany(
+        "INSERT INTO cms_rvu (procedure_code, year, work_rvu, practice_expense_rvu, malpractice_rvu, "
+        "facility_pe_rvu, total_rvu, modifier) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rvu_rows
+    )
+    conn.execute(
+        "INSERT INTO cms_conversion_factor (year, conversion_factor, effective_date) VALUES (?, ?, ?)",
+        (MEDICARE_YEAR, CONVERSION_FACTOR, f"{MEDICARE_YEAR}-01-01")
+    )
+    conn.commit()
+    conn.close()
+
+
+def hot_keys(states, codes, count, seed=7):
+    """The `count` (state, procedure_code) keys the app cache holds, most popular first"""
+    rng = np.random.default_rng(seed)
+    count = min(count, len(states) * len(codes))
+    flat = rng.choice(len(states) * len(codes), size=count, replace=False)
+    return [(states[i // len(codes)], codes[i % len(codes)]) for i in flat]
+
+
+def build_app_database(path, keys, rows_per_key, rate_queries, seed=7):
+    """models.py schema with CachedRate rows for `keys` and a Zipf rate_query history"""
+    from flask import Flask
+    from models import db
+    import rollups
+
+    if os.path.exists(path):
+        os.remove(path)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.abspath(path)}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    rng = np.random.default_rng(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    # Loading millions of rows is several times faster with the indexes built afterwards
+    indexes = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'rate_query' AND sql IS NOT NULL"
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    cached = []
+    for state, code in keys:
+        rates = np.round(rng.uniform(20, 900, rows_per_key), 2)
+        for i, rate in enumerate(rates):
+            cached.append((state, code, f"Provider {i:04d}", float(rate),
+                           (now - timedelta(days=int(i * 7))).strftime('%Y-%m-%d'),
+                           now.strftime('%Y-%m-%d %H:%M:%S.%f'), 0, now.strftime('%Y-%m-%d %H:%M:%S.%f')))
+    conn.executemany(
+        "INSERT INTO cached_rate (state, procedure_code, provider, rate, effective_date, last_updated, "
+        "access_count, last_accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", cached
+    )
+
+    # Zipf popularity over the hot keys, spread over the last 90 days
+    batch = 200_000
+    start = np.datetime64(now - timedelta(days=90), 'us')
+    key_states = np.array([state for state, _ in keys], dtype=object)
+    key_codes = np.array([code for _, code in keys], dtype=object)
+    for offset in range(0, rate_queries, batch):
+        size = min(batch, rate_queries - offset)
+        picks = np.minimum(rng.zipf(1.3, size) - 1, len(keys) - 1)
+        seconds = rng.integers(0, 90 * 86400, size).astype('timedelta64[s]')
+        # SQLAlchemy's SQLite DateTime storage format
+        dates = np.char.replace(np.datetime_as_string(start + seconds, unit='us'), 'T', ' ')
+        hits = (rng.random(size) < 0.8).tolist()
+        conn.executemany(
+            "INSERT INTO rate_query (state, procedure_code, query_date, result_count, cache_hit) VALUES (?, ?, ?, ?, ?)",
+            zip(key_states[picks], key_codes[picks], dates.tolist(), [rows_per_key] * size, hits)
+        )
+    for _, sql in indexes:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+    with app.app_context():
+        rollups.rebuild_rollups()
+
+
+def generate(out, scale='small', seed=7, **overrides):
+    """Write drop/, rates.db and app.db under `out`; returns the parameters used"""
+    params = dict(SCALES[scale], **{key: value for key, value in overrides.items() if value is not None})
+    params['states'] = min(params['states'], len(STATES))
+    states = STATES[:params['states']]
+    codes = procedure_codes(params['codes'])
+    os.makedirs(out, exist_ok=True)
+
+    timings = {}
+    start = time.perf_counter()
+    drop_files = write_drop_folder(os.path.join(out, 'drop'), states, codes, params['regions'], seed=seed)
+    timings['drop_folder'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    build_rates_database(os.path.join(out, 'rates.db'), drop_files, states, codes, params['zips_per_state'], seed)
+    timings['rates_db'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    keys = hot_keys(states, codes, params['cached_keys'], seed)
+    build_app_database(os.path.join(out, 'app.db'), keys, params['rows_per_key'], params['rate_queries'], seed)
+    timings['app_db'] = time.perf_counter() - start
+
+    for label, elapsed in timings.items():
+        print(f"Generated {label:<12} in {elapsed:8.2f} s")
+    return dict(params, scale=scale, seed=seed, state_codes=states, drop_files=len(drop_files))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate deterministic synthetic benchmark data')
+    parser.add_argument('--out', required=True, help='Directory for drop/, rates.db and app.db')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='Preset sizes (overridable below)')
+    parser.add_argument('--seed', type=int, default=7, help='Random seed')
+    parser.add_argument('--states', type=int, help='Number of states (max 50)')
+    parser.add_argument('--codes', type=int, help='Procedure codes per state')
+    parser.add_argument('--regions', type=int, help='County regions per state')
+    parser.add_argument('--zips-per-state', type=int, help=f'ZIP codes per state (max {ZIP_BLOCK})')
+    parser.add_argument('--rate-queries', type=int, help='rate_query history rows')
+    parser.add_argument('--cached-keys', type=int, help='(state, procedure_code) keys in cached_rate')
+    parser.add_argument('--rows-per-key', type=int, help='cached_rate rows per key')
+    args = parser.parse_args()
+
+    generate(args.out, args.scale, args.seed, states=args.states, codes=args.codes, regions=args.regions,
+             zips_per_state=args.zips_per_state, rate_queries=args.rate_queries,
+             cached_keys=args.cached_keys, rows_per_key=args.rows_per_key)
+
+
+if __name__ == '__main__':
+    main()
@@ -79,6 +79,9 @@ def create_database(db_path=r'C:\Users\ChristopherCato\OneDrive - clarity-dx.com
         expiration_date DATE,
         conversion_factor DECIMAL(10,4),
         notes TEXT,
+        status VARCHAR(20) DEFAULT 'published',
+        published_at TIMESTAMP,
+        replaces_id INTEGER,
         FOREIGN KEY (state_code) REFERENCES state(state_code)
     )
     ''')
@@ -145,6 +148,9 @@ def create_database(db_path=r'C:\Users\ChristopherCato\OneDrive - clarity-dx.com
         effective_date DATE NOT NULL,
         expiration_date DATE,
         last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        year INTEGER,
+        carrier_code VARCHAR(10),
+        facility_rate DECIMAL(10,2),
         FOREIGN KEY (procedure_code) REFERENCES procedure_code(procedure_code)
     )
     ''')
@@ -188,11 +194,23 @@ def create_database(db_path=r'C:\Users\ChristopherCato\OneDrive - clarity-dx.com
     cursor.execute('CREATE INDEX idx_zip_state ON zip_code(state_code)')
     cursor.execute('CREATE INDEX idx_region_state ON region(state_code)')
     cursor.execute('CREATE INDEX idx_fee_schedule_state ON fee_schedule(state_code)')
+    cursor.execute('CREATE INDEX idx_fee_schedule_status ON fee_schedule(state_code, schedule_type, status)')
     cursor.execute('CREATE INDEX idx_fee_schedule_rate_proc ON fee_schedule_rate(procedure_code)')
     cursor.execute('CREATE INDEX idx_fee_schedule_rate_region ON fee_schedule_rate(region_id)')
+    cursor.execute("CREATE UNIQUE INDEX idx_fee_schedule_rate_key ON fee_schedule_rate(fee_schedule_id, procedure_code, IFNULL(modifier, ''), IFNULL(region_id, 0))")
+    cursor.execute('CREATE INDEX idx_medicare_rate_year ON medicare_rate(year)')
+    cursor.execute('CREATE INDEX idx_medicare_rate_lookup ON medicare_rate(procedure_code, locality_code, year)')
     cursor.execute('CREATE INDEX idx_query_state_procedure ON rate_query(state, procedure_code)')
     cursor.execute('CREATE INDEX idx_query_date ON rate_query(query_date)')
     
+    # Rates of the published version of each fee schedule (see import_data_wcfs shadow imports)
+    cursor.execute('''
+    CREATE VIEW published_fee_schedule_rate AS
+    SELECT r.*, f.state_code, f.schedule_type
+    FROM fee_schedule_rate r JOIN fee_schedule f ON f.id = r.fee_schedule_id
+    WHERE f.status = 'published'
+    ''')
+    
     # Add sample data for Georgia
     cursor.execute('''
     INSERT INTO state (state_code, state_name, effective_date, has_regions, data_source) 
@@ -0,0 +1,341 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from import_data_wcfs import ensure_schedule_versioning
+from state_partitions import read_partitions
+
+# --- CONFIGURATION ---
+db_path = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db"
+
+# File layout: MAGIC, uint32 header length, JSON header, then each array at a 64-byte aligned offset.
+# web/fee_snapshot.py memory-maps the file; keep the two in step (bump the magic on format changes).
+MAGIC = b"FEESNAP2"
+ALIGN = 64
+
+# Key fields, most significant first; the packed uint64 key sorts rows by (state, schedule, code, modifier, region)
+KEY_FIELDS = ["state", "schedule", "code", "modifier", "region"]
+MEDICARE_KEY_FIELDS = ["code", "modifier", "locality"]
+
+# Fee schedule versions that were in force at some point; rolled back and failed ones never were.
+# History only goes back as far as shadow imports: in-place imports overwrite the published version.
+VERSION_STATUSES = ("published", "superseded", "archived")
+
+# Versions are packed as (key run << 32 | valid_from day + DAY_OFFSET) so one uint64 sorts by (key, date)
+DAY_OFFSET = 1 << 31
+
+WC_ROW_DTYPE = [
+    ("state", "u1"), ("schedule", "u1"), ("code", "<u4"), ("modifier", "<u2"), ("region", "<u4"),
+    ("rate", "<f8"), ("rate_unit", "<u2"), ("is_by_report", "?"), ("effective_date", "<M8[D]"),
+    ("valid_from", "<M8[D]"), ("valid_to", "<M8[D]"), ("fee_schedule_id", "<i8"),
+]
+MEDICARE_ROW_DTYPE = [
+    ("code", "<u4"), ("modifier", "<u2"), ("locality", "<u4"), ("rate", "<f8"), ("facility_rate", "<f8"),
+    ("year", "<i2"), ("valid_from", "<M8[D]"), ("valid_to", "<M8[D]"),
+]
+
+
+def log_message(message):
+    """Print a timestamped log message"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+
+def default_snapshot_path(conn):
+    """compensation_rates.db -> compensation_rates.fees, next to the main database file"""
+    main_file = next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+    if not main_file:
+        raise ValueError("An in-memory database needs an explicit snapshot path")
+    return os.path.splitext(main_file)[0] + ".fees"
+
+
+def _bits(count):
+    return max(1, (count - 1).bit_length())
+
+
+def _table(*columns, always=None):
+    """Sorted unique values of the columns, so ids sort like the values themselves
+
+    `always` (the smallest possible value) is kept as id 0 even if no row uses it.
+    """
+    values = pd.unique(pd.concat([pd.Series(column) for column in columns], ignore_index=True))
+    table = np.sort(np.asarray(values[pd.notna(values)]))
+    if always is not None and (len(table) == 0 or table[0] != always):
+        table = np.concatenate([np.asarray([always], dtype=table.dtype), table])
+    return table
+
+
+def _ids(column, table):
+    return pd.Categorical(column, categories=table).codes.astype(np.int64)
+
+
+def _pack(columns, bits):
+    keys = np.zeros(len(columns[0][1]), dtype=np.uint64)
+    for field, ids in columns:
+        keys = (keys << np.uint64(bits[field])) | ids.astype(np.uint64)
+    return keys
+
+
+def _days(dates):
+    return pd.to_datetime(dates, errors="coerce").to_numpy().astype("datetime64[D]")
+
+
+def _versioned(keys, valid_from, precedence):
+    """Sort rows by (key, valid_from), keeping the highest-precedence row of each pair
+
+    Returns (row order, sorted distinct keys, packed (key run, valid_from) per row).
+    """
+    days = valid_from.astype(np.int64) + DAY_OFFSET
+    order = np.lexsort((precedence, days, keys))
+    sorted_keys, sorted_days = keys[order], days[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (sorted_keys[1:] != sorted_keys[:-1]) | (sorted_days[1:] != sorted_days[:-1])
+    order, sorted_keys, sorted_days = order[last], sorted_keys[last], sorted_days[last]
+
+    starts = np.ones(len(sorted_keys), dtype=bool)
+    starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    runs = np.cumsum(starts) - 1
+    versions = (runs.astype(np.uint64) << np.uint64(32)) | sorted_days.astype(np.uint64)
+    return order, sorted_keys[starts], versions
+
+
+def read_schedule_versions(conn):
+    """When each fee schedule version was in force: id -> [valid_from, valid_to), plus a precedence rank
+
+    A version runs from its effective_date until the next version of the same
+    state and schedule type takes effect, or until the day after its
+    expiration_date. Of versions taking effect on the same day, the
+    published one (else the most recently published) wins.
+    """
+    ensure_schedule_versioning(conn.cursor())
+    conn.commit()
+    sql = f"""
+        SELECT id AS fee_schedule_id, state_code, schedule_type, effective_date, expiration_date,
+               status = 'published' AS is_published, IFNULL(published_at, '') AS published_at
+        FROM fee_schedule
+        WHERE status IN ({', '.join('?' * len(VERSION_STATUSES))}) AND state_code IS NOT NULL
+    """
+    # States split out by state_partitions.py live in their own files
+    versions = pd.concat([pd.read_sql_query(sql, conn, params=VERSION_STATUSES)]
+                         + read_partitions(conn, sql, VERSION_STATUSES), ignore_index=True)
+    versions["start"] = _days(versions["effective_date"])
+    versions = versions[~np.isnat(versions["start"].to_numpy())]
+    versions = versions.sort_values(
+        ["state_code", "schedule_type", "start", "is_published", "published_at", "fee_schedule_id"]
+    )
+    versions = versions.drop_duplicates(["state_code", "schedule_type", "start"], keep="last").copy()
+    versions["rank"] = np.arange(len(versions))
+
+    next_start = versions.groupby(["state_code", "schedule_type"])["start"].shift(-1).to_numpy().astype("datetime64[D]")
+    expires = _days(versions["expiration_date"]) + np.timedelta64(1, "D")
+    # NaT means open-ended; the earlier of the two ends applies
+    valid_to = np.where(np.isnat(next_start) | (~np.isnat(expires) & (expires < next_start)), expires, next_start)
+    versions["valid_to"] = valid_to.astype("datetime64[D]")
+    return versions
+
+
+def read_wc_rates(conn, versions):
+    """Every rate of every version in force at some point, with the interval it applied for"""
+    sql = f"""
+        SELECT r.fee_schedule_id, r.procedure_code, IFNULL(r.modifier, '') AS modifier,
+               IFNULL(r.region_id, 0) AS region_id, r.rate, IFNULL(r.rate_unit, '') AS rate_unit,
+               IFNULL(r.is_by_report, 0) AS is_by_report, r.effective_date
+        FROM fee_schedule_rate r JOIN fee_schedule f ON f.id = r.fee_schedule_id
+        WHERE f.status IN ({', '.join('?' * len(VERSION_STATUSES))}) AND r.procedure_code IS NOT NULL
+    """
+    frame = pd.concat([pd.read_sql_query(sql, conn, params=VERSION_STATUSES)]
+                      + read_partitions(conn, sql, VERSION_STATUSES), ignore_index=True)
+    frame = frame.merge(
+        versions[["fee_schedule_id", "state_code", "schedule_type", "is_published", "start", "valid_to", "rank"]],
+        on="fee_schedule_id"
+    )
+    frame["rate"] = pd.to_numeric(frame["rate"], errors="coerce")
+    frame["effective_date"] = _days(frame["effective_date"])
+    # A rate never applies before its own effective date, even inside its version
+    start = frame["start"].to_numpy().astype("datetime64[D]")
+    effective = frame["effective_date"].to_numpy()
+    frame["valid_from"] = np.where(~np.isnat(effective) & (effective > start), effective, start)
+    return frame
+
+
+def read_medicare_rates(conn):
+    """All loaded Medicare years; each rate applies from effective_date through expiration_date"""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "medicare_rate" not in tables:
+        return pd.DataFrame(columns=["procedure_code", "modifier", "locality", "rate", "facility_rate",
+                                     "year", "valid_from", "valid_to", "id"])
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(medicare_rate)")}
+    carrier = "IFNULL(carrier_code, '')" if "carrier_code" in columns else "''"
+    facility = "facility_rate" if "facility_rate" in columns else "NULL"
+    year = "year" if "year" in columns else "NULL"
+    frame = pd.read_sql_query(f"""
+        SELECT procedure_code, IFNULL(modifier, '') AS modifier, {carrier} || char(9) || locality_code AS locality,
+               rate, {facility} AS facility_rate, {year} AS year, effective_date, expiration_date, id
+        FROM medicare_rate
+        WHERE procedure_code IS NOT NULL AND locality_code IS NOT NULL
+    """, conn)
+    frame["rate"] = pd.to_numeric(frame["rate"], errors="coerce")
+    frame["facility_rate"] = pd.to_numeric(frame["facility_rate"], errors="coerce")
+    frame["valid_from"] = _days(frame["effective_date"])
+    frame["valid_to"] = _days(frame["expiration_date"]) + np.timedelta64(1, "D")
+    return frame[~np.isnat(frame["valid_from"].to_numpy())]
+
+
+def build_arrays(wc, medicare):
+    """Intern the key columns and lay out the sorted key, version and row arrays; returns (header, {name: array})"""
+    states = _table(wc["state_code"].astype(str))
+    schedules = _table(wc["schedule_type"].astype(str))
+    codes = _table(wc["procedure_code"].astype(str), medicare["procedure_code"].astype(str))
+    # '' (no modifier) and region 0 (statewide) always exist, so they are id 0
+    modifiers = _table(wc["modifier"].astype(str), medicare["modifier"].astype(str), always="")
+    regions = _table(wc["region_id"].astype(np.int64), always=0)
+    localities = _table(medicare["locality"].astype(str))
+    rate_units = _table(wc["rate_unit"].astype(str), always="")
+
+    bits = {field: _bits(len(table)) for field, table in zip(KEY_FIELDS, [states, schedules, codes, modifiers, regions])}
+    bits["locality"] = _bits(len(localities))
+    if (sum(bits[field] for field in KEY_FIELDS) > 64 or bits["state"] > 8 or bits["schedule"] > 8
+            or bits["modifier"] > 16 or len(rate_units) > 1 << 16):
+        raise ValueError(f"Too many distinct key values for the snapshot layout: {bits}")
+
+    # --- Workers' comp: every version, plus an index of the published rows ---
+    wc_ids = {
+        "state": _ids(wc["state_code"].astype(str), states),
+        "schedule": _ids(wc["schedule_type"].astype(str), schedules),
+        "code": _ids(wc["procedure_code"].astype(str), codes),
+        "modifier": _ids(wc["modifier"].astype(str), modifiers),
+        "region": _ids(wc["region_id"].astype(np.int64), regions),
+    }
+    wc_row_keys = _pack([(field, wc_ids[field]) for field in KEY_FIELDS], bits)
+    order, wc_keys, wc_versions = _versioned(
+        wc_row_keys, wc["valid_from"].to_numpy().astype("datetime64[D]"), wc["rank"].to_numpy()
+    )
+    wc_rows = np.zeros(len(order), dtype=WC_ROW_DTYPE)
+    for field in KEY_FIELDS:
+        wc_rows[field] = wc_ids[field][order]
+    wc_rows["rate"] = wc["rate"].to_numpy(dtype=np.float64)[order]
+    wc_rows["rate_unit"] = _ids(wc["rate_unit"].astype(str), rate_units)[order]
+    wc_rows["is_by_report"] = wc["is_by_report"].to_numpy()[order] != 0
+    for field in ("effective_date", "valid_from", "valid_to"):
+        wc_rows[field] = wc[field].to_numpy().astype("datetime64[D]")[order]
+    wc_rows["fee_schedule_id"] = wc["fee_schedule_id"].to_numpy(dtype=np.int64)[order]
+
+    # Rows are in (key, valid_from) order, so the published rows are already sorted by key;
+    # a key published twice (legacy duplicate schedules) keeps the one that took effect last
+    published = np.flatnonzero(wc["is_published"].to_numpy()[order] != 0)
+    published_keys = wc_row_keys[order][published]
+    last = np.ones(len(published), dtype=bool)
+    last[:-1] = published_keys[1:] != published_keys[:-1]
+    published, published_keys = published[last], published_keys[last]
+
+    # --- Medicare: every loaded year ---
+    medicare_ids = {
+        "code": _ids(medicare["procedure_code"].astype(str), codes),
+        "modifier": _ids(medicare["modifier"].astype(str), modifiers),
+        "locality": _ids(medicare["locality"].astype(str), localities),
+    }
+    medicare_order, medicare_keys, medicare_versions = _versioned(
+        _pack([(field, medicare_ids[field]) for field in MEDICARE_KEY_FIELDS], bits),
+        medicare["valid_from"].to_numpy().astype("datetime64[D]"),
+        medicare["id"].to_numpy(dtype=np.int64)
+    )
+    medicare_rows = np.zeros(len(medicare_order), dtype=MEDICARE_ROW_DTYPE)
+    for field in MEDICARE_KEY_FIELDS:
+        medicare_rows[field] = medicare_ids[field][medicare_order]
+    medicare_rows["rate"] = medicare["rate"].to_numpy(dtype=np.float64)[medicare_order]
+    medicare_rows["facility_rate"] = medicare["facility_rate"].to_numpy(dtype=np.float64)[medicare_order]
+    medicare_rows["year"] = pd.to_numeric(medicare["year"]).fillna(0).to_numpy(dtype=np.int64)[medicare_order]
+    for field in ("valid_from", "valid_to"):
+        medicare_rows[field] = medicare[field].to_numpy().astype("datetime64[D]")[medicare_order]
+
+    header = {
+        "states": [str(state) for state in states],
+        "schedules": [str(schedule) for schedule in schedules],
+        "rate_units": [str(unit) for unit in rate_units],
+        "bits": bits,
+        "rows": int(len(published)),
+        "wc_versions": int(len(wc_rows)),
+        "medicare_rows": int(len(medicare_rows)),
+    }
+    arrays = {
+        "keys": published_keys,
+        "published": published.astype("<u4"),
+        "wc_keys": wc_keys,
+        "wc_versions": wc_versions,
+        "wc_rows": wc_rows,
+        "medicare_keys": medicare_keys,
+        "medicare_versions": medicare_versions,
+        "medicare_rows": medicare_rows,
+        # Sorted tables stay in the file so lookups can binary-search them without a per-worker copy
+        "codes": np.char.encode(codes.astype(str), "utf-8"),
+        "modifiers": np.char.encode(modifiers.astype(str), "utf-8"),
+        "regions": regions.astype("<i8"),
+        "localities": np.char.encode(localities.astype(str), "utf-8"),
+    }
+    return header, arrays
+
+
+def write_snapshot_file(path, header, arrays):
+    """Write the snapshot next to path and rename it into place, so readers never see a partial file"""
+    header = dict(header, arrays={})
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGN) * ALIGN
+        header["arrays"][name] = {
+            "dtype": np.lib.format.dtype_to_descr(array.dtype),
+            "count": int(len(array)),
+            "offset": offset,
+        }
+        offset += array.nbytes
+    # Offsets are relative to the data section, which starts at the first aligned byte after the header
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = -(-(len(MAGIC) + 4 + len(header_bytes)) // ALIGN) * ALIGN
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(4, "little"))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(data_start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    # Workers that still map the old file keep reading it until they reopen
+    os.replace(temp_path, path)
+    return data_start + offset
+
+
+def build_snapshot(conn, path=None):
+    """Rebuild the fee schedule snapshot from the rates database; returns the snapshot path"""
+    path = path or default_snapshot_path(conn)
+    start = time.perf_counter()
+    wc = read_wc_rates(conn, read_schedule_versions(conn))
+    medicare = read_medicare_rates(conn)
+    header, arrays = build_arrays(wc, medicare)
+    header["built_at"] = datetime.utcnow().isoformat(timespec="seconds")
+    size = write_snapshot_file(path, header, arrays)
+    log_message(f"Wrote fee schedule snapshot {path}: {header['rows']} published rates, "
+                f"{header['wc_versions']} WC rate versions, {header['medicare_rows']} Medicare rates, "
+                f"{size / 1e6:.1f} MB in {time.perf_counter() - start:.2f}s")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the memory-mappable fee schedule snapshot the web app serves from")
+    parser.add_argument("--db", type=str, default=db_path, help="Path to the SQLite database file")
+    parser.add_argument("--output", type=str, default=None, help="Snapshot path (default: the database path with a .fees extension)")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        build_snapshot(conn, args.output)
+    finally:
+        conn.close()
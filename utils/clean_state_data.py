@@ -90,6 +90,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Delete all data for specified state codes from the database')
     parser.add_argument('--db', type=str, default=r'C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db', help='Path to the SQLite database file')
     parser.add_argument('--states', type=str, required=True, help='Comma-separated list of state codes to delete data for (e.g., GA,AL,LA)')
+    parser.add_argument('--partitioned', action='store_true', help='States live in per-state partition files (see state_partitions.py); purge the files instead')
     
     args = parser.parse_args()
     
@@ -97,4 +98,17 @@ if __name__ == "__main__":
     state_codes = [code.strip().upper() for code in args.states.split(',')]
     
     # Execute deletion
-    delete_state_data(args.db, state_codes)
\ No newline at end of file
+    if args.partitioned:
+        # Refuses states the shared database still holds, so a purge never leaves rates live
+        from state_partitions import default_partition_dir, publish_changes, purge_state
+        partition_dir = default_partition_dir(args.db)
+        for code in state_codes:
+            if not purge_state(args.db, partition_dir, code):
+                print(f"No partition for {code}")
+        publish_changes(args.db)
+    else:
+        delete_state_data(args.db, state_codes)
+        from state_partitions import default_partition_dir, list_partitions
+        partitioned = sorted(set(state_codes) & set(list_partitions(default_partition_dir(args.db))))
+        if partitioned:
+            print(f"{', '.join(partitioned)} also have partition files; purge them with --partitioned")
\ No newline at end of file
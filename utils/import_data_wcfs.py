@@ -1,9 +1,13 @@
 import os
 import csv
+import hashlib
 import sqlite3
 import time
 import glob
+import queue
+import re
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 # Configuration
@@ -12,10 +16,14 @@ PROCESSED_FOLDER = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensa
 ERROR_FOLDER = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\wcfs_drop\error_data"  # Folder for files that couldn't be processed
 DATABASE_FILE = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db"  # Path to your SQLite database
 
-# Create folders if they don't exist
-for folder in [TARGET_FOLDER, PROCESSED_FOLDER, ERROR_FOLDER]:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+# A schedule's effective date in its filename: wc_fee_2023-01-01_AL.csv
+EFFECTIVE_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+def ensure_folders():
+    """Create the drop, processed and error folders if they don't exist"""
+    for folder in [TARGET_FOLDER, PROCESSED_FOLDER, ERROR_FOLDER]:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
 
 def log_message(message):
     """Print a timestamped log message"""
@@ -23,7 +31,12 @@ def log_message(message):
     print(f"[{timestamp}] {message}")
 
 def parse_csv_filename(filename):
-    """Parse information from the filename, looking for _XX suffix for state code"""
+    """Parse information from the filename, looking for _XX suffix for state code
+
+    An optional _YYYY-MM-DD part just before the state code is the
+    schedule's effective date (see parse_effective_date), not part of the
+    schedule type.
+    """
     try:
         base = os.path.basename(filename)
         name_without_ext = os.path.splitext(base)[0]
@@ -38,6 +51,8 @@ def parse_csv_filename(filename):
                 state_code = potential_state_code
                 # Remove the state code from parts to get the schedule type
                 schedule_parts = parts[:-1]
+                if len(schedule_parts) > 1 and EFFECTIVE_DATE_PATTERN.fullmatch(schedule_parts[-1]):
+                    schedule_parts = schedule_parts[:-1]
                 # Skip 'import' if it's the first part
                 if schedule_parts[0].lower() == 'import':
                     schedule_parts = schedule_parts[1:]
@@ -54,8 +69,98 @@ def parse_csv_filename(filename):
         log_message(f"Error parsing filename {filename}: {str(e)}")
         return None, None
 
-def import_file_to_database(conn, filepath):
-    """Import data from a CSV file into the database"""
+def parse_effective_date(filename):
+    """The effective date in a name like wc_fee_2023-01-01_AL.csv, as YYYY-MM-DD, or None"""
+    parts = os.path.splitext(os.path.basename(filename))[0].split('_')
+    if len(parts) >= 3 and EFFECTIVE_DATE_PATTERN.fullmatch(parts[-2]):
+        try:
+            return datetime.strptime(parts[-2], "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            log_message(f"Ignoring invalid effective date {parts[-2]} in {os.path.basename(filename)}")
+    return None
+
+def resolve_effective_date(filepath, effective_date=None):
+    """The date a file's rates take effect: the one given, else the one in its name, else today"""
+    return effective_date or parse_effective_date(filepath) or datetime.now().strftime("%Y-%m-%d")
+
+def parse_rate_fields(row):
+    """Normalize the modifier, rate, rate_unit and is_by_report columns of a CSV row"""
+    modifier = (row.get('modifier') or '').strip() or None
+    rate = float(row.get('rate', 0)) if row.get('rate') else 0
+    rate_unit = int(row.get('rate_unit', 1)) if row.get('rate_unit') else 1
+    is_by_report = 1 if row.get('is_by_report') in ['True', 'true', '1', 'TRUE', 'T', 'Yes', 'yes', 'Y', 'y'] else 0
+    return modifier, rate, rate_unit, is_by_report
+
+def ensure_state(cursor, state_code):
+    """Create the state row if it doesn't exist"""
+    cursor.execute("SELECT 1 FROM state WHERE state_code = ?", (state_code,))
+    if not cursor.fetchone():
+        log_message(f"Adding new state: {state_code}")
+        cursor.execute(
+            "INSERT INTO state (state_code, state_name, effective_date) VALUES (?, ?, ?)",
+            (state_code, state_code, datetime.now().strftime("%Y-%m-%d"))
+        )
+
+def ensure_schedule_versioning(cursor):
+    """Add the fee_schedule version columns and the published-rates view if missing
+
+    Shadow imports write a new fee_schedule version with status 'building';
+    readers only see status 'published'. Versions replaced by a publish are
+    kept as 'superseded' for rollback, then 'archived' for as-of history.
+    """
+    cursor.execute("PRAGMA table_info(fee_schedule)")
+    columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in [("status", "VARCHAR(20) DEFAULT 'published'"), ("published_at", "TIMESTAMP"), ("replaces_id", "INTEGER")]:
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE fee_schedule ADD COLUMN {column} {column_type}")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fee_schedule_status ON fee_schedule(state_code, schedule_type, status)")
+    cursor.execute("""
+        CREATE VIEW IF NOT EXISTS published_fee_schedule_rate AS
+        SELECT r.*, f.state_code, f.schedule_type
+        FROM fee_schedule_rate r JOIN fee_schedule f ON f.id = r.fee_schedule_id
+        WHERE f.status = 'published'
+    """)
+
+def get_or_create_fee_schedule(cursor, state_code, schedule_type, effective_date=None):
+    """Return the active fee schedule ID for a state/schedule type, creating the state and schedule if needed"""
+    ensure_state(cursor, state_code)
+    ensure_schedule_versioning(cursor)
+    
+    # Check if fee schedule exists, create if not
+    cursor.execute(
+        "SELECT id FROM fee_schedule WHERE state_code = ? AND schedule_type = ? AND status = 'published' AND (expiration_date IS NULL OR expiration_date >= date('now')) ORDER BY id DESC",
+        (state_code, schedule_type)
+    )
+    fee_schedule_row = cursor.fetchone()
+    
+    if fee_schedule_row:
+        fee_schedule_id = fee_schedule_row[0]
+    else:
+        cursor.execute(
+            "INSERT INTO fee_schedule (state_code, schedule_type, effective_date) VALUES (?, ?, ?)",
+            (state_code, schedule_type, effective_date or datetime.now().strftime("%Y-%m-%d"))
+        )
+        fee_schedule_id = cursor.lastrowid
+        log_message(f"Created new fee schedule with ID {fee_schedule_id}")
+    
+    return fee_schedule_id
+
+def reset_import_manifest(cursor, fee_schedule_id):
+    """Forget the diff-import manifest for a schedule rewritten by a row or bulk import"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'import_file_manifest'")
+    if cursor.fetchone():
+        cursor.execute("DELETE FROM import_file_manifest WHERE fee_schedule_id = ?", (fee_schedule_id,))
+        cursor.execute("DELETE FROM import_row_manifest WHERE fee_schedule_id = ?", (fee_schedule_id,))
+
+def import_file_to_database(conn, filepath, fee_schedule_id=None, effective_date=None):
+    """Import data from a CSV file into the database
+
+    Rates go to the published schedule for the file's state and type, or to
+    fee_schedule_id when one is given (a shadow version being built).
+    Writing into the published schedule overwrites its rates, so the rates
+    they replace drop out of as-of history; only shadow imports keep it.
+    New rates take effect on effective_date (see resolve_effective_date).
+    """
     cursor = conn.cursor()
     
     # Parse state code and schedule type from filename
@@ -64,33 +169,12 @@ def import_file_to_database(conn, filepath):
         return False
     
     log_message(f"Processing file for state {state_code}, schedule type {schedule_type}")
+    effective_date = resolve_effective_date(filepath, effective_date)
     
     try:
-        # Check if state exists, create if not
-        cursor.execute("SELECT 1 FROM state WHERE state_code = ?", (state_code,))
-        if not cursor.fetchone():
-            log_message(f"Adding new state: {state_code}")
-            cursor.execute(
-                "INSERT INTO state (state_code, state_name, effective_date) VALUES (?, ?, ?)",
-                (state_code, state_code, datetime.now().strftime("%Y-%m-%d"))
-            )
-        
-        # Check if fee schedule exists, create if not
-        cursor.execute(
-            "SELECT id FROM fee_schedule WHERE state_code = ? AND schedule_type = ? AND (expiration_date IS NULL OR expiration_date >= date('now'))",
-            (state_code, schedule_type)
-        )
-        fee_schedule_row = cursor.fetchone()
-        
-        if fee_schedule_row:
-            fee_schedule_id = fee_schedule_row[0]
-        else:
-            cursor.execute(
-                "INSERT INTO fee_schedule (state_code, schedule_type, effective_date) VALUES (?, ?, ?)",
-                (state_code, schedule_type, datetime.now().strftime("%Y-%m-%d"))
-            )
-            fee_schedule_id = cursor.lastrowid
-            log_message(f"Created new fee schedule with ID {fee_schedule_id}")
+        if fee_schedule_id is None:
+            fee_schedule_id = get_or_create_fee_schedule(cursor, state_code, schedule_type, effective_date)
+        reset_import_manifest(cursor, fee_schedule_id)
         
         # Process the CSV file
         with open(filepath, 'r', encoding='utf-8') as csv_file:
@@ -130,10 +214,7 @@ def import_file_to_database(conn, filepath):
                         region_id = cursor.lastrowid
                 
                 # Insert or update the fee schedule rate
-                modifier = row.get('modifier', '').strip() or None
-                rate = float(row.get('rate', 0)) if row.get('rate') else 0
-                rate_unit = int(row.get('rate_unit', 1)) if row.get('rate_unit') else 1
-                is_by_report = 1 if row.get('is_by_report') in ['True', 'true', '1', 'TRUE', 'T', 'Yes', 'yes', 'Y', 'y'] else 0
+                modifier, rate, rate_unit, is_by_report = parse_rate_fields(row)
                 
                 # Check if rate entry already exists
                 cursor.execute(
@@ -163,9 +244,9 @@ def import_file_to_database(conn, filepath):
                         """
                         INSERT INTO fee_schedule_rate 
                         (fee_schedule_id, procedure_code, modifier, region_id, rate, rate_unit, is_by_report, effective_date)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, date('now'))
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                         """,
-                        (fee_schedule_id, proc_code, modifier, region_id, rate, rate_unit, is_by_report)
+                        (fee_schedule_id, proc_code, modifier, region_id, rate, rate_unit, is_by_report, effective_date)
                     )
                 
                 rows_processed += 1
@@ -185,9 +266,667 @@ def import_file_to_database(conn, filepath):
         log_message(f"Error processing file {filepath}: {str(e)}")
         return False
 
-def process_pending_files():
+STAGING_COLUMNS = [
+    'proc_cd', 'description', 'modifier', 'region_type', 'region_value',
+    'rate', 'rate_unit', 'is_by_report'
+]
+
+def ensure_rate_key_index(cursor):
+    """Create the NULL-safe unique index the bulk upsert uses as its conflict target
+
+    UNIQUE (fee_schedule_id, procedure_code, modifier, region_id) treats NULLs as
+    distinct, so it never fires for statewide rows or rows without a modifier.
+    This index covers the same key with NULLs folded to '' / 0.
+    """
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_fee_schedule_rate_key
+        ON fee_schedule_rate (fee_schedule_id, procedure_code, IFNULL(modifier, ''), IFNULL(region_id, 0))
+    """)
+
+def import_file_to_database_bulk(conn, filepath, fee_schedule_id=None, effective_date=None):
+    """Import a CSV file with set-based SQL through a temporary staging table
+
+    Produces the same procedure_code, region and fee_schedule_rate rows as
+    import_file_to_database, but resolves them with a handful of
+    INSERT ... ON CONFLICT statements in a single transaction. Like
+    import_file_to_database, an in-place import overwrites as-of history.
+    """
+    cursor = conn.cursor()
+    
+    # Parse state code and schedule type from filename
+    state_code, schedule_type = parse_csv_filename(filepath)
+    if not state_code or not schedule_type:
+        return False
+    
+    log_message(f"Bulk processing file for state {state_code}, schedule type {schedule_type}")
+    effective_date = resolve_effective_date(filepath, effective_date)
+    
+    try:
+        if fee_schedule_id is None:
+            fee_schedule_id = get_or_create_fee_schedule(cursor, state_code, schedule_type, effective_date)
+        ensure_rate_key_index(cursor)
+        reset_import_manifest(cursor, fee_schedule_id)
+        
+        # Load the file into a staging table; rowid keeps file order for "last row wins"
+        cursor.execute("DROP TABLE IF EXISTS temp.fs_staging")
+        cursor.execute("""
+            CREATE TEMP TABLE fs_staging (
+                proc_cd TEXT NOT NULL,
+                description TEXT,
+                modifier TEXT,
+                region_type TEXT,
+                region_value TEXT,
+                rate REAL,
+                rate_unit INTEGER,
+                is_by_report INTEGER,
+                region_id INTEGER
+            )
+        """)
+        with open(filepath, 'r', encoding='utf-8') as csv_file:
+            reader = csv.DictReader(csv_file)
+            staged_rows = []
+            for row in reader:
+                modifier, rate, rate_unit, is_by_report = parse_rate_fields(row)
+                region_type = row.get('region_type')
+                staged_rows.append((
+                    row['proc_cd'],
+                    row.get('description', ''),
+                    modifier,
+                    region_type if region_type and region_type != 'state' else None,
+                    row.get('region_value'),
+                    rate,
+                    rate_unit,
+                    is_by_report
+                ))
+        cursor.executemany(
+            f"INSERT INTO fs_staging ({', '.join(STAGING_COLUMNS)}) VALUES ({', '.join('?' * len(STAGING_COLUMNS))})",
+            staged_rows
+        )
+        rows_processed = len(staged_rows)
+        
+        # New procedure codes take the description of their first row in the file
+        cursor.execute("""
+            INSERT INTO procedure_code (procedure_code, description, code_type)
+            SELECT proc_cd, description, 'CPT' FROM fs_staging
+            WHERE rowid IN (SELECT MIN(rowid) FROM fs_staging GROUP BY proc_cd)
+            ORDER BY rowid
+            ON CONFLICT (procedure_code) DO NOTHING
+        """)
+        
+        # New regions, then resolve region_id for every staged row
+        cursor.execute("""
+            INSERT INTO region (state_code, region_type, region_code, region_name)
+            SELECT ?, region_type, region_value, ? || ' ' || region_type || ' ' || region_value
+            FROM fs_staging
+            WHERE region_type IS NOT NULL
+              AND rowid IN (SELECT MIN(rowid) FROM fs_staging WHERE region_type IS NOT NULL GROUP BY region_type, region_value)
+            ORDER BY rowid
+            ON CONFLICT (state_code, region_type, region_code) DO NOTHING
+        """, (state_code, state_code))
+        cursor.execute("""
+            UPDATE fs_staging SET region_id = (
+                SELECT r.region_id FROM region r
+                WHERE r.state_code = ? AND r.region_type = fs_staging.region_type AND r.region_code = fs_staging.region_value
+            )
+            WHERE region_type IS NOT NULL
+        """, (state_code,))
+        
+        # Upsert rates; later rows in the file overwrite earlier ones with the same key
+        cursor.execute("""
+            INSERT INTO fee_schedule_rate
+            (fee_schedule_id, procedure_code, modifier, region_id, rate, rate_unit, is_by_report, effective_date)
+            SELECT ?, proc_cd, modifier, region_id, rate, rate_unit, is_by_report, ?
+            FROM fs_staging
+            WHERE true
+            ORDER BY rowid
+            ON CONFLICT (fee_schedule_id, procedure_code, IFNULL(modifier, ''), IFNULL(region_id, 0)) DO UPDATE SET
+                rate = excluded.rate,
+                rate_unit = excluded.rate_unit,
+                is_by_report = excluded.is_by_report,
+                last_updated = CURRENT_TIMESTAMP
+        """, (fee_schedule_id, effective_date))
+        
+        cursor.execute("DROP TABLE temp.fs_staging")
+        conn.commit()
+        log_message(f"Successfully imported {rows_processed} rows from {filepath}")
+        return True
+        
+    except Exception as e:
+        conn.rollback()
+        log_message(f"Error processing file {filepath}: {str(e)}")
+        return False
+
+def ensure_manifest_tables(cursor):
+    """Create the import manifest and change log tables used by diff imports"""
+    cursor.executescript("""
+        CREATE TABLE IF NOT EXISTS import_file_manifest (
+            fee_schedule_id INTEGER PRIMARY KEY,
+            file_hash TEXT NOT NULL,
+            file_name TEXT,
+            row_count INTEGER,
+            imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (fee_schedule_id) REFERENCES fee_schedule(id)
+        );
+        
+        CREATE TABLE IF NOT EXISTS import_row_manifest (
+            fee_schedule_id INTEGER NOT NULL,
+            procedure_code VARCHAR(20) NOT NULL,
+            modifier_key VARCHAR(5) NOT NULL,   -- '' when modifier IS NULL
+            region_key INTEGER NOT NULL,        -- 0 when region_id IS NULL
+            row_hash TEXT NOT NULL,
+            PRIMARY KEY (fee_schedule_id, procedure_code, modifier_key, region_key)
+        );
+        
+        CREATE TABLE IF NOT EXISTS import_change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fee_schedule_id INTEGER NOT NULL,
+            state_code CHAR(2) NOT NULL,
+            procedure_code VARCHAR(20) NOT NULL,
+            modifier VARCHAR(5),
+            region_id INTEGER,
+            change_type VARCHAR(10) NOT NULL,   -- insert, update or delete
+            file_hash TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_change_log_state_procedure ON import_change_log(state_code, procedure_code);
+    """)
+
+def file_content_hash(filepath):
+    """SHA-256 of the raw file bytes"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def rate_row_hash(rate, rate_unit, is_by_report):
+    """Hash of the stored rate values, normalized so CSV rows and database rows compare equal"""
+    value = f"{float(rate or 0)!r}|{int(rate_unit or 1)}|{int(is_by_report or 0)}"
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+def _load_row_manifest(cursor, fee_schedule_id):
+    """Current row hashes for a schedule, seeded from fee_schedule_rate on first use"""
+    cursor.execute("SELECT 1 FROM import_file_manifest WHERE fee_schedule_id = ?", (fee_schedule_id,))
+    if not cursor.fetchone():
+        cursor.execute("DELETE FROM import_row_manifest WHERE fee_schedule_id = ?", (fee_schedule_id,))
+        cursor.execute(
+            "SELECT procedure_code, IFNULL(modifier, ''), IFNULL(region_id, 0), rate, rate_unit, is_by_report "
+            "FROM fee_schedule_rate WHERE fee_schedule_id = ?",
+            (fee_schedule_id,)
+        )
+        cursor.executemany(
+            "INSERT OR REPLACE INTO import_row_manifest "
+            "(fee_schedule_id, procedure_code, modifier_key, region_key, row_hash) VALUES (?, ?, ?, ?, ?)",
+            [(fee_schedule_id, code, modifier_key, region_key, rate_row_hash(rate, rate_unit, is_by_report))
+             for code, modifier_key, region_key, rate, rate_unit, is_by_report in cursor.fetchall()]
+        )
+    
+    cursor.execute(
+        "SELECT procedure_code, modifier_key, region_key, row_hash FROM import_row_manifest WHERE fee_schedule_id = ?",
+        (fee_schedule_id,)
+    )
+    return {(code, modifier_key, region_key): row_hash for code, modifier_key, region_key, row_hash in cursor.fetchall()}
+
+def _resolve_regions(cursor, state_code, region_pairs):
+    """Map (region_type, region_value) pairs to region IDs, creating missing regions"""
+    cursor.execute("SELECT region_type, region_code, region_id FROM region WHERE state_code = ?", (state_code,))
+    regions = {(region_type, region_code): region_id for region_type, region_code, region_id in cursor.fetchall()}
+    for region_type, region_value in region_pairs:
+        if (region_type, region_value) not in regions:
+            cursor.execute(
+                "INSERT INTO region (state_code, region_type, region_code, region_name) VALUES (?, ?, ?, ?)",
+                (state_code, region_type, region_value, f"{state_code} {region_type} {region_value}")
+            )
+            regions[(region_type, region_value)] = cursor.lastrowid
+    return regions
+
+# Returned instead of True by an import that found nothing to change; truthy, so it still counts as success
+IMPORT_UNCHANGED = 'unchanged'
+
+def import_file_to_database_diff(conn, filepath, effective_date=None):
+    """Import a CSV file by applying only the rows that changed since the last import
+
+    The file is treated as the full schedule: rows whose key (procedure_code,
+    modifier, region) is new are inserted, rows whose values changed are
+    updated, and tracked rows missing from the file are deleted. A file whose
+    content hash matches the last import for its schedule is skipped and
+    IMPORT_UNCHANGED is returned. Every change is written to import_change_log
+    for downstream cache invalidation. Updates and deletes are applied to the
+    published version in place, so the old rates drop out of as-of history.
+    """
+    cursor = conn.cursor()
+    
+    # Parse state code and schedule type from filename
+    state_code, schedule_type = parse_csv_filename(filepath)
+    if not state_code or not schedule_type:
+        return False
+    
+    log_message(f"Diff processing file for state {state_code}, schedule type {schedule_type}")
+    effective_date = resolve_effective_date(filepath, effective_date)
+    
+    try:
+        file_hash = file_content_hash(filepath)
+        fee_schedule_id = get_or_create_fee_schedule(cursor, state_code, schedule_type, effective_date)
+        ensure_rate_key_index(cursor)
+        ensure_manifest_tables(cursor)
+        
+        cursor.execute("SELECT file_hash FROM import_file_manifest WHERE fee_schedule_id = ?", (fee_schedule_id,))
+        manifest_row = cursor.fetchone()
+        if manifest_row and manifest_row[0] == file_hash:
+            conn.commit()
+            log_message(f"Skipping {filepath}: unchanged since last import")
+            return IMPORT_UNCHANGED
+        
+        # Parse the file; later rows with the same key win, as in the other import paths
+        parsed = {}
+        descriptions = {}
+        region_pairs = set()
+        with open(filepath, 'r', encoding='utf-8') as csv_file:
+            for row in csv.DictReader(csv_file):
+                proc_code = row['proc_cd']
+                descriptions.setdefault(proc_code, row.get('description', ''))
+                modifier, rate, rate_unit, is_by_report = parse_rate_fields(row)
+                region_type = row.get('region_type')
+                region = (region_type, row.get('region_value')) if region_type and region_type != 'state' else None
+                if region:
+                    region_pairs.add(region)
+                parsed[(proc_code, modifier, region)] = (rate, rate_unit, is_by_report)
+        
+        regions = _resolve_regions(cursor, state_code, sorted(region_pairs))
+        new_rows = {}
+        for (proc_code, modifier, region), values in parsed.items():
+            region_id = regions[region] if region else None
+            new_rows[(proc_code, modifier or '', region_id or 0)] = (modifier, region_id, values)
+        
+        old_hashes = _load_row_manifest(cursor, fee_schedule_id)
+        inserted, updated = [], []
+        for key, (modifier, region_id, values) in new_rows.items():
+            row_hash = rate_row_hash(*values)
+            if key not in old_hashes:
+                inserted.append((key, modifier, region_id, values, row_hash))
+            elif old_hashes[key] != row_hash:
+                updated.append((key, modifier, region_id, values, row_hash))
+        deleted = [key for key in old_hashes if key not in new_rows]
+        
+        # New procedure codes take the description of their first row in the file
+        cursor.executemany(
+            "INSERT OR IGNORE INTO procedure_code (procedure_code, description, code_type) VALUES (?, ?, 'CPT')",
+            [(proc_code, descriptions[proc_code]) for proc_code in dict.fromkeys(item[0][0] for item in inserted)]
+        )
+        
+        cursor.executemany(
+            """
+            INSERT INTO fee_schedule_rate
+            (fee_schedule_id, procedure_code, modifier, region_id, rate, rate_unit, is_by_report, effective_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(fee_schedule_id, key[0], modifier, region_id, *values, effective_date)
+             for key, modifier, region_id, values, _ in inserted]
+        )
+        cursor.executemany(
+            """
+            UPDATE fee_schedule_rate
+            SET rate = ?, rate_unit = ?, is_by_report = ?, last_updated = CURRENT_TIMESTAMP
+            WHERE fee_schedule_id = ? AND procedure_code = ? AND IFNULL(modifier, '') = ? AND IFNULL(region_id, 0) = ?
+            """,
+            [(*values, fee_schedule_id, *key) for key, _, _, values, _ in updated]
+        )
+        cursor.executemany(
+            """
+            DELETE FROM fee_schedule_rate
+            WHERE fee_schedule_id = ? AND procedure_code = ? AND IFNULL(modifier, '') = ? AND IFNULL(region_id, 0) = ?
+            """,
+            [(fee_schedule_id, *key) for key in deleted]
+        )
+        
+        # Keep the manifest in step with what was applied
+        cursor.executemany(
+            "INSERT OR REPLACE INTO import_row_manifest "
+            "(fee_schedule_id, procedure_code, modifier_key, region_key, row_hash) VALUES (?, ?, ?, ?, ?)",
+            [(fee_schedule_id, *key, row_hash) for key, _, _, _, row_hash in inserted + updated]
+        )
+        cursor.executemany(
+            "DELETE FROM import_row_manifest "
+            "WHERE fee_schedule_id = ? AND procedure_code = ? AND modifier_key = ? AND region_key = ?",
+            [(fee_schedule_id, *key) for key in deleted]
+        )
+        cursor.execute(
+            "INSERT OR REPLACE INTO import_file_manifest (fee_schedule_id, file_hash, file_name, row_count, imported_at) "
+            "VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            (fee_schedule_id, file_hash, os.path.basename(filepath), len(new_rows))
+        )
+        
+        # Change report for cache invalidation
+        changes = [(key[0], modifier, region_id, 'insert') for key, modifier, region_id, _, _ in inserted]
+        changes += [(key[0], modifier, region_id, 'update') for key, modifier, region_id, _, _ in updated]
+        changes += [(key[0], key[1] or None, key[2] or None, 'delete') for key in deleted]
+        cursor.executemany(
+            "INSERT INTO import_change_log "
+            "(fee_schedule_id, state_code, procedure_code, modifier, region_id, change_type, file_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(fee_schedule_id, state_code, *change, file_hash) for change in changes]
+        )
+        
+        conn.commit()
+        log_message(
+            f"Applied {filepath}: {len(inserted)} inserted, {len(updated)} updated, "
+            f"{len(deleted)} deleted, {len(new_rows) - len(inserted) - len(updated)} unchanged"
+        )
+        return True
+        
+    except Exception as e:
+        conn.rollback()
+        log_message(f"Error processing file {filepath}: {str(e)}")
+        return False
+
+def get_change_report(conn, since_id=0):
+    """Changes logged after since_id, grouped by (state_code, procedure_code)
+
+    Returns (last_id, {(state_code, procedure_code): {'insert': n, 'update': n, 'delete': n}})
+    so a cache invalidator can remember last_id and poll for new changes.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT MAX(id), state_code, procedure_code, change_type, COUNT(*) FROM import_change_log "
+        "WHERE id > ? GROUP BY state_code, procedure_code, change_type",
+        (since_id,)
+    )
+    last_id = since_id
+    report = {}
+    for max_id, state_code, procedure_code, change_type, count in cursor.fetchall():
+        last_id = max(last_id, max_id)
+        report.setdefault((state_code, procedure_code), {'insert': 0, 'update': 0, 'delete': 0})[change_type] = count
+    return last_id, report
+
+# Superseded versions per state/schedule type that rollback can republish; older
+# ones are archived with their rates, which the snapshot keeps for as-of lookups
+KEEP_VERSIONS = 2
+# A new version may not have fewer than this fraction of the previous version's rates
+MIN_ROW_RATIO = 0.5
+
+def published_fee_schedule_id(cursor, state_code, schedule_type):
+    cursor.execute(
+        "SELECT id FROM fee_schedule WHERE state_code = ? AND schedule_type = ? AND status = 'published' ORDER BY id DESC",
+        (state_code, schedule_type)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def validate_fee_schedule_version(cursor, fee_schedule_id, previous_id):
+    """Return a reason the version must not be published, or None if it passes"""
+    cursor.execute(
+        "SELECT COUNT(*), SUM(rate < 0), SUM(procedure_code IS NULL OR procedure_code = '') FROM fee_schedule_rate WHERE fee_schedule_id = ?",
+        (fee_schedule_id,)
+    )
+    count, negative, missing_code = cursor.fetchone()
+    if not count:
+        return "no rates imported"
+    if negative:
+        return f"{negative} negative rates"
+    if missing_code:
+        return f"{missing_code} rates without a procedure code"
+    if previous_id is not None:
+        cursor.execute("SELECT COUNT(*) FROM fee_schedule_rate WHERE fee_schedule_id = ?", (previous_id,))
+        previous_count = cursor.fetchone()[0]
+        if count < previous_count * MIN_ROW_RATIO:
+            return f"only {count} rates vs {previous_count} in the published version"
+    return None
+
+def discard_fee_schedule_version(conn, fee_schedule_id):
+    """Drop a version that failed to build or validate; readers never saw it
+
+    Failures are logged, not raised: the version stays 'building' and the
+    next import of its schedule discards it (discard_orphaned_versions).
+    """
+    conn.rollback()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM fee_schedule_rate WHERE fee_schedule_id = ?", (fee_schedule_id,))
+        cursor.execute("UPDATE fee_schedule SET status = 'failed' WHERE id = ?", (fee_schedule_id,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        log_message(f"Error discarding version {fee_schedule_id}: {str(e)}")
+
+def discard_orphaned_versions(conn, state_code, schedule_type):
+    """Discard 'building' versions of the schedule left behind by an import that was killed
+
+    Imports of one state run one at a time (DropFolderWatcher), so any
+    version still building when the next one starts is an orphan.
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id FROM fee_schedule WHERE state_code = ? AND schedule_type = ? AND status = 'building'",
+        (state_code, schedule_type)
+    )
+    for (orphan_id,) in cursor.fetchall():
+        log_message(f"Discarding version {orphan_id} of {state_code} {schedule_type}, left building by an earlier import")
+        cursor.execute("DELETE FROM fee_schedule_rate WHERE fee_schedule_id = ?", (orphan_id,))
+        cursor.execute("UPDATE fee_schedule SET status = 'failed' WHERE id = ?", (orphan_id,))
+    conn.commit()
+
+def prune_fee_schedule_versions(cursor, state_code, schedule_type, keep=KEEP_VERSIONS):
+    """Archive superseded versions beyond the `keep` latest-effective and drop the rates of old rolled-back ones
+
+    Archived versions can no longer be rolled back to, but their rates stay:
+    they were in force once, and build_fee_snapshot.py serves them to as-of
+    lookups. Rolled-back versions were withdrawn, so nothing reads them.
+    """
+    cursor.execute(
+        "SELECT id FROM fee_schedule WHERE state_code = ? AND schedule_type = ? AND status = 'superseded' ORDER BY effective_date DESC, published_at DESC, id DESC",
+        (state_code, schedule_type)
+    )
+    old_ids = [row[0] for row in cursor.fetchall()[keep:]]
+    for old_id in old_ids:
+        cursor.execute("UPDATE fee_schedule SET status = 'archived' WHERE id = ?", (old_id,))
+    
+    cursor.execute(
+        "SELECT id FROM fee_schedule WHERE state_code = ? AND schedule_type = ? AND status = 'rolled_back' ORDER BY published_at DESC, id DESC",
+        (state_code, schedule_type)
+    )
+    for old_id in [row[0] for row in cursor.fetchall()[keep:]]:
+        cursor.execute("DELETE FROM fee_schedule_rate WHERE fee_schedule_id = ?", (old_id,))
+    return old_ids
+
+def import_file_to_database_shadow(conn, filepath, build_mode='bulk', effective_date=None):
+    """Build a new version of the file's fee schedule out of sight, then publish it atomically
+
+    The rates are written under a new fee_schedule row with status
+    'building', using the row or bulk importer. Readers of
+    published_fee_schedule_rate (and get_or_create_fee_schedule) keep seeing
+    the current version until the new one validates. Then a single short
+    transaction marks it 'published' and the old one 'superseded', which
+    keeps the old rates for as-of lookups (prune_fee_schedule_versions
+    archives versions, it does not delete them). A failed
+    file leaves nothing behind, and rollback_fee_schedule flips back
+    instantly. With WAL enabled (connect_database) readers never wait on the
+    build.
+    
+    The version takes effect on effective_date (see resolve_effective_date).
+    One that takes effect before the published version is history being
+    backfilled: it goes straight to 'superseded' and the published version
+    stays current.
+    """
+    state_code, schedule_type = parse_csv_filename(filepath)
+    if not state_code or not schedule_type:
+        return False
+    
+    cursor = conn.cursor()
+    effective_date = resolve_effective_date(filepath, effective_date)
+    shadow_id = None
+    try:
+        ensure_state(cursor, state_code)
+        ensure_schedule_versioning(cursor)
+        discard_orphaned_versions(conn, state_code, schedule_type)
+        previous_id = published_fee_schedule_id(cursor, state_code, schedule_type)
+        cursor.execute(
+            "INSERT INTO fee_schedule (state_code, schedule_type, effective_date, status, replaces_id) VALUES (?, ?, ?, 'building', ?)",
+            (state_code, schedule_type, effective_date, previous_id)
+        )
+        shadow_id = cursor.lastrowid
+        conn.commit()
+        log_message(f"Building version {shadow_id} of {state_code} {schedule_type} effective {effective_date} (published: {previous_id})")
+        
+        builder = {'row': import_file_to_database, 'bulk': import_file_to_database_bulk}[build_mode]
+        if not builder(conn, filepath, fee_schedule_id=shadow_id, effective_date=effective_date):
+            discard_fee_schedule_version(conn, shadow_id)
+            return False
+        
+        problem = validate_fee_schedule_version(cursor, shadow_id, previous_id)
+        if problem:
+            log_message(f"Not publishing version {shadow_id}: {problem}")
+            discard_fee_schedule_version(conn, shadow_id)
+            return False
+    except Exception as e:
+        log_message(f"Error building {state_code} {schedule_type} version {shadow_id}: {str(e)}")
+        if shadow_id is not None:
+            discard_fee_schedule_version(conn, shadow_id)
+        else:
+            conn.rollback()
+        return False
+    
+    # The swap: one transaction, two UPDATEs
+    try:
+        backfill = False
+        if previous_id is not None:
+            cursor.execute("SELECT effective_date FROM fee_schedule WHERE id = ?", (previous_id,))
+            previous_date = cursor.fetchone()[0]
+            backfill = bool(previous_date) and effective_date < previous_date
+        if backfill:
+            cursor.execute("UPDATE fee_schedule SET status = 'superseded', published_at = CURRENT_TIMESTAMP WHERE id = ?", (shadow_id,))
+        else:
+            cursor.execute(
+                "UPDATE fee_schedule SET status = 'superseded' WHERE state_code = ? AND schedule_type = ? AND status = 'published'",
+                (state_code, schedule_type)
+            )
+            cursor.execute("UPDATE fee_schedule SET status = 'published', published_at = CURRENT_TIMESTAMP WHERE id = ?", (shadow_id,))
+        pruned = prune_fee_schedule_versions(cursor, state_code, schedule_type)
+        conn.commit()
+    except Exception as e:
+        log_message(f"Error publishing version {shadow_id}: {str(e)}")
+        discard_fee_schedule_version(conn, shadow_id)
+        return False
+    
+    if backfill:
+        log_message(f"Added version {shadow_id} of {state_code} {schedule_type} to history "
+                    f"(effective {effective_date}, before published version {previous_id})"
+                    + (f"; archived {pruned}" if pruned else ""))
+    else:
+        log_message(f"Published version {shadow_id} of {state_code} {schedule_type}"
+                    + (f"; archived {pruned}" if pruned else ""))
+    return True
+
+def rollback_fee_schedule(conn, state_code, schedule_type):
+    """Republish the latest-effective superseded version; returns (now published, rolled back) ids"""
+    cursor = conn.cursor()
+    ensure_schedule_versioning(cursor)
+    current_id = published_fee_schedule_id(cursor, state_code, schedule_type)
+    cursor.execute(
+        "SELECT id FROM fee_schedule WHERE state_code = ? AND schedule_type = ? AND status = 'superseded' ORDER BY effective_date DESC, published_at DESC, id DESC",
+        (state_code, schedule_type)
+    )
+    row = cursor.fetchone()
+    if not row:
+        log_message(f"No previous version of {state_code} {schedule_type} to roll back to")
+        return None, current_id
+    
+    cursor.execute("UPDATE fee_schedule SET status = 'rolled_back' WHERE id = ?", (current_id,))
+    cursor.execute("UPDATE fee_schedule SET status = 'published', published_at = CURRENT_TIMESTAMP WHERE id = ?", (row[0],))
+    conn.commit()
+    log_message(f"Rolled back {state_code} {schedule_type}: version {row[0]} published, {current_id} withdrawn")
+    return row[0], current_id
+
+IMPORT_MODES = {
+    'row': import_file_to_database,
+    'bulk': import_file_to_database_bulk,
+    'diff': import_file_to_database_diff,
+    'shadow': import_file_to_database_shadow,
+}
+
+# Readers only ever see whole, validated versions, and every version stays in
+# as-of history; 'row', 'bulk' and 'diff' write into the published schedule in
+# place, overwriting history, and are explicit opt-outs
+DEFAULT_IMPORT_MODE = 'shadow'
+
+def connect_database(database_file=None):
+    """Open the SQLite database in WAL mode so the web app can keep reading during imports"""
+    conn = sqlite3.connect(database_file or DATABASE_FILE, timeout=60)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=60000")
+    return conn
+
+def refresh_rate_benchmarks(conn):
+    """Bring rate_benchmark up to date with the rates just imported; failures are logged, not raised"""
+    from rate_benchmark import refresh_benchmarks  # imports this module
+    try:
+        refresh_benchmarks(conn)
+    except Exception as e:
+        log_message(f"Error refreshing rate benchmarks: {str(e)}")
+
+def rebuild_fee_snapshot(conn):
+    """Rewrite the memory-mapped fee schedule snapshot the web app serves from; failures are logged, not raised"""
+    from build_fee_snapshot import build_snapshot  # imports this module
+    try:
+        build_snapshot(conn)
+    except Exception as e:
+        log_message(f"Error rebuilding fee schedule snapshot: {str(e)}")
+
+def open_state_partition(conn, state_code):
+    """A connection to the state's partition file if state_partitions.py split it out, else None"""
+    from state_partitions import open_partition  # imports this module
+    return open_partition(conn, state_code) if state_code else None
+
+def import_and_move(conn, file_path, mode=DEFAULT_IMPORT_MODE, effective_date=None):
+    """Import one file, then move it to the processed or error folder
+
+    Files for a partitioned state are imported into its partition file;
+    conn (the shared database) still gets the benchmark refresh and the
+    snapshot rebuild, which read every partition. effective_date overrides
+    the date in the file name.
+    """
+    file_name = os.path.basename(file_path)
+    log_message(f"Processing {file_name}...")
+    
+    state_code, _ = parse_csv_filename(file_path)
+    part = None
+    success = False
+    try:
+        part = open_state_partition(conn, state_code)
+        success = IMPORT_MODES[mode](part or conn, file_path, effective_date=effective_date)
+        if part is not None and success and success != IMPORT_UNCHANGED:
+            from state_partitions import queue_benchmark_codes
+            queue_benchmark_codes(conn, part)
+    except Exception as e:
+        # Still move the file, or the next scan would import it again
+        log_message(f"Error importing {file_name}: {str(e)}")
+    finally:
+        if part is not None:
+            part.close()
+    
+    # Move file to processed or error folder
+    if success == IMPORT_UNCHANGED:
+        # Nothing was written, so the benchmarks and the snapshot are still current
+        dest_folder = PROCESSED_FOLDER
+        log_message(f"{file_name} unchanged, nothing to refresh")
+    elif success:
+        dest_folder = PROCESSED_FOLDER
+        log_message(f"Successfully processed {file_name}")
+        refresh_rate_benchmarks(conn)
+        rebuild_fee_snapshot(conn)
+    else:
+        dest_folder = ERROR_FOLDER
+        log_message(f"Failed to process {file_name}")
+    
+    # Create a timestamped filename to avoid overwriting
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    dest_file = os.path.join(dest_folder, f"{timestamp}_{file_name}")
+    shutil.move(file_path, dest_file)
+    return success
+
+def process_pending_files(mode=DEFAULT_IMPORT_MODE, effective_date=None):
     """Process all CSV files in the target folder"""
-    conn = sqlite3.connect(DATABASE_FILE)
+    ensure_folders()
     
     # Find all CSV files in the target folder
     csv_files = glob.glob(os.path.join(TARGET_FOLDER, "*.csv"))
@@ -198,45 +937,174 @@ def process_pending_files():
     
     log_message(f"Found {len(csv_files)} CSV files to process")
     
+    conn = connect_database()
     for file_path in csv_files:
-        file_name = os.path.basename(file_path)
-        log_message(f"Processing {file_name}...")
+        import_and_move(conn, file_path, mode, effective_date)
+    
+    conn.close()
+
+def import_worker(file_path, mode=DEFAULT_IMPORT_MODE):
+    """Process pool entry point: import one file on its own connection"""
+    conn = connect_database()
+    try:
+        return import_and_move(conn, file_path, mode)
+    finally:
+        conn.close()
+
+class DropFolderWatcher:
+    """Import drop-folder files as soon as they finish writing, in parallel across states
+
+    File system events come from watchdog (inotify on Linux) when it is
+    installed; otherwise, and as a safety net for missed events, the folder is
+    rescanned every poll_interval seconds. A file is ready once its size and
+    mtime have not changed for settle_seconds. Files run in a process pool with
+    at most one import per state at a time.
+    """
+    
+    def __init__(self, workers=4, mode=DEFAULT_IMPORT_MODE, settle_seconds=2.0, poll_interval=5.0):
+        self.workers = workers
+        self.mode = mode
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.candidates = {}  # path -> (size, mtime, time of last change)
+        self.queued = {}  # state -> [paths], in arrival order
+        self.claimed = set()  # paths queued or running
+        self.busy_states = set()
+        self.running = {}  # future -> (state, path)
+        self.events = queue.Queue()
+        self.observer = None
+    
+    def _start_observer(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            log_message(f"watchdog not installed, polling every {self.poll_interval} seconds")
+            return
         
-        success = import_file_to_database(conn, file_path)
+        events = self.events
         
-        # Move file to processed or error folder
-        if success:
-            dest_folder = PROCESSED_FOLDER
-            log_message(f"Successfully processed {file_name}")
-        else:
-            dest_folder = ERROR_FOLDER
-            log_message(f"Failed to process {file_name}")
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    events.put(getattr(event, 'dest_path', None) or event.src_path)
         
-        # Create a timestamped filename to avoid overwriting
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        dest_file = os.path.join(dest_folder, f"{timestamp}_{file_name}")
-        shutil.move(file_path, dest_file)
+        self.observer = Observer()
+        self.observer.schedule(Handler(), TARGET_FOLDER, recursive=False)
+        self.observer.start()
+        log_message("Watching for file system events")
     
-    conn.close()
+    def _scan(self):
+        for file_path in glob.glob(os.path.join(TARGET_FOLDER, "*.csv")):
+            self._touch(file_path)
+    
+    def _touch(self, file_path):
+        file_path = os.path.abspath(file_path)
+        if not file_path.lower().endswith('.csv') or os.path.dirname(file_path) != os.path.abspath(TARGET_FOLDER):
+            return
+        if file_path in self.claimed or file_path in self.candidates:
+            return
+        self.candidates[file_path] = (None, None, time.monotonic())
+    
+    def _collect_ready(self):
+        now = time.monotonic()
+        for file_path, (size, mtime, changed_at) in list(self.candidates.items()):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                del self.candidates[file_path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self.candidates[file_path] = (stat.st_size, stat.st_mtime, now)
+            elif now - changed_at >= self.settle_seconds:
+                del self.candidates[file_path]
+                state_code, _ = parse_csv_filename(file_path)
+                # Unparseable names get their own lane; the import will route them to the error folder
+                lane = state_code or file_path
+                self.queued.setdefault(lane, []).append(file_path)
+                self.claimed.add(file_path)
+    
+    def _dispatch(self, executor):
+        for state, paths in list(self.queued.items()):
+            if len(self.running) >= self.workers:
+                break
+            if state in self.busy_states:
+                continue
+            file_path = paths.pop(0)
+            if not paths:
+                del self.queued[state]
+            self.busy_states.add(state)
+            self.running[executor.submit(import_worker, file_path, self.mode)] = (state, file_path)
+    
+    def _reap(self):
+        for future in [f for f in self.running if f.done()]:
+            state, file_path = self.running.pop(future)
+            self.busy_states.discard(state)
+            self.claimed.discard(file_path)
+            try:
+                future.result()
+            except Exception as e:
+                log_message(f"Worker error on {os.path.basename(file_path)}: {str(e)}")
+    
+    def run(self):
+        ensure_folders()
+        # Switch to WAL once up front so readers are never blocked by the workers
+        connect_database().close()
+        self._start_observer()
+        
+        last_scan = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while True:
+                    if time.monotonic() - last_scan >= self.poll_interval:
+                        self._scan()
+                        last_scan = time.monotonic()
+                    try:
+                        while True:
+                            self._touch(self.events.get(timeout=0.5))
+                    except queue.Empty:
+                        pass
+                    self._collect_ready()
+                    self._reap()
+                    self._dispatch(executor)
+            finally:
+                if self.observer is not None:
+                    self.observer.stop()
+                    self.observer.join()
 
-def run_import_service(interval=60):
+def run_import_service(interval=60, mode=DEFAULT_IMPORT_MODE):
     """Run as a service, checking for new files at the specified interval (seconds)"""
     log_message(f"Starting import service. Monitoring folder: {TARGET_FOLDER}")
     log_message(f"Check interval: {interval} seconds")
     
     try:
         while True:
-            process_pending_files()
+            try:
+                process_pending_files(mode)
+            except Exception as e:
+                log_message(f"Error processing pending files: {str(e)}")
             time.sleep(interval)
     except KeyboardInterrupt:
         log_message("Service stopped by user")
     except Exception as e:
         log_message(f"Service error: {str(e)}")
 
-def run_once():
+def run_watch_service(workers=4, mode=DEFAULT_IMPORT_MODE, settle_seconds=2.0, poll_interval=5.0):
+    """Run as a service that imports files as soon as they land in the target folder"""
+    log_message(f"Starting watch service. Monitoring folder: {TARGET_FOLDER}")
+    log_message(f"Workers: {workers}, settle time: {settle_seconds} seconds")
+    
+    try:
+        DropFolderWatcher(workers, mode, settle_seconds, poll_interval).run()
+    except KeyboardInterrupt:
+        log_message("Service stopped by user")
+    except Exception as e:
+        log_message(f"Service error: {str(e)}")
+
+def run_once(mode=DEFAULT_IMPORT_MODE, effective_date=None):
     """Process files once and exit"""
     log_message("Processing files in one-time mode")
-    process_pending_files()
+    process_pending_files(mode, effective_date)
     log_message("Processing complete")
 
 if __name__ == "__main__":
@@ -245,10 +1113,46 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Import fee schedule CSV files into the database')
     parser.add_argument('--service', action='store_true', help='Run as a continuous service')
     parser.add_argument('--interval', type=int, default=60, help='Interval in seconds for checking new files (when running as service)')
+    parser.add_argument('--watch', action='store_true', help='Import files as soon as they finish writing, in parallel across states')
+    parser.add_argument('--workers', type=int, default=4, help='Number of import processes (with --watch)')
+    parser.add_argument('--settle', type=float, default=2.0, help='Seconds a file must stay unchanged before it is imported (with --watch)')
+    parser.add_argument('--poll', type=float, default=5.0, help='Folder rescan interval in seconds, the fallback when watchdog is not installed (with --watch)')
+    parser.add_argument('--shadow', action='store_true', help='Build each file as a new schedule version and publish it atomically once it validates (the default)')
+    parser.add_argument('--row', action='store_true', help='Import in place, row by row, into the published schedule (readers can see a partial import)')
+    parser.add_argument('--bulk', action='store_true', help='Import in place with set-based SQL through a staging table (readers can see a partial import)')
+    parser.add_argument('--diff', action='store_true', help='Import in place, skipping unchanged files and applying only inserted, updated and deleted rates')
+    parser.add_argument('--effective-date', type=str, metavar='YYYY-MM-DD', help='Date the imported schedules take effect, overriding a _YYYY-MM-DD part in the file names (one-time runs only)')
+    parser.add_argument('--rollback', type=str, metavar='STATE:SCHEDULE_TYPE', help='Republish the previous version of a fee schedule and exit')
     
     args = parser.parse_args()
+    if args.shadow + args.row + args.bulk + args.diff > 1:
+        parser.error('--shadow, --row, --bulk and --diff cannot be combined')
+    mode = 'row' if args.row else 'bulk' if args.bulk else 'diff' if args.diff else DEFAULT_IMPORT_MODE
+    if mode != 'shadow':
+        log_message(f"Importing in place ({mode}): replaced rates will not be available to as-of lookups")
+    if args.effective_date:
+        if args.watch or args.service:
+            parser.error('--effective-date applies to one-time runs; name the files wc_fee_YYYY-MM-DD_XX.csv instead')
+        try:
+            args.effective_date = datetime.strptime(args.effective_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            parser.error(f'--effective-date must be YYYY-MM-DD, not {args.effective_date}')
     
-    if args.service:
-        run_import_service(args.interval)
+    if args.rollback:
+        state_code, _, schedule_type = args.rollback.partition(':')
+        conn = connect_database()
+        part = open_state_partition(conn, state_code.upper())
+        rollback_fee_schedule(part or conn, state_code.upper(), schedule_type)
+        if part is not None:
+            from state_partitions import queue_benchmark_codes
+            queue_benchmark_codes(conn, part)
+            part.close()
+        refresh_rate_benchmarks(conn)
+        rebuild_fee_snapshot(conn)
+        conn.close()
+    elif args.watch:
+        run_watch_service(args.workers, mode, args.settle, args.poll)
+    elif args.service:
+        run_import_service(args.interval, mode)
     else:
-        run_once()
\ No newline at end of file
+        run_once(mode, args.effective_date)
\ No newline at end of file
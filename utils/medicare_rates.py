@@ -0,0 +1,214 @@
+import argparse
+import hashlib
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from rate_benchmark import refresh_benchmarks
+from build_fee_snapshot import build_snapshot
+
+# --- CONFIGURATION ---
+db_path = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db"
+
+
+def log_message(message):
+    """Print a timestamped log message"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+
+def ensure_tables(conn):
+    """Add the columns the engine fills to medicare_rate and create its build log"""
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS medicare_rate (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        procedure_code VARCHAR(20),
+        modifier VARCHAR(5) DEFAULT NULL,
+        locality_code VARCHAR(10),
+        rate DECIMAL(10,2),
+        effective_date DATE NOT NULL,
+        expiration_date DATE,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (procedure_code) REFERENCES procedure_code(procedure_code)
+    )
+    """)
+
+    # Add columns if missing
+    for column, column_type in [("year", "INTEGER"), ("carrier_code", "VARCHAR(10)"), ("facility_rate", "DECIMAL(10,2)")]:
+        try:
+            cursor.execute(f"ALTER TABLE medicare_rate ADD COLUMN {column} {column_type}")
+        except sqlite3.OperationalError:
+            pass  # column already exists
+
+    cursor.executescript("""
+    CREATE INDEX IF NOT EXISTS idx_medicare_rate_year ON medicare_rate(year);
+    CREATE INDEX IF NOT EXISTS idx_medicare_rate_lookup ON medicare_rate(procedure_code, locality_code, year);
+
+    CREATE TABLE IF NOT EXISTS medicare_rate_build (
+        year INTEGER PRIMARY KEY,
+        input_hash TEXT NOT NULL,
+        row_count INTEGER,
+        built_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    conn.commit()
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def load_inputs(conn, year):
+    """Read the RVU rows, GPCI localities and conversion factor for one year"""
+    rvu_columns = _columns(conn, "cms_rvu")
+    facility_pe = "facility_pe_rvu" if "facility_pe_rvu" in rvu_columns else "NULL"
+    rvus = pd.read_sql(f"""
+        SELECT procedure_code, modifier, work_rvu, practice_expense_rvu,
+               {facility_pe} AS facility_pe_rvu, malpractice_rvu
+        FROM cms_rvu
+        WHERE year = ?
+        ORDER BY procedure_code, modifier
+    """, conn, params=(year,))
+
+    carrier = "mac_code" if "mac_code" in _columns(conn, "cms_gpci") else "NULL"
+    localities = pd.read_sql(f"""
+        SELECT {carrier} AS carrier_code, locality_code, work_gpci, pe_gpci, mp_gpci
+        FROM cms_gpci
+        WHERE year = ?
+        ORDER BY carrier_code, locality_code
+    """, conn, params=(year,))
+
+    cf_row = conn.execute(
+        "SELECT conversion_factor, effective_date FROM cms_conversion_factor WHERE year = ?", (year,)
+    ).fetchone()
+    return rvus, localities, cf_row
+
+
+def input_hash(rvus, localities, cf_row):
+    """Fingerprint of everything a year's rates depend on"""
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(rvus, index=False).values.tobytes())
+    digest.update(pd.util.hash_pandas_object(localities, index=False).values.tobytes())
+    digest.update(repr(tuple(cf_row)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def compute_rates(rvus, localities, conversion_factor):
+    """Price every RVU row in every locality with array math
+
+    total RVU = work_rvu * work_gpci + pe_rvu * pe_gpci + mp_rvu * mp_gpci, and
+    rate = round(total RVU * conversion factor, 2), computed as an (RVU rows x
+    localities) grid. Missing RVUs count as zero; a missing facility PE RVU
+    leaves the facility rate empty.
+    """
+    work = rvus["work_rvu"].fillna(0).to_numpy(dtype=float)[:, None]
+    mp = rvus["malpractice_rvu"].fillna(0).to_numpy(dtype=float)[:, None]
+    pe_non_facility = rvus["practice_expense_rvu"].fillna(0).to_numpy(dtype=float)[:, None]
+    pe_facility = pd.to_numeric(rvus["facility_pe_rvu"], errors="coerce").to_numpy(dtype=float)[:, None]
+
+    work_gpci = localities["work_gpci"].to_numpy(dtype=float)[None, :]
+    pe_gpci = localities["pe_gpci"].to_numpy(dtype=float)[None, :]
+    mp_gpci = localities["mp_gpci"].to_numpy(dtype=float)[None, :]
+
+    base = work * work_gpci + mp * mp_gpci
+    non_facility = np.round((base + pe_non_facility * pe_gpci) * conversion_factor, 2)
+    facility = np.round((base + pe_facility * pe_gpci) * conversion_factor, 2)
+
+    n_rvus, n_localities = len(rvus), len(localities)
+    return pd.DataFrame({
+        "procedure_code": np.repeat(rvus["procedure_code"].to_numpy(dtype=object), n_localities),
+        "modifier": np.repeat(rvus["modifier"].to_numpy(dtype=object), n_localities),
+        "carrier_code": np.tile(localities["carrier_code"].to_numpy(dtype=object), n_rvus),
+        "locality_code": np.tile(localities["locality_code"].to_numpy(dtype=object), n_rvus),
+        "rate": non_facility.ravel(),
+        "facility_rate": facility.ravel(),
+    })
+
+
+def _nullable(values):
+    """Object array with NaN replaced by None so sqlite3 writes NULL"""
+    values = values.astype(object)
+    values[pd.isna(values)] = None
+    return values
+
+
+def write_year(conn, year, rates, effective_date, digest):
+    """Replace one year of medicare_rate in a single transaction"""
+    expiration_date = f"{year}-12-31"
+    rows = zip(
+        rates["procedure_code"].tolist(),
+        rates["modifier"].tolist(),
+        rates["carrier_code"].tolist(),
+        rates["locality_code"].tolist(),
+        _nullable(rates["rate"].to_numpy()).tolist(),
+        _nullable(rates["facility_rate"].to_numpy()).tolist(),
+    )
+    with conn:
+        conn.execute("DELETE FROM medicare_rate WHERE year = ?", (year,))
+        conn.executemany("""
+            INSERT INTO medicare_rate
+            (procedure_code, modifier, carrier_code, locality_code, rate, facility_rate,
+             year, effective_date, expiration_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, ((*row, year, effective_date, expiration_date) for row in rows))
+        conn.execute("""
+            INSERT OR REPLACE INTO medicare_rate_build (year, input_hash, row_count, built_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        """, (year, digest, len(rates)))
+
+
+def materialize(conn, years=None, force=False):
+    """Rebuild medicare_rate for every year whose inputs changed; returns {year: rows written}"""
+    ensure_tables(conn)
+    if years is None:
+        years = [row[0] for row in conn.execute("""
+            SELECT year FROM cms_conversion_factor
+            WHERE year IN (SELECT DISTINCT year FROM cms_rvu)
+              AND year IN (SELECT DISTINCT year FROM cms_gpci)
+            ORDER BY year
+        """)]
+
+    written = {}
+    for year in years:
+        start = time.perf_counter()
+        rvus, localities, cf_row = load_inputs(conn, year)
+        if cf_row is None or rvus.empty or localities.empty:
+            log_message(f"Skipping {year}: missing RVU, GPCI or conversion factor data")
+            continue
+
+        digest = input_hash(rvus, localities, cf_row)
+        previous = conn.execute("SELECT input_hash FROM medicare_rate_build WHERE year = ?", (year,)).fetchone()
+        if not force and previous and previous[0] == digest:
+            log_message(f"{year}: inputs unchanged, skipping")
+            continue
+
+        conversion_factor, effective_date = cf_row
+        rates = compute_rates(rvus, localities, conversion_factor)
+        computed = time.perf_counter()
+        write_year(conn, year, rates, effective_date, digest)
+        written[year] = len(rates)
+        log_message(
+            f"{year}: {len(rvus)} RVU rows x {len(localities)} localities = {len(rates)} rates "
+            f"(compute {computed - start:.2f}s, write {time.perf_counter() - computed:.2f}s)"
+        )
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialize Medicare physician fee schedule rates into medicare_rate")
+    parser.add_argument("--db", type=str, default=db_path, help="Path to the SQLite database file")
+    parser.add_argument("--year", type=int, action="append", help="Only rebuild this year (repeatable)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if the year's inputs are unchanged")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    written = materialize(conn, args.year, args.force)
+    if written:
+        refresh_benchmarks(conn)
+        build_snapshot(conn)
+    conn.close()
+    log_message(f"Done: {sum(written.values())} rates written for {len(written)} year(s)")
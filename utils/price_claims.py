@@ -0,0 +1,341 @@
+import argparse
+import io
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from rate_benchmark import locality_map_sql, refresh_benchmarks
+from state_partitions import read_partitions
+
+# --- CONFIGURATION ---
+db_path = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db"
+
+CHUNK_LINES = 100_000
+ZIP_SLOTS = 100_000
+
+# Accepted input headers (lower-cased) for each column the engine needs
+COLUMN_ALIASES = {
+    "state_code": ["state_code", "state"],
+    "zip_code": ["zip_code", "zip", "zipcode", "service_zip"],
+    "procedure_code": ["procedure_code", "cpt", "cpt_code", "hcpcs", "proc_cd"],
+    "modifier": ["modifier", "mod"],
+    "units": ["units", "unit", "quantity"],
+    "billed_amount": ["billed_amount", "billed", "charge", "charges", "billed_charge"],
+}
+OPTIONAL_COLUMNS = {"modifier", "units"}
+
+PRICED_COLUMNS = [
+    "wc_rate", "medicare_rate", "commercial_p25", "commercial_p50", "commercial_p75",
+    "allowed_amount", "savings", "pricing_status",
+]
+
+
+def log_message(message):
+    """Print a timestamped log message"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+
+def _index_of(values, categories):
+    """Vectorized position of each value in categories; -1 where absent"""
+    return pd.Categorical(values, categories=categories).codes.astype(np.int64)
+
+
+def _zip_slots(values):
+    """ZIP strings (5-digit or ZIP+4) to ints 0..99999; -1 where unparseable"""
+    digits = pd.Series(values, dtype="string").str.strip().str[:5]
+    slots = pd.to_numeric(digits.where(digits.str.fullmatch(r"\d{5}", na=False)), errors="coerce")
+    return slots.fillna(-1).to_numpy(dtype=np.int64)
+
+
+class PricingTables:
+    """rate_benchmark and the ZIP maps flattened into sorted integer keys
+
+    Every lookup key (state, code, modifier, region or locality) is packed
+    into one int64, so a whole chunk of lines is priced with a searchsorted
+    per table instead of a merge or a per-line query.
+    """
+
+    def __init__(self, states, codes, modifiers, region_ids, locality_count):
+        self.states = states
+        self.codes = codes
+        self.modifiers = modifiers
+        self.region_ids = region_ids  # index 0 is the statewide rate
+        self.locality_count = locality_count
+        self.zip_locality = None
+        self.zip_region_offsets = None
+        self.zip_region_index = None
+        self.wc_keys = None
+        self.wc_rates = None
+        self.bench_keys = None
+        self.bench_values = None  # medicare_rate, commercial_p25, p50, p75
+
+    @classmethod
+    def build(cls, conn):
+        bench = pd.read_sql("""
+            SELECT state_code, procedure_code, modifier, carrier_code, locality_code, region_id,
+                   wc_rate, medicare_rate, commercial_p25, commercial_p50, commercial_p75
+            FROM rate_benchmark
+        """, conn)
+        localities = pd.read_sql(f"SELECT zip_code, carrier_code, locality_code FROM ({locality_map_sql(conn)})", conn)
+        zip_region_sql = "SELECT zip_code, region_id FROM zip_region_map"
+        zip_regions = pd.concat([pd.read_sql(zip_region_sql, conn)] + read_partitions(conn, zip_region_sql),
+                                ignore_index=True).sort_values(["zip_code", "region_id"], ignore_index=True)
+
+        states = sorted(bench["state_code"].unique())
+        codes = sorted(bench["procedure_code"].unique())
+        modifiers = sorted(bench["modifier"].unique())
+        region_ids = [0] + sorted(set(bench["region_id"].unique()) - {0})
+        locality_keys = pd.Index(sorted(
+            set(zip(bench["carrier_code"], bench["locality_code"]))
+            | set(zip(localities["carrier_code"], localities["locality_code"]))
+        ))
+        tables = cls(states, codes, modifiers, region_ids, len(locality_keys))
+
+        # ZIP -> Medicare locality, and ZIP -> WC regions (CSR, only regions that have rates)
+        zip_locality = np.full(ZIP_SLOTS, -1, dtype=np.int32)
+        slots = _zip_slots(localities["zip_code"])
+        keep = slots >= 0
+        zip_locality[slots[keep]] = locality_keys.get_indexer(
+            list(zip(localities["carrier_code"], localities["locality_code"]))
+        )[keep]
+        tables.zip_locality = zip_locality
+
+        slots = _zip_slots(zip_regions["zip_code"])
+        region_index = _index_of(zip_regions["region_id"], region_ids[1:]) + 1
+        keep = (slots >= 0) & (region_index > 0)
+        slots, region_index = slots[keep], region_index[keep]
+        counts = np.bincount(slots, minlength=ZIP_SLOTS)
+        tables.zip_region_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        tables.zip_region_index = region_index[np.argsort(slots, kind="stable")].astype(np.int32)
+
+        # WC rate per (state, code, modifier, region)
+        state_idx = _index_of(bench["state_code"], states)
+        code_idx = _index_of(bench["procedure_code"], codes)
+        modifier_idx = _index_of(bench["modifier"], modifiers)
+        wc_keys = tables.wc_key(state_idx, code_idx, modifier_idx, _index_of(bench["region_id"], region_ids))
+        wc_keys, first = np.unique(wc_keys, return_index=True)
+        tables.wc_keys = wc_keys
+        tables.wc_rates = pd.to_numeric(bench["wc_rate"], errors="coerce").to_numpy(dtype=np.float64)[first]
+
+        # Medicare and commercial benchmarks per (state, code, modifier, locality)
+        locality_idx = locality_keys.get_indexer(list(zip(bench["carrier_code"], bench["locality_code"])))
+        bench_keys = tables.bench_key(state_idx, code_idx, modifier_idx, locality_idx)
+        bench_keys, first = np.unique(bench_keys, return_index=True)
+        tables.bench_keys = bench_keys
+        tables.bench_values = bench[["medicare_rate", "commercial_p25", "commercial_p50", "commercial_p75"]] \
+            .apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)[first]
+        return tables
+
+    def _base_key(self, state_idx, code_idx, modifier_idx):
+        return (state_idx * len(self.codes) + code_idx) * len(self.modifiers) + modifier_idx
+
+    def wc_key(self, state_idx, code_idx, modifier_idx, region_idx):
+        return self._base_key(state_idx, code_idx, modifier_idx) * len(self.region_ids) + region_idx
+
+    def bench_key(self, state_idx, code_idx, modifier_idx, locality_idx):
+        return self._base_key(state_idx, code_idx, modifier_idx) * self.locality_count + locality_idx
+
+    def memory_bytes(self):
+        arrays = [self.zip_locality, self.zip_region_offsets, self.zip_region_index,
+                  self.wc_keys, self.wc_rates, self.bench_keys, self.bench_values]
+        return sum(array.nbytes for array in arrays)
+
+
+def _probe(table_keys, keys, valid):
+    """Positions of keys in a sorted key array, and a mask of which were found"""
+    if not len(table_keys):
+        return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+    positions = np.minimum(np.searchsorted(table_keys, keys), len(table_keys) - 1)
+    return positions, valid & (table_keys[positions] == keys)
+
+
+def price_frame(tables, lines):
+    """Add benchmark, allowed amount and savings columns to a frame of bill lines
+
+    The WC rate is the line's regional rate when one of its ZIP's regions has
+    one, else the statewide rate; allowed is the lesser of billed and rate x
+    units. Lines without a WC rate are allowed as billed.
+    """
+    n = len(lines)
+    state_idx = _index_of(lines["state_code"].str.strip().str.upper(), tables.states)
+    code_idx = _index_of(lines["procedure_code"].str.strip().str.upper(), tables.codes)
+    modifier_idx = _index_of(lines["modifier"].fillna("").str.strip().str.upper(), tables.modifiers)
+    slots = _zip_slots(lines["zip_code"])
+    known = (state_idx >= 0) & (code_idx >= 0) & (modifier_idx >= 0)
+    base = np.where(known, tables._base_key(state_idx, code_idx, modifier_idx), 0)
+    region_count = len(tables.region_ids)
+
+    # Regional rates: expand each line over its ZIP's regions, keep the first match
+    wc_rate = np.full(n, np.nan)
+    has_zip = known & (slots >= 0)
+    zip_slot = np.where(has_zip, slots, 0)
+    starts = tables.zip_region_offsets[zip_slot]
+    counts = np.where(has_zip, tables.zip_region_offsets[zip_slot + 1] - starts, 0)
+    if counts.any():
+        line_idx = np.repeat(np.arange(n), counts)
+        within = np.arange(len(line_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+        region_idx = tables.zip_region_index[np.repeat(starts, counts) + within]
+        positions, found = _probe(tables.wc_keys, base[line_idx] * region_count + region_idx, True)
+        hit_lines, first = np.unique(line_idx[found], return_index=True)
+        wc_rate[hit_lines] = tables.wc_rates[positions[found][first]]
+    regional = ~np.isnan(wc_rate)
+
+    # Statewide fallback
+    positions, found = _probe(tables.wc_keys, base * region_count, known & ~regional)
+    wc_rate[found] = tables.wc_rates[positions[found]]
+    has_schedule = regional | found
+
+    # Medicare and commercial benchmarks for the ZIP's locality
+    locality_idx = np.where(slots >= 0, tables.zip_locality[np.maximum(slots, 0)], -1)
+    positions, found = _probe(tables.bench_keys, base * tables.locality_count + locality_idx,
+                              known & (locality_idx >= 0))
+    benchmarks = np.full((n, 4), np.nan)
+    benchmarks[found] = tables.bench_values[positions[found]]
+
+    units = pd.to_numeric(lines["units"], errors="coerce").fillna(1).to_numpy(dtype=np.float64)
+    billed = pd.to_numeric(lines["billed_amount"], errors="coerce").to_numpy(dtype=np.float64)
+    priced = has_schedule & ~np.isnan(wc_rate) & ~np.isnan(billed)
+    allowed = np.where(priced, np.minimum(billed, np.nan_to_num(wc_rate) * units), billed)
+
+    status = np.full(n, "no_fee_schedule", dtype=object)
+    status[has_schedule & np.isnan(wc_rate)] = "by_report"
+    status[priced] = "priced"
+    status[~known] = "unknown_code"
+    status[np.isnan(billed)] = "invalid_billed"
+
+    out = lines.copy()
+    out["wc_rate"] = wc_rate
+    out["medicare_rate"] = benchmarks[:, 0]
+    out["commercial_p25"] = benchmarks[:, 1]
+    out["commercial_p50"] = benchmarks[:, 2]
+    out["commercial_p75"] = benchmarks[:, 3]
+    out["allowed_amount"] = np.round(allowed, 2)
+    out["savings"] = np.round(billed - allowed, 2)
+    out["pricing_status"] = status
+    return out
+
+
+def resolve_columns(header):
+    """Map the engine's column names to the input file's header names"""
+    lowered = {name.strip().lower(): name for name in header}
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        match = next((lowered[alias] for alias in aliases if alias in lowered), None)
+        if match is None and column not in OPTIONAL_COLUMNS:
+            raise ValueError(f"Input has no {column} column (accepted names: {', '.join(aliases)})")
+        columns[column] = match
+    return columns
+
+
+# Set in each worker process by the pool initializer
+_tables = None
+
+
+def _init_worker(tables):
+    global _tables
+    _tables = tables
+
+
+def price_block(header, columns, block):
+    """Parse, price and re-serialize one block of CSV lines; returns (csv bytes, totals)"""
+    lines = pd.read_csv(io.StringIO(header + block), dtype=str, keep_default_na=False, header=0)
+    input_columns = list(lines.columns)
+    for column, source in columns.items():
+        lines[column] = lines[source] if source else ""
+    priced = price_frame(_tables, lines)
+    # pyarrow's CSV writer is ~30x faster than DataFrame.to_csv with float formatting
+    output = io.BytesIO()
+    pa_csv.write_csv(
+        pa.Table.from_pandas(priced[input_columns + PRICED_COLUMNS], preserve_index=False), output,
+        pa_csv.WriteOptions(include_header=False, quoting_style="needed")
+    )
+    totals = {
+        "lines": len(priced),
+        "priced": int((priced["pricing_status"] == "priced").sum()),
+        "billed": float(np.nansum(pd.to_numeric(priced["billed_amount"], errors="coerce"))),
+        "allowed": float(np.nansum(priced["allowed_amount"])),
+    }
+    return output.getvalue(), totals
+
+
+def _blocks(stream, chunk_lines):
+    while True:
+        block = "".join(islice(stream, chunk_lines))
+        if not block:
+            return
+        yield block
+
+
+def price_file(conn, input_path, output_path, workers=None, chunk_lines=CHUNK_LINES):
+    """Price a bill-line CSV into output_path, streaming blocks through a process pool
+
+    At most two blocks per worker are in flight and output is written in
+    input order, so memory stays bounded however large the file is. Input
+    lines must not contain quoted newlines.
+    """
+    start = time.perf_counter()
+    tables = PricingTables.build(conn)
+    log_message(f"Loaded pricing tables: {len(tables.wc_keys)} WC rates, {len(tables.bench_keys)} "
+                f"benchmarks ({tables.memory_bytes() / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s")
+
+    workers = workers or os.cpu_count() or 1
+    totals = {"lines": 0, "priced": 0, "billed": 0.0, "allowed": 0.0}
+    start = time.perf_counter()
+    with open(input_path, newline="", encoding="utf-8") as src, \
+            open(output_path, "wb") as dst:
+        header = src.readline()
+        columns = resolve_columns(pd.read_csv(io.StringIO(header), dtype=str).columns)
+        dst.write((header.rstrip("\r\n") + "," + ",".join(PRICED_COLUMNS) + "\n").encode("utf-8"))
+
+        def write(result):
+            output, block_totals = result
+            dst.write(output)
+            for key, value in block_totals.items():
+                totals[key] += value
+
+        if workers == 1:
+            _init_worker(tables)
+            for block in _blocks(src, chunk_lines):
+                write(price_block(header, columns, block))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(tables,)) as pool:
+                pending = deque()
+                for block in _blocks(src, chunk_lines):
+                    pending.append(pool.submit(price_block, header, columns, block))
+                    if len(pending) >= workers * 2:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+
+    elapsed = time.perf_counter() - start
+    log_message(f"Priced {totals['lines']:,} lines ({totals['priced']:,} on a fee schedule) in {elapsed:.1f}s "
+                f"({totals['lines'] / elapsed * 60:,.0f} lines/min); billed {totals['billed']:,.2f}, "
+                f"allowed {totals['allowed']:,.2f}, savings {totals['billed'] - totals['allowed']:,.2f}")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Price a CSV of bill lines against fee schedule, Medicare and commercial benchmarks")
+    parser.add_argument("input", type=str, help="Bill-line CSV (state, ZIP, CPT, modifier, units, billed amount)")
+    parser.add_argument("output", type=str, help="Priced CSV to write")
+    parser.add_argument("--db", type=str, default=db_path, help="Path to the SQLite database file")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-lines", type=int, default=CHUNK_LINES, help="Lines per block handed to a worker")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        refresh_benchmarks(conn)
+        price_file(conn, args.input, args.output, args.workers, args.chunk_lines)
+    finally:
+        conn.close()
@@ -0,0 +1,300 @@
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from import_data_wcfs import ensure_schedule_versioning
+from state_partitions import read_partitions
+
+# --- CONFIGURATION ---
+db_path = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db"
+
+# Marker in benchmark_dirty meaning "rebuild everything" (a ZIP/region/locality map or a Medicare year changed)
+ALL_CODES = "*"
+
+KEY_COLUMNS = ["state_code", "procedure_code", "modifier", "carrier_code", "locality_code", "region_id"]
+BENCHMARK_COLUMNS = KEY_COLUMNS + [
+    "fee_schedule_id", "wc_rate", "medicare_year", "medicare_rate", "pct_of_medicare",
+    "commercial_count", "commercial_p25", "commercial_p50", "commercial_p75",
+]
+
+# (trigger suffix, table, event, procedure_code expression or ALL_CODES)
+DIRTY_TRIGGERS = [
+    ("rate_ins", "fee_schedule_rate", "AFTER INSERT", "NEW.procedure_code"),
+    ("rate_upd", "fee_schedule_rate", "AFTER UPDATE OF rate, procedure_code, modifier, region_id", "NEW.procedure_code"),
+    ("rate_upd_old", "fee_schedule_rate", "AFTER UPDATE OF procedure_code", "OLD.procedure_code"),
+    ("rate_del", "fee_schedule_rate", "AFTER DELETE", "OLD.procedure_code"),
+    ("commercial_ins", "commercial_rate", "AFTER INSERT", "NEW.procedure_code"),
+    ("commercial_upd", "commercial_rate", "AFTER UPDATE", "NEW.procedure_code"),
+    ("commercial_del", "commercial_rate", "AFTER DELETE", "OLD.procedure_code"),
+    ("medicare_build_ins", "medicare_rate_build", "AFTER INSERT", ALL_CODES),
+    ("medicare_build_upd", "medicare_rate_build", "AFTER UPDATE", ALL_CODES),
+    ("zip_region_ins", "zip_region_map", "AFTER INSERT", ALL_CODES),
+    ("zip_region_del", "zip_region_map", "AFTER DELETE", ALL_CODES),
+    ("locality_map_ins", "medicare_locality_map", "AFTER INSERT", ALL_CODES),
+    ("locality_map_upd", "medicare_locality_map", "AFTER UPDATE", ALL_CODES),
+    ("locality_map_del", "medicare_locality_map", "AFTER DELETE", ALL_CODES),
+]
+
+
+def log_message(message):
+    """Print a timestamped log message"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def ensure_benchmark_tables(conn):
+    """Create rate_benchmark, its dirty-code queue and the triggers that feed the queue
+
+    Triggers are only created for input tables that exist; calling this again
+    after a new input table appears adds its triggers and queues a full
+    rebuild.
+    """
+    cursor = conn.cursor()
+    ensure_schedule_versioning(cursor)
+    cursor.executescript("""
+    -- One row per WC rate x Medicare locality it applies to; '' and 0 stand in for
+    -- "no modifier", "no locality" and "statewide" so the key has no NULLs
+    CREATE TABLE IF NOT EXISTS rate_benchmark (
+        state_code CHAR(2) NOT NULL,
+        procedure_code VARCHAR(20) NOT NULL,
+        modifier VARCHAR(5) NOT NULL DEFAULT '',
+        carrier_code VARCHAR(10) NOT NULL DEFAULT '',
+        locality_code VARCHAR(10) NOT NULL DEFAULT '',
+        region_id INTEGER NOT NULL DEFAULT 0,
+        fee_schedule_id INTEGER,
+        wc_rate DECIMAL(10,2),
+        medicare_year INTEGER,
+        medicare_rate DECIMAL(10,2),
+        pct_of_medicare REAL,
+        commercial_count INTEGER DEFAULT 0,
+        commercial_p25 DECIMAL(10,2),
+        commercial_p50 DECIMAL(10,2),
+        commercial_p75 DECIMAL(10,2),
+        refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (state_code, procedure_code, modifier, carrier_code, locality_code, region_id)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS benchmark_dirty (
+        procedure_code VARCHAR(20) PRIMARY KEY
+    ) WITHOUT ROWID;
+    """)
+
+    tables = _tables(conn)
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    added = False
+    for suffix, table, event, code in DIRTY_TRIGGERS:
+        name = f"trg_benchmark_{suffix}"
+        if table not in tables or name in existing:
+            continue
+        value = f"'{ALL_CODES}'" if code == ALL_CODES else code
+        # No OR IGNORE: an outer upsert's conflict handling would override it
+        cursor.execute(f"""
+            CREATE TRIGGER {name} {event} ON {table}
+            WHEN {value} IS NOT NULL AND NOT EXISTS (SELECT 1 FROM benchmark_dirty WHERE procedure_code = {value})
+            BEGIN
+                INSERT INTO benchmark_dirty (procedure_code) VALUES ({value});
+            END
+        """)
+        added = True
+
+    # Publishing or rolling back a fee schedule version changes every code in it
+    if "trg_benchmark_schedule_status" not in existing:
+        cursor.execute("""
+            CREATE TRIGGER trg_benchmark_schedule_status AFTER UPDATE OF status ON fee_schedule
+            WHEN OLD.status IS NOT NEW.status AND 'published' IN (OLD.status, NEW.status)
+            BEGIN
+                INSERT INTO benchmark_dirty (procedure_code)
+                SELECT DISTINCT r.procedure_code FROM fee_schedule_rate r
+                WHERE r.fee_schedule_id = NEW.id AND r.procedure_code IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM benchmark_dirty d WHERE d.procedure_code = r.procedure_code);
+            END
+        """)
+        added = True
+
+    if added:
+        cursor.execute("INSERT OR IGNORE INTO benchmark_dirty (procedure_code) VALUES (?)", (ALL_CODES,))
+    conn.commit()
+
+
+def _code_filter(alias, full):
+    return "" if full else f" AND {alias}.procedure_code IN (SELECT procedure_code FROM temp.benchmark_codes)"
+
+
+def locality_map_sql(conn):
+    """SELECT of (zip_code, state_code, carrier_code, locality_code) for the latest quarter of each ZIP"""
+    columns = _columns(conn, "medicare_locality_map")
+    carrier = "carrier_code" if "carrier_code" in columns else "''"
+    state = "m.state_code" if "state_code" in columns else "z.state_code"
+    latest = ""
+    if "year_qtr" in columns:
+        latest = """
+            AND (m.year_qtr IS NULL OR m.year_qtr = (
+                SELECT MAX(m2.year_qtr) FROM medicare_locality_map m2 WHERE m2.zip_code = m.zip_code))
+        """
+    return f"""
+        SELECT m.zip_code, {state} AS state_code, IFNULL({carrier}, '') AS carrier_code,
+               IFNULL(m.locality_code, '') AS locality_code
+        FROM medicare_locality_map m LEFT JOIN zip_code z ON z.zip_code = m.zip_code
+        WHERE 1 = 1 {latest}
+    """
+
+
+def compute_benchmarks(conn, full):
+    """Build the benchmark rows for every code (full) or for the codes in temp.benchmark_codes"""
+    tables = _tables(conn)
+    wc_sql = """
+        SELECT f.state_code, r.procedure_code, IFNULL(r.modifier, '') AS modifier,
+               IFNULL(r.region_id, 0) AS region_id, r.fee_schedule_id, r.rate AS wc_rate
+        FROM fee_schedule_rate r JOIN fee_schedule f ON f.id = r.fee_schedule_id
+        WHERE f.status = 'published'
+    """
+    # Partitioned states (state_partitions.py) are read from their own files; the code
+    # filter is applied here because temp.benchmark_codes only exists on this connection
+    partitions = read_partitions(conn, wc_sql)
+    if not full and partitions:
+        codes = {row[0] for row in conn.execute("SELECT procedure_code FROM temp.benchmark_codes")}
+        partitions = [frame[frame["procedure_code"].isin(codes)] for frame in partitions]
+    wc = pd.concat([pd.read_sql(wc_sql + _code_filter("r", full), conn)] + partitions, ignore_index=True)
+    if wc.empty:
+        return pd.DataFrame(columns=BENCHMARK_COLUMNS)
+    # Two published schedules for the same state can price the same code; the newest wins
+    wc = wc.sort_values("fee_schedule_id").drop_duplicates(
+        ["state_code", "procedure_code", "modifier", "region_id"], keep="last"
+    )
+
+    # Which Medicare localities each WC rate applies to
+    if "medicare_locality_map" in tables:
+        locality_sql = locality_map_sql(conn)
+        state_localities = pd.read_sql(f"""
+            SELECT DISTINCT state_code, carrier_code, locality_code FROM ({locality_sql})
+        """, conn)
+        region_sql = f"""
+            SELECT DISTINCT zr.region_id, l.carrier_code, l.locality_code
+            FROM zip_region_map zr JOIN ({locality_sql}) l ON l.zip_code = zr.zip_code
+        """
+        region_localities = pd.concat([pd.read_sql(region_sql, conn)] + read_partitions(conn, region_sql),
+                                      ignore_index=True)
+    else:
+        state_localities = pd.DataFrame(columns=["state_code", "carrier_code", "locality_code"])
+        region_localities = pd.DataFrame(columns=["region_id", "carrier_code", "locality_code"])
+
+    statewide = wc[wc["region_id"] == 0].merge(state_localities, on="state_code", how="left")
+    regional = wc[wc["region_id"] != 0].merge(region_localities, on="region_id", how="left")
+    rows = pd.concat([statewide, regional], ignore_index=True)
+    rows[["carrier_code", "locality_code"]] = rows[["carrier_code", "locality_code"]].fillna("")
+
+    # Medicare: latest materialized year
+    medicare_year = None
+    if "medicare_rate" in tables and "year" in _columns(conn, "medicare_rate"):
+        medicare_year = conn.execute("SELECT MAX(year) FROM medicare_rate").fetchone()[0]
+    if medicare_year is not None:
+        medicare = pd.read_sql(f"""
+            SELECT m.procedure_code, IFNULL(m.modifier, '') AS modifier, IFNULL(m.carrier_code, '') AS carrier_code,
+                   m.locality_code, m.rate AS medicare_rate
+            FROM medicare_rate m
+            WHERE m.year = ? {_code_filter('m', full)}
+        """, conn, params=(medicare_year,))
+        medicare = medicare.drop_duplicates(["procedure_code", "modifier", "carrier_code", "locality_code"])
+        rows = rows.merge(medicare, on=["procedure_code", "modifier", "carrier_code", "locality_code"], how="left")
+        rows["medicare_year"] = medicare_year
+    else:
+        rows["medicare_rate"] = None
+        rows["medicare_year"] = None
+
+    # Commercial rates, pooled per Medicare locality
+    if "commercial_rate" in tables and "medicare_locality_map" in tables:
+        commercial = pd.read_sql(f"""
+            SELECT c.procedure_code, IFNULL(c.modifier, '') AS modifier, l.carrier_code, l.locality_code, c.rate
+            FROM commercial_rate c JOIN ({locality_map_sql(conn)}) l ON l.zip_code = c.zip_code
+            WHERE c.rate IS NOT NULL {_code_filter('c', full)}
+        """, conn)
+    else:
+        commercial = pd.DataFrame(columns=["procedure_code", "modifier", "carrier_code", "locality_code", "rate"])
+    if not commercial.empty:
+        grouped = commercial.groupby(["procedure_code", "modifier", "carrier_code", "locality_code"])["rate"]
+        stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+        stats.columns = ["commercial_p25", "commercial_p50", "commercial_p75"]
+        stats["commercial_count"] = grouped.size()
+        rows = rows.merge(stats.reset_index(), on=["procedure_code", "modifier", "carrier_code", "locality_code"], how="left")
+    else:
+        for column in ["commercial_p25", "commercial_p50", "commercial_p75", "commercial_count"]:
+            rows[column] = None
+    rows["commercial_count"] = rows["commercial_count"].fillna(0).astype(int)
+
+    medicare_rate = pd.to_numeric(rows["medicare_rate"], errors="coerce")
+    rows["pct_of_medicare"] = (pd.to_numeric(rows["wc_rate"], errors="coerce") / medicare_rate.where(medicare_rate > 0) * 100).round(1)
+    for column in ["commercial_p25", "commercial_p50", "commercial_p75"]:
+        rows[column] = pd.to_numeric(rows[column], errors="coerce").round(2)
+    return rows[BENCHMARK_COLUMNS].drop_duplicates(KEY_COLUMNS)
+
+
+def refresh_benchmarks(conn, full=False):
+    """Recompute rate_benchmark for the codes whose inputs changed since the last refresh
+
+    The triggers queue procedure codes in benchmark_dirty (or '*' for a full
+    rebuild). The queue is drained in the same transaction as the rewrite, so
+    a failed refresh leaves both the table and the queue as they were.
+    Returns the number of benchmark rows written.
+    """
+    start = time.perf_counter()
+    ensure_benchmark_tables(conn)
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS temp.benchmark_codes")
+    cursor.execute("CREATE TEMP TABLE benchmark_codes (procedure_code TEXT PRIMARY KEY)")
+    try:
+        cursor.execute("INSERT INTO temp.benchmark_codes SELECT procedure_code FROM benchmark_dirty")
+        full = full or cursor.execute(
+            "SELECT 1 FROM temp.benchmark_codes WHERE procedure_code = ?", (ALL_CODES,)
+        ).fetchone() is not None
+        if not full and not cursor.execute("SELECT 1 FROM temp.benchmark_codes LIMIT 1").fetchone():
+            conn.commit()
+            return 0
+
+        rows = compute_benchmarks(conn, full)
+        if full:
+            cursor.execute("DELETE FROM rate_benchmark")
+        else:
+            cursor.execute("DELETE FROM rate_benchmark WHERE procedure_code IN (SELECT procedure_code FROM temp.benchmark_codes)")
+        rows = rows.astype(object).where(rows.notna(), None)
+        cursor.executemany(
+            f"INSERT INTO rate_benchmark ({', '.join(BENCHMARK_COLUMNS)}) VALUES ({', '.join('?' * len(BENCHMARK_COLUMNS))})",
+            rows.itertuples(index=False, name=None)
+        )
+        if full:
+            cursor.execute("DELETE FROM benchmark_dirty")
+        else:
+            cursor.execute("DELETE FROM benchmark_dirty WHERE procedure_code IN (SELECT procedure_code FROM temp.benchmark_codes)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.benchmark_codes")
+
+    log_message(f"Refreshed {'all' if full else 'changed'} benchmarks: {len(rows)} rows "
+                f"in {time.perf_counter() - start:.2f}s")
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the WC vs Medicare vs commercial rate_benchmark table")
+    parser.add_argument("--db", type=str, default=db_path, help="Path to the SQLite database file")
+    parser.add_argument("--full", action="store_true", help="Rebuild every benchmark, not just changed codes")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        refresh_benchmarks(conn, args.full)
+    finally:
+        conn.close()
@@ -0,0 +1,455 @@
+import argparse
+import csv
+import hashlib
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# --- CONFIGURATION ---
+rvu_folder = r"C:\Users\ChristopherCato\Downloads\rvu25a (1)"
+zip5_path = r"C:\Users\ChristopherCato\Downloads\zplc_apr2025\ZIP5_APR2025.xlsx"
+db_path = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db"
+
+# Rows per parquet row group / staging batch; bounds memory for any file size
+BATCH_ROWS = 50000
+
+# Conversion factors we have loaded before; other years need --cf YEAR=VALUE
+CONVERSION_FACTORS = {2025: 32.7442}
+
+# Target tables: DDL, key columns (the PK) and the ON CONFLICT target matching a unique index
+TABLES = {
+    "cms_rvu": {
+        "ddl": """
+        CREATE TABLE IF NOT EXISTS cms_rvu (
+            procedure_code TEXT,
+            year INTEGER NOT NULL,
+            work_rvu REAL,
+            practice_expense_rvu REAL,
+            malpractice_rvu REAL,
+            facility_pe_rvu REAL,
+            total_rvu REAL,
+            modifier TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (procedure_code, year, modifier)
+        );
+        -- modifier is usually NULL, which the PK treats as distinct, so upserts key on this instead
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_cms_rvu_key ON cms_rvu(procedure_code, year, IFNULL(modifier, ''));
+        """,
+        "key": ["procedure_code", "year", "modifier"],
+        "conflict": "procedure_code, year, IFNULL(modifier, '')",
+        "scope": "year",
+    },
+    "cms_gpci": {
+        "ddl": """
+        CREATE TABLE IF NOT EXISTS cms_gpci (
+            mac_code TEXT,
+            state TEXT,
+            locality_code TEXT,
+            year INTEGER NOT NULL,
+            work_gpci REAL,
+            pe_gpci REAL,
+            mp_gpci REAL,
+            locality_name TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (mac_code, locality_code, year)
+        );
+        """,
+        "key": ["mac_code", "locality_code", "year"],
+        "conflict": "mac_code, locality_code, year",
+        "scope": "year",
+    },
+    "medicare_locality_meta": {
+        "ddl": """
+        CREATE TABLE IF NOT EXISTS medicare_locality_meta (
+            mac_code TEXT,
+            locality_code TEXT,
+            year INTEGER NOT NULL,
+            state_name TEXT,
+            fee_schedule_area TEXT,
+            counties TEXT,
+            PRIMARY KEY (mac_code, locality_code, year)
+        );
+        """,
+        "key": ["mac_code", "locality_code", "year"],
+        "conflict": "mac_code, locality_code, year",
+        "scope": "year",
+    },
+    "medicare_locality_map": {
+        "ddl": """
+        CREATE TABLE IF NOT EXISTS medicare_locality_map (
+            zip_code TEXT,
+            state_code TEXT,
+            carrier_code TEXT,
+            locality_code TEXT,
+            year_qtr TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (zip_code, year_qtr),
+            FOREIGN KEY (zip_code) REFERENCES zip_code(zip_code)
+        );
+        """,
+        "key": ["zip_code", "year_qtr"],
+        "conflict": "zip_code, year_qtr",
+        "scope": "year_qtr",
+    },
+}
+
+
+def log_message(message):
+    """Print a timestamped log message"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+
+# --- SOURCE FILES -> CACHED PARQUET ---
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cell_text(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+def xlsx_rows(path, header_marker):
+    """Yield the header row, then data rows, from the first sheet of a workbook
+
+    Uses openpyxl's read-only mode, which streams rows instead of loading the
+    sheet. Title rows above the header (the first row containing
+    `header_marker`) are skipped.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        for row in rows:
+            cells = [_cell_text(value) for value in row]
+            if header_marker in cells:
+                yield cells
+                break
+        else:
+            raise ValueError(f"No header row containing {header_marker!r} in {path}")
+        for row in rows:
+            yield [_cell_text(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def csv_rows(path):
+    """Yield a positional header ("0", "1", ...) and then the rows of a headerless CSV"""
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        reader = csv.reader(f)
+        header = None
+        for row in reader:
+            if header is None:
+                header = [str(i) for i in range(len(row))]
+                yield header
+            yield [_cell_text(value) for value in row]
+
+
+def cached_parquet(path, rows, cache_dir):
+    """Return a parquet copy of a source file, converting it only if its content changed
+
+    The cache file name carries the source's SHA-256, so an unchanged file is
+    never parsed twice and a changed one gets a new cache entry. All columns
+    are stored as text, exactly as they appear in the source.
+    """
+    digest = file_sha256(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    target = os.path.join(cache_dir, f"{stem}-{digest[:16]}.parquet")
+    if os.path.exists(target):
+        log_message(f"Using cached {os.path.basename(target)}")
+        return target
+
+    start = time.perf_counter()
+    os.makedirs(cache_dir, exist_ok=True)
+    rows = iter(rows)
+    names = []
+    for i, name in enumerate(next(rows)):
+        name = name or f"column_{i}"
+        names.append(name if name not in names else f"{name}_{i}")
+    schema = pa.schema([(name, pa.string()) for name in names])
+
+    def write(writer, batch):
+        columns = list(zip(*batch))
+        writer.write_table(pa.Table.from_arrays([pa.array(column, pa.string()) for column in columns], schema=schema))
+
+    count = 0
+    tmp_path = f"{target}.tmp"
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        batch = []
+        for row in rows:
+            if not any(row):
+                continue  # blank line
+            row = (list(row) + [None] * len(names))[:len(names)]
+            batch.append(row)
+            if len(batch) >= BATCH_ROWS:
+                write(writer, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            write(writer, batch)
+            count += len(batch)
+    os.replace(tmp_path, target)
+    log_message(f"Converted {os.path.basename(path)} -> {os.path.basename(target)} "
+                f"({count} rows, {time.perf_counter() - start:.1f}s)")
+    return target
+
+
+def parquet_frames(path):
+    """Yield a parquet file as pandas DataFrames of at most BATCH_ROWS rows"""
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=BATCH_ROWS):
+        yield batch.to_pandas()
+
+
+# --- STAGED UPSERTS ---
+
+def _primary_key(conn, table):
+    columns = [(row[5], row[1]) for row in conn.execute(f"PRAGMA table_info({table})") if row[5]]
+    return [name for _, name in sorted(columns)]
+
+
+def ensure_tables(conn):
+    """Create the reference tables, rebuilding any whose primary key is missing or outdated
+
+    Older loaders replaced these tables with pandas.to_sql, which drops the
+    declared keys. Those tables are rebuilt and their rows copied over.
+    """
+    for table, spec in TABLES.items():
+        existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if existing and _primary_key(conn, table) != spec["key"]:
+            log_message(f"Rebuilding {table} with primary key ({', '.join(spec['key'])})")
+            conn.execute(f"DROP INDEX IF EXISTS idx_{table}_key")
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+            conn.executescript(spec["ddl"])
+            new_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            common = ", ".join(column for column in existing if column in new_columns)
+            conn.execute(f"INSERT OR IGNORE INTO {table} ({common}) SELECT {common} FROM {table}_old")
+            conn.execute(f"DROP TABLE {table}_old")
+        else:
+            conn.executescript(spec["ddl"])
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS cms_conversion_factor (
+        year INTEGER PRIMARY KEY,
+        conversion_factor REAL,
+        effective_date DATE NOT NULL,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.commit()
+
+
+def upsert_frames(conn, table, frames, scope_value):
+    """Replace one year (or quarter) of a reference table from a stream of DataFrames
+
+    Rows are streamed into a temp staging table, then merged with one
+    INSERT ... ON CONFLICT DO UPDATE, so existing rows keep their keys and
+    every index stays in place. Rows of the same year that are no longer in
+    the source are deleted. Other years are left alone. Everything runs in one
+    transaction. Returns (rows upserted, rows deleted).
+    """
+    spec = TABLES[table]
+    table_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS temp.ref_staging")
+
+    columns = None
+    staged = 0
+    try:
+        for frame in frames:
+            if columns is None:
+                columns = [column for column in frame.columns if column in table_columns]
+                cursor.execute(f"CREATE TEMP TABLE ref_staging AS SELECT {', '.join(columns)} FROM {table} WHERE 0")
+            frame = frame[columns].astype(object).where(frame[columns].notna(), None)
+            cursor.executemany(
+                f"INSERT INTO ref_staging VALUES ({', '.join('?' * len(columns))})",
+                frame.itertuples(index=False, name=None)
+            )
+            staged += len(frame)
+        if columns is None:
+            return 0, 0
+
+        cursor.execute(f"CREATE INDEX temp.idx_ref_staging_key ON ref_staging({', '.join(spec['key'])})")
+        column_list = ", ".join(columns)
+        updates = [f"{column} = excluded.{column}" for column in columns if column not in spec["key"]]
+        if "last_updated" in table_columns:
+            updates.append("last_updated = CURRENT_TIMESTAMP")
+        cursor.execute(f"""
+            INSERT INTO {table} ({column_list})
+            SELECT {column_list} FROM ref_staging WHERE true
+            ON CONFLICT ({spec['conflict']}) DO UPDATE SET {', '.join(updates)}
+        """)
+        match = " AND ".join(f"s.{column} IS {table}.{column}" for column in spec["key"])
+        cursor.execute(f"""
+            DELETE FROM {table}
+            WHERE {spec['scope']} = ? AND NOT EXISTS (SELECT 1 FROM ref_staging s WHERE {match})
+        """, (scope_value,))
+        deleted = cursor.rowcount
+        conn.commit()
+        return staged, deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("DROP TABLE IF EXISTS temp.ref_staging")
+
+
+# --- SOURCE-SPECIFIC CLEANING ---
+
+def _numeric(frame, columns):
+    for column in columns:
+        frame[column] = pd.to_numeric(frame[column], errors="coerce")
+    return frame
+
+
+def rvu_frames(parquet_path, year):
+    for df in parquet_frames(parquet_path):
+        # Drop blank rows and rows without HCPCS
+        df = df[df["HCPCS"].notna()]
+        df = df[["HCPCS", "MOD", "WORK_RVU", "NON_FAC_PE_RVU", "FAC_PE_RVU", "MP_RVU", "NON_FAC_TOTAL"]].rename(columns={
+            "HCPCS": "procedure_code",
+            "MOD": "modifier",
+            "WORK_RVU": "work_rvu",
+            "NON_FAC_PE_RVU": "practice_expense_rvu",
+            "FAC_PE_RVU": "facility_pe_rvu",
+            "MP_RVU": "malpractice_rvu",
+            "NON_FAC_TOTAL": "total_rvu"
+        })
+        df = _numeric(df, ["work_rvu", "practice_expense_rvu", "facility_pe_rvu", "malpractice_rvu", "total_rvu"])
+        yield df.assign(year=year)
+
+
+def gpci_frames(parquet_path, year):
+    for df in parquet_frames(parquet_path):
+        df = df.iloc[:, :7].copy()
+        df.columns = ["mac_code", "state", "locality_code", "locality_name", "work_gpci", "pe_gpci", "mp_gpci"]
+        df = _numeric(df, ["work_gpci", "pe_gpci", "mp_gpci"])
+        # Locality code must be present; title and header lines have no numeric GPCIs
+        df = df[df["locality_code"].notna() & df["work_gpci"].notna()]
+        yield df.assign(year=year)
+
+
+def locality_meta_frames(parquet_path, year):
+    for df in parquet_frames(parquet_path):
+        df = df.iloc[:, :5].copy()
+        df.columns = ["mac_code", "locality_code", "state_name", "fee_schedule_area", "counties"]
+        # Rows need a locality and state; title and header lines have no numeric MAC code
+        numeric_mac = df["mac_code"].str.isdigit().fillna(False).astype(bool)
+        df = df[df["locality_code"].notna() & df["state_name"].notna() & numeric_mac]
+        yield df.drop_duplicates().assign(year=year)
+
+
+def zip5_frames(parquet_path, quarter):
+    for df in parquet_frames(parquet_path):
+        df.columns = df.columns.str.strip()
+        df = df[df["YEAR/QTR"] == quarter].rename(columns={
+            "ZIP CODE": "zip_code",
+            "STATE": "state_code",
+            "CARRIER": "carrier_code",
+            "LOCALITY": "locality_code",
+            "YEAR/QTR": "year_qtr"
+        })
+        df = df[["zip_code", "state_code", "carrier_code", "locality_code", "year_qtr"]]
+        yield df.dropna(subset=["zip_code", "locality_code"])
+
+
+# --- INGEST COMMANDS ---
+
+def default_cache_dir(database):
+    return os.path.join(os.path.dirname(os.path.abspath(database)), "reference_cache")
+
+
+def ingest_medicare_year(conn, year, folder, cache_dir, conversion_factor=None, release="JAN"):
+    """Load one year of CMS RVU, GPCI and locality files from a PFS release folder"""
+    yy = str(year)[-2:]
+    rvu_path = os.path.join(folder, f"PPRRVU{yy}_{release}.xlsx")
+    gpci_path = os.path.join(folder, f"GPCI{year}.csv")
+    meta_path = os.path.join(folder, f"{yy}LOCCO.csv")
+
+    rvu_parquet = cached_parquet(rvu_path, xlsx_rows(rvu_path, "HCPCS"), cache_dir)
+    loaded, deleted = upsert_frames(conn, "cms_rvu", rvu_frames(rvu_parquet, year), year)
+    log_message(f"{year}: upserted {loaded} rows into cms_rvu ({deleted} removed)")
+
+    gpci_parquet = cached_parquet(gpci_path, csv_rows(gpci_path), cache_dir)
+    loaded, deleted = upsert_frames(conn, "cms_gpci", gpci_frames(gpci_parquet, year), year)
+    log_message(f"{year}: upserted {loaded} rows into cms_gpci ({deleted} removed)")
+
+    meta_parquet = cached_parquet(meta_path, csv_rows(meta_path), cache_dir)
+    loaded, deleted = upsert_frames(conn, "medicare_locality_meta", locality_meta_frames(meta_parquet, year), year)
+    log_message(f"{year}: upserted {loaded} rows into medicare_locality_meta ({deleted} removed)")
+
+    conversion_factor = conversion_factor or CONVERSION_FACTORS.get(year)
+    if conversion_factor is None:
+        log_message(f"{year}: no conversion factor known; pass --cf {year}=VALUE to load one")
+    else:
+        conn.execute("""
+            INSERT INTO cms_conversion_factor (year, conversion_factor, effective_date, last_updated)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (year) DO UPDATE SET
+                conversion_factor = excluded.conversion_factor,
+                effective_date = excluded.effective_date,
+                last_updated = excluded.last_updated
+        """, (year, conversion_factor, f"{year}-01-01"))
+        conn.commit()
+        log_message(f"{year}: loaded conversion factor {conversion_factor}")
+
+
+def ingest_zip5(conn, path, quarter, cache_dir):
+    """Load one quarter of the CMS ZIP5 carrier/locality file into medicare_locality_map"""
+    parquet = cached_parquet(path, xlsx_rows(path, "ZIP CODE"), cache_dir)
+    loaded, deleted = upsert_frames(conn, "medicare_locality_map", zip5_frames(parquet, quarter), quarter)
+    log_message(f"{quarter}: upserted {loaded} rows into medicare_locality_map ({deleted} removed)")
+
+
+def _year_pairs(values, cast):
+    pairs = {}
+    for value in values or []:
+        key, _, item = value.partition("=")
+        if not item:
+            raise argparse.ArgumentTypeError(f"Expected YEAR=VALUE, got {value!r}")
+        pairs[int(key)] = cast(item)
+    return pairs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest CMS reference files (RVU/GPCI/locality, ZIP5) with a parquet cache")
+    parser.add_argument("--db", type=str, default=db_path, help="Path to the SQLite database file")
+    parser.add_argument("--cache-dir", type=str, help="Parquet cache folder (default: reference_cache next to the database)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rvu_parser = subparsers.add_parser("rvu", help="Load PPRRVU, GPCI and LOCCO files for one or more years")
+    rvu_parser.add_argument("--source", action="append", metavar="YEAR=FOLDER",
+                            help=f"Release folder for a year (repeatable; default 2025={rvu_folder})")
+    rvu_parser.add_argument("--cf", action="append", metavar="YEAR=VALUE", help="Conversion factor for a year (repeatable)")
+    rvu_parser.add_argument("--release", default="JAN", help="PPRRVU release suffix (JAN, APR, JUL, OCT)")
+
+    zip_parser = subparsers.add_parser("zip5", help="Load a CMS ZIP5 carrier/locality workbook")
+    zip_parser.add_argument("--file", default=zip5_path, help="ZIP5_*.xlsx path")
+    zip_parser.add_argument("--quarter", default="20252", help="YEAR/QTR value to load, e.g. 20252")
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or default_cache_dir(args.db)
+    conn = sqlite3.connect(args.db)
+    try:
+        ensure_tables(conn)
+        if args.command == "rvu":
+            sources = _year_pairs(args.source, str) or {2025: rvu_folder}
+            factors = _year_pairs(args.cf, float)
+            for year, folder in sorted(sources.items()):
+                ingest_medicare_year(conn, year, folder, cache_dir, factors.get(year), args.release)
+        else:
+            ingest_zip5(conn, args.file, args.quarter, cache_dir)
+    finally:
+        conn.close()
@@ -0,0 +1,505 @@
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from import_data_wcfs import (
+    IMPORT_MODES, connect_database, ensure_schedule_versioning, parse_csv_filename,
+    rebuild_fee_snapshot, refresh_rate_benchmarks
+)
+
+# --- CONFIGURATION ---
+db_path = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db"
+
+# Tables that live in a state's partition file; shared reference tables stay in the main database
+PARTITIONED_TABLES = ["fee_schedule", "fee_schedule_rate", "region", "zip_region_map"]
+
+# AUTOINCREMENT ids in a new partition start at state_index * ID_STRIDE, so ids stay
+# unique across partitions and the shared database. They go up to 6.8e11, so
+# every reader keeps region and fee schedule ids as int64.
+ID_STRIDE = 10 ** 9
+
+# SQLite's compile-time SQLITE_MAX_ATTACHED; sqlite3 setlimit can lower it but never raise it
+MAX_ATTACHED = 10
+
+# Shared-database rows of a state that split_state moves into the partition (state and procedure_code stay)
+MOVED_TABLES = ["fee_schedule_rate", "zip_region_map", "region", "fee_schedule"]
+
+# Same definitions as builder_scripts/create_db.py
+PARTITION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    state_code CHAR(2) PRIMARY KEY,
+    state_name VARCHAR(50) NOT NULL,
+    effective_date DATE NOT NULL,
+    expiration_date DATE,
+    has_regions BOOLEAN DEFAULT 0,
+    data_source VARCHAR(255),
+    data_url VARCHAR(255),
+    notes TEXT
+);
+
+CREATE TABLE IF NOT EXISTS region (
+    region_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state_code CHAR(2),
+    region_type VARCHAR(50) NOT NULL,
+    region_code VARCHAR(50) NOT NULL,
+    region_name VARCHAR(100),
+    UNIQUE (state_code, region_type, region_code)
+);
+
+CREATE TABLE IF NOT EXISTS zip_region_map (
+    zip_code VARCHAR(10),
+    region_id INTEGER,
+    PRIMARY KEY (zip_code, region_id)
+);
+
+CREATE TABLE IF NOT EXISTS fee_schedule (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state_code CHAR(2),
+    schedule_type VARCHAR(50) NOT NULL,
+    effective_date DATE NOT NULL,
+    expiration_date DATE,
+    conversion_factor DECIMAL(10,4),
+    notes TEXT
+);
+
+CREATE TABLE IF NOT EXISTS procedure_code (
+    procedure_code VARCHAR(20) PRIMARY KEY,
+    description TEXT NOT NULL,
+    code_type VARCHAR(10) NOT NULL,
+    category VARCHAR(50),
+    subcategory VARCHAR(50)
+);
+
+CREATE TABLE IF NOT EXISTS fee_schedule_rate (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fee_schedule_id INTEGER,
+    procedure_code VARCHAR(20),
+    modifier VARCHAR(5) DEFAULT NULL,
+    region_id INTEGER,
+    rate DECIMAL(10,2),
+    rate_unit VARCHAR(20) DEFAULT '1',
+    is_by_report BOOLEAN DEFAULT 0,
+    effective_date DATE NOT NULL,
+    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    access_count INTEGER DEFAULT 0,
+    last_accessed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (fee_schedule_id, procedure_code, modifier, region_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_region_state ON region(state_code);
+CREATE INDEX IF NOT EXISTS idx_fee_schedule_state ON fee_schedule(state_code);
+CREATE INDEX IF NOT EXISTS idx_fee_schedule_rate_proc ON fee_schedule_rate(procedure_code);
+CREATE INDEX IF NOT EXISTS idx_fee_schedule_rate_region ON fee_schedule_rate(region_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_fee_schedule_rate_key ON fee_schedule_rate(fee_schedule_id, procedure_code, IFNULL(modifier, ''), IFNULL(region_id, 0));
+"""
+
+
+def log_message(message):
+    """Print a timestamped log message"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+
+def default_partition_dir(database_file):
+    return os.path.join(os.path.dirname(os.path.abspath(database_file)), "states")
+
+
+def _check_state(state_code):
+    state_code = state_code.strip().upper()
+    if not re.fullmatch(r"[A-Z]{2}", state_code):
+        raise ValueError(f"Invalid state code: {state_code!r}")
+    return state_code
+
+
+def partition_path(partition_dir, state_code):
+    return os.path.join(partition_dir, f"{_check_state(state_code)}.db")
+
+
+def list_partitions(partition_dir):
+    """State codes that have a partition file"""
+    return sorted(
+        os.path.splitext(os.path.basename(path))[0]
+        for path in glob.glob(os.path.join(partition_dir, "[A-Z][A-Z].db"))
+    )
+
+
+def _main_file(conn):
+    return next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+
+
+def partition_dir_for(conn):
+    """The default partition folder of an open shared database; None for an in-memory one"""
+    main_file = _main_file(conn)
+    return default_partition_dir(main_file) if main_file else None
+
+
+def state_in_main(conn, state_code):
+    """Whether the shared database still holds fee schedules or regions for the state"""
+    return conn.execute(
+        "SELECT 1 FROM fee_schedule WHERE state_code = ? UNION ALL SELECT 1 FROM region WHERE state_code = ? LIMIT 1",
+        (state_code, state_code)
+    ).fetchone() is not None
+
+
+def open_partition(conn, state_code, partition_dir=None):
+    """A connection to the state's partition file, or None if the state is not partitioned
+
+    Imports write to the file in place. Its rollback journal (not WAL) keeps the
+    file self-contained for reload and purge, which swap whole files.
+    """
+    partition_dir = partition_dir or partition_dir_for(conn)
+    if not partition_dir:
+        return None
+    path = partition_path(partition_dir, state_code)
+    if not os.path.exists(path):
+        return None
+    part = sqlite3.connect(path, timeout=60)
+    part.execute("PRAGMA busy_timeout=60000")
+    return part
+
+
+def read_partitions(conn, sql, params=(), partition_dir=None):
+    """Run a query against every state partition and return one DataFrame per partition
+
+    Each partition is opened on its own connection with the shared database
+    attached as `shared`. Unqualified names resolve to the partition's tables
+    first, so state tables come from the partition and reference tables
+    (zip_code, medicare_locality_map, ...) from the shared database. Readers
+    concatenate the frames with their own read of the shared database. This
+    covers every state without running into SQLite's attachment limit.
+    """
+    partition_dir = partition_dir or partition_dir_for(conn)
+    if not partition_dir:
+        return []
+    main_file = _main_file(conn)
+    frames = []
+    for state_code in list_partitions(partition_dir):
+        part = sqlite3.connect(partition_path(partition_dir, state_code), timeout=60)
+        try:
+            part.execute("ATTACH DATABASE ? AS shared", (main_file,))
+            frames.append(pd.read_sql_query(sql, part, params=params))
+        finally:
+            part.close()
+    return frames
+
+
+def queue_benchmark_codes(conn, part):
+    """Queue a partition's procedure codes for the next rate_benchmark refresh of the shared database
+
+    The dirty-code triggers live in the shared database and never see writes
+    to a partition file, so partition writers call this instead.
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'benchmark_dirty'").fetchone():
+        return 0
+    codes = part.execute("SELECT DISTINCT procedure_code FROM fee_schedule_rate WHERE procedure_code IS NOT NULL").fetchall()
+    conn.executemany("INSERT OR IGNORE INTO benchmark_dirty (procedure_code) VALUES (?)", codes)
+    conn.commit()
+    return len(codes)
+
+
+def _queue_partition_codes(conn, partition_dir, state_code):
+    part = open_partition(conn, state_code, partition_dir)
+    if part is not None:
+        try:
+            queue_benchmark_codes(conn, part)
+        finally:
+            part.close()
+
+
+def _id_base(state_code):
+    return ((ord(state_code[0]) - 65) * 26 + (ord(state_code[1]) - 65) + 1) * ID_STRIDE
+
+
+def create_partition_file(path, state_code):
+    """Create an empty partition database with the state tables and seeded id ranges"""
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(PARTITION_SCHEMA)
+        ensure_schedule_versioning(conn.cursor())
+        base = _id_base(state_code)
+        conn.executemany(
+            "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+            [("region", base), ("fee_schedule", base), ("fee_schedule_rate", base)]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _copy_state_row(conn, source_file, state_code):
+    """Copy the state's row from another database file, in place of the placeholder the importers would add"""
+    conn.execute("ATTACH DATABASE ? AS source", (source_file,))
+    try:
+        conn.execute("INSERT OR REPLACE INTO main.state SELECT * FROM source.state WHERE state_code = ?", (state_code,))
+        conn.commit()
+    finally:
+        conn.execute("DETACH DATABASE source")
+
+
+def _staging_path(partition_dir, state_code):
+    os.makedirs(partition_dir, exist_ok=True)
+    path = f"{partition_path(partition_dir, state_code)}.{os.getpid()}.tmp"
+    for leftover in (path, f"{path}-journal", f"{path}-wal", f"{path}-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    return path
+
+
+def _publish(staging, target):
+    """Swap a finished partition file into place; readers see the old or the new file, never a mix"""
+    conn = sqlite3.connect(staging)
+    conn.execute("PRAGMA journal_mode=DELETE")  # fold any WAL back so the file stands alone
+    conn.close()
+    os.replace(staging, target)
+
+
+def split_state(database_file, partition_dir, state_code):
+    """Move one state's fee-schedule data out of the shared database into its partition file
+
+    Ids are copied as they are, so they stay unique across partitions. The
+    copy and the DELETEs from the shared database are one transaction over
+    both files: every reader sees the state in exactly one place. In WAL
+    mode SQLite commits the two files one after the other, not atomically,
+    so split during a quiet period. A partition that already holds fee
+    schedules is never overwritten.
+    """
+    state_code = _check_state(state_code)
+    target = partition_path(partition_dir, state_code)
+    if os.path.exists(target):
+        existing = sqlite3.connect(target)
+        try:
+            if existing.execute("SELECT 1 FROM fee_schedule LIMIT 1").fetchone():
+                raise ValueError(f"{state_code} already has a partition; reload or purge it instead")
+        finally:
+            existing.close()
+    else:
+        # An empty partition is published first, so the move below can write the final file
+        staging = _staging_path(partition_dir, state_code)
+        create_partition_file(staging, state_code)
+        _publish(staging, target)
+
+    conn = sqlite3.connect(database_file, timeout=60)
+    try:
+        ensure_schedule_versioning(conn.cursor())  # same fee_schedule columns on both sides
+        conn.commit()
+        conn.execute("ATTACH DATABASE ? AS part", (target,))
+        conn.execute("INSERT OR IGNORE INTO part.state SELECT * FROM main.state WHERE state_code = ?", (state_code,))
+        conn.execute("INSERT INTO part.fee_schedule SELECT * FROM main.fee_schedule WHERE state_code = ?", (state_code,))
+        conn.execute("INSERT INTO part.region SELECT * FROM main.region WHERE state_code = ?", (state_code,))
+        conn.execute("""
+            INSERT INTO part.zip_region_map
+            SELECT m.* FROM main.zip_region_map m JOIN part.region r ON r.region_id = m.region_id
+        """)
+        conn.execute("""
+            INSERT INTO part.fee_schedule_rate (id, fee_schedule_id, procedure_code, modifier, region_id, rate,
+                rate_unit, is_by_report, effective_date, last_updated, access_count, last_accessed)
+            SELECT r.id, r.fee_schedule_id, r.procedure_code, r.modifier, r.region_id, r.rate,
+                r.rate_unit, r.is_by_report, r.effective_date, r.last_updated, r.access_count, r.last_accessed
+            FROM main.fee_schedule_rate r JOIN part.fee_schedule f ON f.id = r.fee_schedule_id
+        """)
+        conn.execute("""
+            INSERT OR IGNORE INTO part.procedure_code
+            SELECT * FROM main.procedure_code
+            WHERE procedure_code IN (SELECT DISTINCT procedure_code FROM part.fee_schedule_rate)
+        """)
+        rows = conn.execute("SELECT COUNT(*) FROM part.fee_schedule_rate").fetchone()[0]
+
+        # Same transaction: the rows leave the shared database (its benchmark triggers see the deletes)
+        conn.execute("DELETE FROM main.fee_schedule_rate WHERE fee_schedule_id IN (SELECT id FROM part.fee_schedule)")
+        conn.execute("DELETE FROM main.zip_region_map WHERE region_id IN (SELECT region_id FROM part.region)")
+        conn.execute("DELETE FROM main.region WHERE state_code = ?", (state_code,))
+        conn.execute("DELETE FROM main.fee_schedule WHERE state_code = ?", (state_code,))
+        tables = {row[0] for row in conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'")}
+        for manifest in ("import_file_manifest", "import_row_manifest"):
+            if manifest in tables:
+                conn.execute(f"DELETE FROM main.{manifest} WHERE fee_schedule_id IN (SELECT id FROM part.fee_schedule)")
+        conn.commit()
+        conn.execute("DETACH DATABASE part")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    log_message(f"{state_code}: moved {rows} fee_schedule_rate rows into its partition")
+    return rows
+
+
+def reload_state(database_file, partition_dir, state_code, csv_files, mode="bulk"):
+    """Rebuild one state's partition from its fee schedule CSVs and swap it in
+
+    The files are imported into a fresh staging file with the regular
+    import_data_wcfs importers. The partition is replaced only if every file
+    imported cleanly, and no other state's file is touched. A state still
+    held by the shared database must be split first, or readers would see
+    it twice.
+    """
+    state_code = _check_state(state_code)
+    for file_path in csv_files:
+        file_state, _ = parse_csv_filename(file_path)
+        if file_state != state_code:
+            raise ValueError(f"{os.path.basename(file_path)} is not a {state_code} fee schedule")
+
+    main = connect_database(database_file)
+    try:
+        if state_in_main(main, state_code):
+            raise ValueError(f"{state_code} is still in the shared database; split it before reloading its partition")
+
+        staging = _staging_path(partition_dir, state_code)
+        create_partition_file(staging, state_code)
+        start = time.perf_counter()
+        conn = sqlite3.connect(staging)
+        try:
+            # Keep the state's real name and dates; the shared database still has the row split_state copied
+            target = partition_path(partition_dir, state_code)
+            _copy_state_row(conn, target if os.path.exists(target) else database_file, state_code)
+            for file_path in csv_files:
+                if not IMPORT_MODES[mode](conn, file_path):
+                    raise RuntimeError(f"Import failed for {os.path.basename(file_path)}")
+            rows = conn.execute("SELECT COUNT(*) FROM fee_schedule_rate").fetchone()[0]
+        except Exception:
+            conn.close()
+            os.remove(staging)
+            raise
+        conn.close()
+
+        # Codes of the old partition and of the new one both need new benchmarks
+        _queue_partition_codes(main, partition_dir, state_code)
+        _publish(staging, partition_path(partition_dir, state_code))
+        _queue_partition_codes(main, partition_dir, state_code)
+    finally:
+        main.close()
+    log_message(f"{state_code}: reloaded partition from {len(csv_files)} file(s), "
+                f"{rows} rates in {time.perf_counter() - start:.1f}s")
+    return rows
+
+
+def purge_state(database_file, partition_dir, state_code):
+    """Remove a state's partition; returns False if it had none
+
+    Refuses while the shared database still holds the state: removing only
+    the file would leave the state's rates live. The file is first renamed
+    out of the way, which is atomic, and only then deleted. A reader that
+    already has it open keeps its handle until it closes. On Windows the
+    rename fails while another process has the file open.
+    """
+    state_code = _check_state(state_code)
+    main = connect_database(database_file)
+    try:
+        if state_in_main(main, state_code):
+            raise ValueError(f"{state_code} is still in the shared database; delete it there (clean_state_data.py "
+                             f"without --partitioned) or split it first")
+        target = partition_path(partition_dir, state_code)
+        if not os.path.exists(target):
+            return False
+        _queue_partition_codes(main, partition_dir, state_code)
+        trash = f"{target}.{int(time.time())}.deleted"
+        os.replace(target, trash)
+        os.remove(trash)
+    finally:
+        main.close()
+    log_message(f"{state_code}: partition purged")
+    return True
+
+
+def publish_changes(database_file):
+    """Refresh rate_benchmark and rebuild the fee schedule snapshot after split, reload or purge
+
+    The web app serves from both, so partition changes are not visible until
+    this runs. The partition commands call it once after all their states.
+    """
+    conn = connect_database(database_file)
+    try:
+        refresh_rate_benchmarks(conn)
+        rebuild_fee_snapshot(conn)
+    finally:
+        conn.close()
+
+
+def attach_states(conn, partition_dir, state_codes):
+    """Attach a few state partitions to a connection and (re)create the <table>_all TEMP views
+
+    Each partitioned table is exposed as <table>_all, a UNION ALL of the
+    shared database's rows and the attached states' rows, e.g.
+    fee_schedule_rate_all. SQLite attaches at most MAX_ATTACHED databases
+    per connection, so this is for ad hoc queries over a handful of states.
+    Readers that need every state use read_partitions. Returns the attached
+    state codes.
+    """
+    available = list_partitions(partition_dir)
+    wanted = [_check_state(code) for code in state_codes]
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    new = [code for code in wanted if f"st_{code}" not in attached]
+    if len(attached - {"main", "temp"}) + len(new) > MAX_ATTACHED:
+        raise ValueError(f"SQLite attaches at most {MAX_ATTACHED} databases; use read_partitions to read every state")
+
+    states = []
+    for state_code in wanted:
+        if state_code not in available:
+            raise FileNotFoundError(f"No partition for {state_code} in {partition_dir}")
+        schema = f"st_{state_code}"
+        if schema not in attached:
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (partition_path(partition_dir, state_code),))
+        states.append(state_code)
+
+    for table in PARTITIONED_TABLES:
+        conn.execute(f"DROP VIEW IF EXISTS temp.{table}_all")
+        union = " UNION ALL ".join([f"SELECT * FROM main.{table}"]
+                                   + [f"SELECT * FROM st_{state_code}.{table}" for state_code in states])
+        conn.execute(f"CREATE TEMP VIEW {table}_all AS {union}")
+    return states
+
+
+def detach_states(conn, state_codes):
+    for state_code in state_codes:
+        conn.execute(f"DETACH DATABASE st_{_check_state(state_code)}")
+
+
+def connect_partitioned(database_file, partition_dir, state_codes):
+    """Open the shared database with the given state partitions attached"""
+    conn = sqlite3.connect(database_file)
+    attach_states(conn, partition_dir, state_codes)
+    return conn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage per-state fee schedule partition files (states/ next to the database)")
+    parser.add_argument("--db", type=str, default=db_path, help="Path to the shared SQLite database file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    split_parser = subparsers.add_parser("split", help="Move states from the shared database into partition files")
+    split_parser.add_argument("--states", type=str, required=True, help="Comma-separated state codes (e.g., GA,AL)")
+
+    reload_parser = subparsers.add_parser("reload", help="Rebuild one state's partition from CSV files")
+    reload_parser.add_argument("--state", type=str, required=True)
+    reload_parser.add_argument("files", nargs="+", help="Fee schedule CSVs for the state")
+    reload_parser.add_argument("--mode", choices=sorted(IMPORT_MODES), default="bulk")
+
+    purge_parser = subparsers.add_parser("purge", help="Remove state partitions")
+    purge_parser.add_argument("--states", type=str, required=True, help="Comma-separated state codes")
+
+    subparsers.add_parser("list", help="List state partitions")
+    args = parser.parse_args()
+
+    # Readers (the importer, snapshot, benchmarks, web app) look for partitions in this folder
+    partition_dir = default_partition_dir(args.db)
+    if args.command == "split":
+        for state_code in args.states.split(","):
+            split_state(args.db, partition_dir, state_code)
+        publish_changes(args.db)
+    elif args.command == "reload":
+        reload_state(args.db, partition_dir, args.state, args.files, args.mode)
+        publish_changes(args.db)
+    elif args.command == "purge":
+        for state_code in args.states.split(","):
+            if not purge_state(args.db, partition_dir, state_code):
+                log_message(f"{state_code.strip().upper()}: no partition")
+        publish_changes(args.db)
+    else:
+        for state_code in list_partitions(partition_dir):
+            print(state_code, os.path.getsize(partition_path(partition_dir, state_code)))
@@ -1,60 +1,147 @@
-import geopandas as gpd
-import zipfile
-import sqlite3
+import argparse
 import os
-import tempfile
-import pandas as pd
+import sqlite3
+import struct
+import time
+import tracemalloc
+import zipfile
+from datetime import datetime
 
 # --- CONFIG ---
 zip_path = r"C:\Users\ChristopherCato\Downloads\tl_2020_us_zcta520.zip"
 db_path = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db"
 
-# --- UNZIP TO TEMP FOLDER ---
-with tempfile.TemporaryDirectory() as tmpdir:
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(tmpdir)
-
-    # Find the .shp file inside the extracted files
-    shp_path = [os.path.join(tmpdir, f) for f in os.listdir(tmpdir) if f.endswith(".shp")][0]
-
-    # Load shapefile into GeoDataFrame
-    gdf = gpd.read_file(shp_path)
-    print("🧠 Available columns in shapefile:")
-    print(gdf.columns.tolist())
-
-    # Extract needed fields
-    df = gdf[["ZCTA5CE20", "INTPTLAT20", "INTPTLON20"]].copy()
-    df = df.rename(columns={
-        "ZCTA5CE20": "zip_code",
-        "INTPTLAT20": "latitude",
-        "INTPTLON20": "longitude"
-    })
-    df["latitude"] = pd.to_numeric(df["latitude"], errors="coerce")
-    df["longitude"] = pd.to_numeric(df["longitude"], errors="coerce")
-
-# --- INSERT INTO SQLITE ---
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
-
-# Add columns if missing
-try:
-    cursor.execute("ALTER TABLE zip_code ADD COLUMN latitude REAL;")
-except sqlite3.OperationalError:
-    pass  # column already exists
-
-try:
-    cursor.execute("ALTER TABLE zip_code ADD COLUMN longitude REAL;")
-except sqlite3.OperationalError:
-    pass  # column already exists
-
-# Merge into zip_code table
-for _, row in df.iterrows():
+# Attribute columns in the 2020 ZCTA shapefile
+ZIP_FIELD = "ZCTA5CE20"
+LAT_FIELD = "INTPTLAT20"
+LON_FIELD = "INTPTLON20"
+BATCH_SIZE = 5000
+
+
+def log_message(message):
+    """Print a timestamped log message"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+
+def read_dbf_records(stream, fields, encoding="utf-8"):
+    """Yield tuples of the requested fields from a dBASE (.dbf) stream
+
+    Only the shapefile's attribute table is read; no geometry is parsed.
+    Records are decoded one at a time, so memory stays flat however many
+    rows the file has.
+    """
+    header = stream.read(32)
+    record_count, header_length, record_length = struct.unpack("<IHH", header[4:12])
+
+    descriptors = stream.read(header_length - 32)
+    layout = {}
+    offset = 1  # each record starts with a deletion flag
+    for position in range(0, len(descriptors) - 31, 32):
+        descriptor = descriptors[position:position + 32]
+        if descriptor[0] == 0x0D:
+            break  # end of field descriptors
+        name = descriptor[:11].split(b"\x00")[0].decode("ascii")
+        length = descriptor[16]
+        layout[name] = (offset, offset + length)
+        offset += length
+
+    missing = [field for field in fields if field not in layout]
+    if missing:
+        raise ValueError(f"Fields not found in DBF: {missing}; available: {list(layout)}")
+    slices = [layout[field] for field in fields]
+
+    for _ in range(record_count):
+        record = stream.read(record_length)
+        if len(record) < record_length:
+            break
+        if record[:1] == b"*":
+            continue  # deleted
+        yield tuple(record[start:end].decode(encoding).strip() for start, end in slices)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def read_centroids(zip_path):
+    """Yield (zip_code, latitude, longitude) from the .dbf inside the ZCTA shapefile zip"""
+    with zipfile.ZipFile(zip_path) as archive:
+        names = archive.namelist()
+        dbf_name = next(name for name in names if name.lower().endswith(".dbf"))
+        cpg_name = os.path.splitext(dbf_name)[0] + ".cpg"
+        encoding = "utf-8"
+        if cpg_name in names:
+            encoding = archive.read(cpg_name).decode("ascii").strip() or encoding
+
+        with archive.open(dbf_name) as stream:
+            for zip_code, lat, lon in read_dbf_records(stream, [ZIP_FIELD, LAT_FIELD, LON_FIELD], encoding):
+                yield zip_code, _to_float(lat), _to_float(lon)
+
+
+def load_centroids(conn, centroids):
+    """Stream centroids into a temp table and merge them into zip_code with one UPDATE
+
+    Returns (rows staged, zip_code rows updated).
+    """
+    cursor = conn.cursor()
+
+    # Add columns if missing
+    for column in ("latitude", "longitude"):
+        try:
+            cursor.execute(f"ALTER TABLE zip_code ADD COLUMN {column} REAL")
+        except sqlite3.OperationalError:
+            pass  # column already exists
+
+    cursor.execute("DROP TABLE IF EXISTS temp.zip_centroid_staging")
+    cursor.execute("""
+        CREATE TEMP TABLE zip_centroid_staging (
+            zip_code TEXT PRIMARY KEY,
+            latitude REAL,
+            longitude REAL
+        )
+    """)
+
+    staged = 0
+    batch = []
+    for row in centroids:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            cursor.executemany("INSERT OR REPLACE INTO zip_centroid_staging VALUES (?, ?, ?)", batch)
+            staged += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany("INSERT OR REPLACE INTO zip_centroid_staging VALUES (?, ?, ?)", batch)
+        staged += len(batch)
+
     cursor.execute("""
         UPDATE zip_code
-        SET latitude = ?, longitude = ?
-        WHERE zip_code = ?
-    """, (row["latitude"], row["longitude"], row["zip_code"]))
+        SET latitude = s.latitude, longitude = s.longitude
+        FROM zip_centroid_staging AS s
+        WHERE zip_code.zip_code = s.zip_code
+    """)
+    updated = cursor.rowcount
+    conn.commit()
+    cursor.execute("DROP TABLE temp.zip_centroid_staging")
+    return staged, updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load Census ZCTA centroids into zip_code.latitude/longitude")
+    parser.add_argument("--zip", type=str, default=zip_path, help="Path to the tl_*_zcta5*.zip shapefile archive")
+    parser.add_argument("--db", type=str, default=db_path, help="Path to the SQLite database file")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    conn = sqlite3.connect(args.db)
+    staged, updated = load_centroids(conn, read_centroids(args.zip))
+    conn.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
 
-conn.commit()
-conn.close()
-print("✅ ZIP centroid coordinates successfully added from Census shapefile.")
+    log_message(f"Staged {staged} centroids, updated {updated} zip_code rows "
+                f"in {time.perf_counter() - start:.2f}s (peak Python memory {peak / 1e6:.1f} MB)")
@@ -1,46 +1,250 @@
-import pandas as pd
+import argparse
 import sqlite3
-from geopy.geocoders import Nominatim
-from time import sleep
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 
 # DB + input
 db_path = r"C:\Users\ChristopherCato\OneDrive - clarity-dx.com\compensation-fee-schedule-app\data\compensation_rates.db"
-conn = sqlite3.connect(db_path)
 
-# Get ZIPs from DB
-df_zips = pd.read_sql("SELECT zip_code FROM zip_code where state_code = 'CA' or state_code = 'FL' or state_code = 'GA' limit 15", conn)
-df_zips = df_zips.drop_duplicates().reset_index(drop=True)
+# Results that are final; errors are retried on the next run
+DONE_STATUSES = ("ok", "not_found")
 
-# Setup geocoder
-geolocator = Nominatim(user_agent="zip-code-enricher")
 
-# Add new columns
-df_zips["city"] = ""
-df_zips["county"] = ""
-df_zips["state"] = ""
-df_zips["latitude"] = None
-df_zips["longitude"] = None
+def log_message(message):
+    """Print a timestamped log message"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{timestamp}] {message}")
 
-for idx, row in df_zips.iterrows():
-    zip_code = row["zip_code"]
+
+class NominatimGeocoder:
+    """OpenStreetMap Nominatim; the public service allows 1 request per second"""
+    name = "nominatim"
+    default_rate = 1.0
+
+    def __init__(self, user_agent="zip-code-enricher", timeout=10):
+        from geopy.geocoders import Nominatim
+        self.geolocator = Nominatim(user_agent=user_agent)
+        self.timeout = timeout
+
+    def geocode(self, zip_code):
+        location = self.geolocator.geocode(
+            {"postalcode": zip_code, "country": "USA"}, addressdetails=True, timeout=self.timeout
+        )
+        if not location:
+            return None
+        addr = location.raw.get("address") or {}
+        return {
+            "city": addr.get("city", addr.get("town", addr.get("village", ""))),
+            "county": addr.get("county", ""),
+            "state": addr.get("state", ""),
+            "latitude": location.latitude,
+            "longitude": location.longitude,
+        }
+
+
+class StubGeocoder:
+    """Offline geocoder with deterministic fake results, for tests and dry runs"""
+    name = "stub"
+    default_rate = 1000.0
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def geocode(self, zip_code):
+        if self.latency:
+            time.sleep(self.latency)
+        if zip_code.endswith("00"):
+            return None  # exercise the not-found path
+        number = int(zip_code)
+        return {
+            "city": f"City {zip_code}",
+            "county": f"County {zip_code[:3]}",
+            "state": "",
+            "latitude": 25 + (number % 2400) / 100,
+            "longitude": -125 + (number % 5800) / 100,
+        }
+
+
+GEOCODERS = {
+    NominatimGeocoder.name: NominatimGeocoder,
+    StubGeocoder.name: StubGeocoder,
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def ensure_tables(conn):
+    """Create the geocode cache and the enriched output table"""
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS geocode_cache (
+        zip_code VARCHAR(10) NOT NULL,
+        provider VARCHAR(20) NOT NULL,
+        status VARCHAR(10) NOT NULL,
+        city VARCHAR(100),
+        county VARCHAR(100),
+        state VARCHAR(50),
+        latitude REAL,
+        longitude REAL,
+        error TEXT,
+        fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (zip_code, provider)
+    );
+
+    CREATE TABLE IF NOT EXISTS zip_code_enriched (
+        zip_code VARCHAR(10) PRIMARY KEY,
+        city VARCHAR(100),
+        county VARCHAR(100),
+        state VARCHAR(50),
+        latitude REAL,
+        longitude REAL
+    );
+
+    -- Tables written by older versions of this script (to_sql) have no key
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_zip_code_enriched_zip ON zip_code_enriched(zip_code);
+    """)
+    conn.commit()
+
+
+def pending_zips(conn, provider, states=None, limit=None):
+    """ZIPs from zip_code with no final cached result for this provider"""
+    sql = """
+        SELECT DISTINCT z.zip_code FROM zip_code z
+        WHERE NOT EXISTS (
+            SELECT 1 FROM geocode_cache c
+            WHERE c.zip_code = z.zip_code AND c.provider = ? AND c.status IN (?, ?)
+        )
+    """
+    params = [provider, *DONE_STATUSES]
+    if states:
+        sql += f" AND z.state_code IN ({','.join('?' * len(states))})"
+        params.extend(states)
+    sql += " ORDER BY z.zip_code"
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return [row[0] for row in conn.execute(sql, params)]
+
+
+def save_results(conn, provider, results):
+    """Write a batch of lookups to the cache and publish the successful ones"""
+    conn.executemany("""
+        INSERT INTO geocode_cache
+        (zip_code, provider, status, city, county, state, latitude, longitude, error, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (zip_code, provider) DO UPDATE SET
+            status = excluded.status, city = excluded.city, county = excluded.county,
+            state = excluded.state, latitude = excluded.latitude, longitude = excluded.longitude,
+            error = excluded.error, fetched_at = excluded.fetched_at
+    """, [
+        (zip_code, provider, status, data.get("city"), data.get("county"), data.get("state"),
+         data.get("latitude"), data.get("longitude"), error)
+        for zip_code, status, data, error in results
+    ])
+    conn.executemany("""
+        INSERT INTO zip_code_enriched (zip_code, city, county, state, latitude, longitude)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (zip_code) DO UPDATE SET
+            city = excluded.city, county = excluded.county, state = excluded.state,
+            latitude = excluded.latitude, longitude = excluded.longitude
+    """, [
+        (zip_code, data["city"], data["county"], data["state"], data["latitude"], data["longitude"])
+        for zip_code, status, data, _ in results if status == "ok"
+    ])
+    conn.commit()
+
+
+def _lookup(geocoder, bucket, zip_code):
+    bucket.acquire()
     try:
-        location = geolocator.geocode({"postalcode": zip_code, "country": "USA"}, timeout=10)
-        if location:
-            df_zips.at[idx, "latitude"] = location.latitude
-            df_zips.at[idx, "longitude"] = location.longitude
-
-            if location.raw.get("address"):
-                addr = location.raw["address"]
-                df_zips.at[idx, "city"] = addr.get("city", addr.get("town", ""))
-                df_zips.at[idx, "county"] = addr.get("county", "")
-                df_zips.at[idx, "state"] = addr.get("state", "")
-        
-        print(f"✅ Enriched {zip_code}")
+        data = geocoder.geocode(zip_code)
     except Exception as e:
-        print(f"❌ Error with {zip_code}: {e}")
-    sleep(1)  # avoid hammering the OSM API (courtesy delay)
+        return zip_code, "error", {}, str(e)
+    if data is None:
+        return zip_code, "not_found", {}, None
+    return zip_code, "ok", data, None
+
 
-# Save to new table
-df_zips.to_sql("zip_code_enriched", conn, if_exists="replace", index=False)
-print("✅ Enriched ZIP data saved to zip_code_enriched")
-conn.close()
+def enrich(conn, geocoder, rate=None, workers=2, states=None, limit=None, checkpoint_every=100):
+    """Geocode every ZIP without a cached result, checkpointing as results arrive
+
+    Lookups run on `workers` threads that share one token bucket, so the
+    provider never sees more than `rate` requests per second. Results are
+    committed every `checkpoint_every` lookups (and on Ctrl+C); a rerun picks
+    up only the ZIPs that are still missing or failed.
+    """
+    ensure_tables(conn)
+    zips = pending_zips(conn, geocoder.name, states, limit)
+    rate = rate or geocoder.default_rate
+    log_message(f"{len(zips)} ZIPs to geocode with {geocoder.name} at {rate}/s on {workers} worker(s)")
+
+    bucket = TokenBucket(rate)
+    counts = {"ok": 0, "not_found": 0, "error": 0}
+    batch = []
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(_lookup, geocoder, bucket, zip_code) for zip_code in zips]
+        for future in as_completed(futures):
+            result = future.result()
+            counts[result[1]] += 1
+            if result[1] == "error":
+                log_message(f"Error with {result[0]}: {result[3]}")
+            batch.append(result)
+            if len(batch) >= checkpoint_every:
+                save_results(conn, geocoder.name, batch)
+                batch = []
+                done = sum(counts.values())
+                log_message(f"Checkpoint: {done}/{len(zips)} ({done / (time.perf_counter() - start):.1f}/s)")
+    except KeyboardInterrupt:
+        log_message("Interrupted; saving progress")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        if batch:
+            save_results(conn, geocoder.name, batch)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    log_message(f"Done: {counts['ok']} enriched, {counts['not_found']} not found, {counts['error']} errors "
+                f"in {time.perf_counter() - start:.1f}s")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrich zip_code with geocoder results into zip_code_enriched")
+    parser.add_argument("--db", type=str, default=db_path, help="Path to the SQLite database file")
+    parser.add_argument("--provider", choices=sorted(GEOCODERS), default=NominatimGeocoder.name, help="Geocoder backend")
+    parser.add_argument("--rate", type=float, help="Max requests per second (default: provider's limit)")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent lookup threads")
+    parser.add_argument("--state", action="append", help="Only ZIPs in this state (repeatable)")
+    parser.add_argument("--limit", type=int, help="Max ZIPs to look up this run")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="Commit results every N lookups")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    try:
+        enrich(conn, GEOCODERS[args.provider](), args.rate, args.workers, args.state, args.limit, args.checkpoint_every)
+    finally:
+        conn.close()
@@ -0,0 +1,180 @@
+import atexit
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import insert, text
+
+from models import db, RateQuery
+import rollups
+
+
+class AccessCounter:
+    """Buffer CachedRate access counts and RateQuery log rows in memory and flush them in batches"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.flush_interval = 2.0
+        self.flush_threshold = 5000
+        self.max_buffered_queries = 100000
+        self._pending = defaultdict(int)
+        self._last_accessed = {}
+        self._queries = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('ACCESS_COUNT_FLUSH_INTERVAL', self.flush_interval)
+        self.flush_threshold = app.config.get('ACCESS_COUNT_FLUSH_THRESHOLD', self.flush_threshold)
+        self.max_buffered_queries = app.config.get('ACCESS_COUNT_MAX_BUFFERED_QUERIES', self.max_buffered_queries)
+        app.extensions['access_counter'] = self
+        atexit.register(self.shutdown)
+
+    def record(self, state, procedure_code, row_ids):
+        """Record one hit for each cached row returned for (state, procedure_code)"""
+        now = datetime.utcnow()
+        with self._lock:
+            for row_id in row_ids:
+                self._pending[(state, procedure_code, row_id)] += 1
+                self._last_accessed[row_id] = now
+            pending_rows = len(self._pending) + len(self._queries)
+
+        self._ensure_worker()
+        if pending_rows >= self.flush_threshold:
+            self._wake.set()
+
+    def log_query(self, state, procedure_code, result_count, cache_hit):
+        """Queue a RateQuery log row to be inserted with the next flush"""
+        self.log_queries([(state, procedure_code, result_count, cache_hit)])
+
+    def log_queries(self, entries):
+        """Queue several (state, procedure_code, result_count, cache_hit) log rows at once"""
+        now = datetime.utcnow()
+        with self._lock:
+            self._queries.extend({
+                'state': state,
+                'procedure_code': procedure_code,
+                'query_date': now,
+                'result_count': result_count,
+                'cache_hit': cache_hit
+            } for state, procedure_code, result_count, cache_hit in entries)
+            pending_rows = len(self._pending) + len(self._queries)
+
+        self._ensure_worker()
+        if pending_rows >= self.flush_threshold:
+            self._wake.set()
+
+    def pending(self):
+        """Return the number of rows waiting to be flushed"""
+        with self._lock:
+            return len(self._pending) + len(self._queries)
+
+    def _drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(int)
+            last_accessed, self._last_accessed = self._last_accessed, {}
+            queries, self._queries = self._queries, []
+        return pending, last_accessed, queries
+
+    def flush(self):
+        """Write all buffered hits and query log rows, with their rollups, in one transaction
+
+        Returns the number of cached_rate and rate_query rows written.
+        """
+        pending, last_accessed, queries = self._drain()
+        if not pending and not queries:
+            return 0
+
+        params = [{
+            'id': row_id,
+            'hits': hits,
+            'accessed': last_accessed[row_id]
+        } for (_, _, row_id), hits in pending.items()]
+
+        try:
+            if params:
+                db.session.execute(
+                    text(
+                        "UPDATE cached_rate "
+                        "SET access_count = COALESCE(access_count, 0) + :hits, last_accessed = :accessed "
+                        "WHERE id = :id"
+                    ),
+                    params
+                )
+                rollups.apply_access_hits(pending, last_accessed)
+            if queries:
+                db.session.execute(insert(RateQuery.__table__), queries)
+                rollups.apply_queries(queries)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # Retried on the next flush; the rollups and /api/stats are built from the query log too
+            dropped = self._requeue(pending, last_accessed, queries)
+            if self.app is not None:
+                self.app.logger.error(f"Error flushing access counts: {str(e)}")
+                if dropped:
+                    self.app.logger.error(f"Dropped {dropped} oldest query log rows over the {self.max_buffered_queries}-row buffer limit")
+            return 0
+
+        return len(params) + len(queries)
+
+    def _requeue(self, pending, last_accessed, queries):
+        """Put a failed batch back for the next flush; returns how many query log rows were dropped
+
+        Access counts are bounded by the number of cached rows, but the query
+        log grows with every request, so during a database outage only the
+        newest max_buffered_queries rows are kept.
+        """
+        with self._lock:
+            # Ahead of anything logged since the drain, so rows stay in query_date order
+            self._queries[:0] = queries
+            dropped = max(0, len(self._queries) - self.max_buffered_queries)
+            if dropped:
+                del self._queries[:dropped]
+            for key, hits in pending.items():
+                self._pending[key] += hits
+            for row_id, accessed in last_accessed.items():
+                if row_id not in self._last_accessed or self._last_accessed[row_id] < accessed:
+                    self._last_accessed[row_id] = accessed
+        return dropped
+
+    def _ensure_worker(self):
+        # Started lazily so each forked gunicorn worker gets its own flusher
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='access-counter-flush',
+                daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush_in_context()
+
+    def _flush_in_context(self):
+        if self.app is None:
+            return 0
+        with self.app.app_context():
+            return self.flush()
+
+    def shutdown(self):
+        """Flush whatever is still buffered; called on worker exit"""
+        if self.pending():
+            self._flush_in_context()
+
+
+access_counter = AccessCounter()
@@ -1,18 +1,50 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
-from models import db, RateQuery, CachedRate
+from models import db, CachedRate
+from access_counter import access_counter
+from bulk_load import replace_cached_rates
+from rate_cache import rate_cache
+from refresh import refresh_scheduler
+from batch_lookup import parse_batch_items, lookup_rates_batch
+from as_of_lookup import parse_as_of_items, lookup_as_of_batch
+from zip_index import zip_resolver, connect_readonly, parse_zip
+from spatial_index import commercial_rates_near
+from rate_benchmarks import benchmark_lookup
+from fee_snapshot import fee_snapshots
+from metrics import metrics
+from cache_eviction import cache_evictor
+from cache_warming import cache_warmer
+import rollups
 import boto3
-import pandas as pd
-import io
-from datetime import datetime, timedelta
+import click
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
+from datetime import datetime, timezone
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
 # Initialize database
 db.init_app(app)
+access_counter.init_app(app)
+rate_cache.init_app(app)
+zip_resolver.init_app(app)
+fee_snapshots.init_app(app)
+cache_evictor.init_app(app)
+metrics.init_app(app)
+metrics.gauge('rate_cache_stats', 'In-process /api/rates response cache counters', rate_cache.stats)
+metrics.gauge('access_counter_pending', 'Buffered access counts and query log rows awaiting flush',
+              access_counter.pending)
+metrics.gauge('cache_eviction_totals', 'CachedRate eviction sweeps, keys, rows and approximate bytes reclaimed',
+              lambda: {key: value for key, value in cache_evictor.stats().items()
+                       if key in ('sweeps', 'keys_evicted', 'rows_evicted', 'approx_bytes_reclaimed')})
+metrics.gauge('fee_snapshot_memory_bytes', 'Fee schedule snapshot file size and this worker\'s resident, proportional and private share of it',
+              fee_snapshots.memory)
+metrics.gauge('cache_warming_last_run', 'Keys fetched, failed and primed by the last cache warming run',
+              lambda: {key: value for key, value in (cache_warmer.status()['last_run'] or {}).items()
+                       if key in ('keys', 'fetched', 'failed', 'primed', 'duration_s')})
 
 # AWS S3 Configuration
 s3_client = boto3.client(
@@ -26,36 +58,41 @@ def update_cache_from_s3(state, procedure_code):
     """Update cache from S3 if data is older than 24 hours"""
     try:
         s3_key = f'rates/{state}/{procedure_code}.parquet'
-        response = s3_client.get_object(
-            Bucket=app.config['S3_BUCKET'],
-            Key=s3_key
-        )
-        parquet_data = response['Body'].read()
-        df = pd.read_parquet(io.BytesIO(parquet_data))
-        
-        # Delete old cache entries
-        CachedRate.query.filter_by(
-            state=state,
-            procedure_code=procedure_code
-        ).delete()
-        
-        # Add new entries
-        for _, row in df.iterrows():
-            cached_rate = CachedRate(
-                state=state,
-                procedure_code=procedure_code,
-                provider=row.get('provider'),
-                rate=row.get('rate'),
-                effective_date=row.get('date')
+        with metrics.track_s3('get_object') as s3_call:
+            response = s3_client.get_object(
+                Bucket=app.config['S3_BUCKET'],
+                Key=s3_key
             )
-            db.session.add(cached_rate)
+            parquet_data = response['Body'].read()
+            s3_call['bytes'] = len(parquet_data)
+        table = pq.read_table(pa.BufferReader(parquet_data))
         
-        db.session.commit()
+        # Delete old cache entries and bulk load the new ones in one transaction
+        replace_cached_rates(state, procedure_code, table)
+        rate_cache.invalidate(state, procedure_code)
         return True
     except Exception as e:
         app.logger.error(f"Error updating cache from S3: {str(e)}")
         return False
 
+def last_publication():
+    """When the S3 publication marker was last written (naive UTC), or None"""
+    if not app.config['CACHE_WARM_PUBLISH_KEY']:
+        return None
+    try:
+        with metrics.track_s3('head_object'):
+            response = s3_client.head_object(
+                Bucket=app.config['S3_BUCKET'],
+                Key=app.config['CACHE_WARM_PUBLISH_KEY']
+            )
+        return response['LastModified'].astimezone(timezone.utc).replace(tzinfo=None)
+    except Exception as e:
+        app.logger.error(f"Error reading publication marker from S3: {str(e)}")
+        return None
+
+refresh_scheduler.init_app(app, update_cache_from_s3)
+cache_warmer.init_app(app, last_publication if app.config['CACHE_WARM_PUBLISH_KEY'] else None)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -63,14 +100,28 @@ def index():
 @app.route('/api/rates/<state>/<procedure_code>')
 def get_rates(state, procedure_code):
     try:
+        # Hot keys are answered from the in-process cache without touching the database
+        cached = rate_cache.get(state, procedure_code)
+        if cached is not None:
+            row_ids, results = cached
+            metrics.rate_lookup('memory')
+            access_counter.record(state, procedure_code, row_ids)
+            access_counter.log_query(state, procedure_code, len(results), cache_hit=True)
+            return jsonify(results)
+        
         # Check if we need to update cache
-        last_update = CachedRate.query.filter_by(
-            state=state,
-            procedure_code=procedure_code
-        ).order_by(CachedRate.last_updated.desc()).first()
+        last_updated = refresh_scheduler.last_updated(state, procedure_code)
         
-        if not last_update or (datetime.utcnow() - last_update.last_updated) > timedelta(hours=24):
-            update_cache_from_s3(state, procedure_code)
+        cache_hit = True
+        stale = refresh_scheduler.is_stale(last_updated)
+        if last_updated is None:
+            # Nothing to serve yet: wait for the (single, shared) S3 fetch
+            refresh_scheduler.refresh_now(state, procedure_code)
+            cache_hit = False
+            stale = False
+        elif stale:
+            # Serve the stale rows now and refresh once in the background
+            refresh_scheduler.submit(state, procedure_code)
         
         # Get rates from cache
         cached_rates = CachedRate.query.filter_by(
@@ -78,48 +129,249 @@ def get_rates(state, procedure_code):
             procedure_code=procedure_code
         ).all()
         
-        # Increment access count for each rate
-        for rate in cached_rates:
-            rate.increment_access()
+        results = [rate.to_dict() for rate in cached_rates]
+        row_ids = [rate.id for rate in cached_rates]
+        metrics.rate_lookup('database' if cache_hit else 's3')
+        if not stale:
+            rate_cache.set(state, procedure_code, (row_ids, results))
         
-        # Log the query
-        query = RateQuery(
-            state=state,
-            procedure_code=procedure_code,
-            result_count=len(cached_rates),
-            cache_hit=True
-        )
-        db.session.add(query)
-        db.session.commit()
+        # Buffer access counts and the query log; they are flushed in batches in the background
+        access_counter.record(state, procedure_code, row_ids)
+        access_counter.log_query(state, procedure_code, len(results), cache_hit=cache_hit)
         
-        return jsonify([{
-            'provider': rate.provider,
-            'rate': float(rate.rate),
-            'date': rate.effective_date.isoformat()
-        } for rate in cached_rates])
+        return jsonify(results)
             
     except Exception as e:
         app.logger.error(f"Error in get_rates: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/rates/batch', methods=['POST'])
+def get_rates_batch():
+    try:
+        items = parse_batch_items(
+            request.get_json(silent=True),
+            app.config['RATES_BATCH_MAX_ITEMS']
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        return jsonify({'results': lookup_rates_batch(items)})
+    except Exception as e:
+        app.logger.error(f"Error in get_rates_batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/rates/as-of', methods=['POST'])
+def get_rates_as_of_batch():
+    try:
+        items = parse_as_of_items(
+            request.get_json(silent=True),
+            app.config['RATES_BATCH_MAX_ITEMS']
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        include_cached = request.args.get('cached', 'true').lower() != 'false'
+        results = lookup_as_of_batch(items, fee_snapshots.get(), zip_resolver, include_cached)
+        return jsonify({'results': results})
+    except Exception as e:
+        app.logger.error(f"Error in get_rates_as_of_batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/rates/<state>/<procedure_code>/as-of/<service_date>')
+def get_rates_as_of(state, procedure_code, service_date):
+    item = {'state': state, 'procedure_code': procedure_code, 'service_date': service_date}
+    for field in ('modifier', 'schedule_type', 'zip', 'carrier_code', 'locality_code'):
+        item[field] = request.args.get(field)
+    try:
+        item['region_id'] = request.args.get('region_id', type=int)
+        items = parse_as_of_items([item], 1)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        include_cached = request.args.get('cached', 'true').lower() != 'false'
+        result = lookup_as_of_batch(items, fee_snapshots.get(), zip_resolver, include_cached)[0]
+        if not result['wc_matches'] and result['medicare'] is None and not result['cached_rates']:
+            return jsonify({'error': f"No rates in effect on {result['service_date']}"}), 404
+        return jsonify(result)
+    except Exception as e:
+        app.logger.error(f"Error in get_rates_as_of: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/zip/<zip_code>')
+def get_zip(zip_code):
+    try:
+        result = zip_resolver.resolve(zip_code)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Error in get_zip: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    if result is None:
+        return jsonify({'error': f"Unknown ZIP code: {zip_code}"}), 404
+    return jsonify(result)
+
+@app.route('/api/zip/stats')
+def get_zip_stats():
+    try:
+        stats = zip_resolver.get_index().stats()
+        centroids = zip_resolver.get_centroids()
+        stats['centroids'] = len(centroids)
+        stats['centroid_memory_bytes'] = centroids.memory_bytes()
+        return jsonify(stats)
+    except Exception as e:
+        app.logger.error(f"Error in get_zip_stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/zip/<zip_code>/nearest')
+def get_nearest_zips(zip_code):
+    try:
+        zip_code = f"{parse_zip(zip_code):05d}"
+        k = min(request.args.get('k', 10, type=int), 1000)
+        miles = request.args.get('miles', type=float)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        centroids = zip_resolver.get_centroids()
+        origin = centroids.centroid(zip_code)
+        if origin is None:
+            return jsonify({'error': f"No centroid for ZIP code: {zip_code}"}), 404
+        found = centroids.within(*origin, miles) if miles else centroids.nearest(*origin, k + 1)
+        found = [(z, d) for z, d in found if z != zip_code][:k]
+        return jsonify([{'zip_code': z, 'distance_miles': round(d, 2)} for z, d in found])
+    except Exception as e:
+        app.logger.error(f"Error in get_nearest_zips: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/commercial/<procedure_code>/near/<zip_code>')
+def get_commercial_rates_near(procedure_code, zip_code):
+    try:
+        zip_code = f"{parse_zip(zip_code):05d}"
+        miles = min(request.args.get('miles', 25, type=float), 500)
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        conn = connect_readonly(app.config['RATES_DATABASE'])
+        try:
+            results = commercial_rates_near(
+                conn, zip_resolver.get_centroids(), zip_code, procedure_code, miles, limit
+            )
+        finally:
+            conn.close()
+        if results is None:
+            return jsonify({'error': f"No centroid for ZIP code: {zip_code}"}), 404
+        return jsonify(results)
+    except Exception as e:
+        app.logger.error(f"Error in get_commercial_rates_near: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/benchmark/<state>/<procedure_code>')
+def get_rate_benchmark(state, procedure_code):
+    state = state.upper()
+    modifier = request.args.get('modifier')
+    location = None
+    zip_code = request.args.get('zip')
+    if zip_code:
+        try:
+            location = zip_resolver.resolve(zip_code)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if location is None:
+            return jsonify({'error': f"Unknown ZIP code: {zip_code}"}), 404
+    
+    try:
+        conn = connect_readonly(app.config['RATES_DATABASE'])
+        try:
+            results = benchmark_lookup(conn, state, procedure_code, modifier, location)
+        finally:
+            conn.close()
+        if not results:
+            return jsonify({'error': 'No benchmark found'}), 404
+        return jsonify(results)
+    except Exception as e:
+        app.logger.error(f"Error in get_rate_benchmark: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fee-schedule/<state>/<procedure_code>')
+def get_fee_schedule_rates(state, procedure_code):
+    state = state.upper()
+    region_ids = None
+    zip_code = request.args.get('zip')
+    if zip_code:
+        try:
+            location = zip_resolver.resolve(zip_code)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if location is None:
+            return jsonify({'error': f"Unknown ZIP code: {zip_code}"}), 404
+        region_ids = {None, *location['region_ids']}
+    
+    try:
+        results = fee_snapshots.get().rates_for_code(
+            state, procedure_code, request.args.get('modifier'), request.args.get('schedule')
+        )
+        if region_ids is not None:
+            # Statewide rates plus the ZIP's WC regions
+            results = [rate for rate in results if rate['region_id'] in region_ids]
+        if not results:
+            return jsonify({'error': 'No fee schedule rate found'}), 404
+        return jsonify(results)
+    except Exception as e:
+        app.logger.error(f"Error in get_fee_schedule_rates: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fee-schedule/batch', methods=['POST'])
+def get_fee_schedule_batch():
+    payload = request.get_json(silent=True)
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Request body must be a non-empty list of lookups or {"items": [...]}'}), 400
+    if len(items) > app.config['RATES_BATCH_MAX_ITEMS']:
+        return jsonify({'error': f"Too many lookups in one batch ({len(items)} > {app.config['RATES_BATCH_MAX_ITEMS']})"}), 400
+    fields = ('state', 'schedule_type', 'procedure_code', 'modifier', 'region_id')
+    columns = {field: [] for field in fields}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not all(item.get(field) for field in fields[:3]):
+            return jsonify({'error': f"Item {index} must be an object with state, schedule_type and procedure_code"}), 400
+        for field in fields:
+            columns[field].append(item.get(field))
+    columns['state'] = [str(state).upper() for state in columns['state']]
+    
+    try:
+        snapshot = fee_snapshots.get()
+        # Regional rate where the region has one, else the statewide rate
+        indexes = snapshot.lookup_many(
+            columns['state'], columns['schedule_type'], columns['procedure_code'],
+            columns['modifier'], columns['region_id']
+        )
+        return jsonify({'results': [snapshot.row(index) if index >= 0 else None for index in indexes]})
+    except Exception as e:
+        app.logger.error(f"Error in get_fee_schedule_batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fee-schedule/stats')
+def get_fee_schedule_stats():
+    try:
+        fee_snapshots.get()
+        return jsonify(fee_snapshots.stats())
+    except Exception as e:
+        app.logger.error(f"Error in get_fee_schedule_stats: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/stats')
 def get_stats():
     try:
-        # Get most frequently accessed rates
-        popular_rates = db.session.query(
-            CachedRate.state,
-            CachedRate.procedure_code,
-            db.func.sum(CachedRate.access_count).label('total_accesses')
-        ).group_by(
-            CachedRate.state,
-            CachedRate.procedure_code
-        ).order_by(
-            db.func.sum(CachedRate.access_count).desc()
-        ).limit(10).all()
+        # Read the incrementally maintained rollups instead of scanning the logs
+        popular_rates = rollups.top_rates(10)
         
         # Get cache hit rate
-        total_queries = RateQuery.query.count()
-        cache_hits = RateQuery.query.filter_by(cache_hit=True).count()
+        total_queries, cache_hits = rollups.query_totals()
         hit_rate = (cache_hits / total_queries * 100) if total_queries > 0 else 0
         
         return jsonify({
@@ -132,13 +384,68 @@ def get_stats():
                 'total_queries': total_queries,
                 'cache_hits': cache_hits,
                 'hit_rate': round(hit_rate, 2)
-            }
+            },
+            'response_cache': rate_cache.stats(),
+            'eviction': cache_evictor.stats(),
+            'warming': cache_warmer.status()
         })
         
     except Exception as e:
         app.logger.error(f"Error in get_stats: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/metrics/slow-queries')
+def get_slow_queries():
+    return jsonify(metrics.slow_queries())
+
+@app.route('/api/cache/warm', methods=['GET', 'POST'])
+def warm_cache():
+    """POST starts a background warm (publishing jobs call this after uploading); GET reports progress"""
+    if request.method == 'POST':
+        try:
+            payload = request.get_json(silent=True) or {}
+            limit = payload.get('limit')
+            if limit is not None and (not isinstance(limit, int) or limit < 1):
+                return jsonify({'error': 'limit must be a positive integer'}), 400
+            # force refetches every hot key, for data published without touching the marker
+            newer_than = datetime.utcnow() if payload.get('force') else None
+            if not cache_warmer.start(newer_than=newer_than, reason='request', limit=limit):
+                return jsonify({'error': 'Cache warming is already running', 'status': cache_warmer.status()}), 409
+            return jsonify(cache_warmer.status()), 202
+        except Exception as e:
+            app.logger.error(f"Error in warm_cache: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+    return jsonify(cache_warmer.status())
+
+@app.cli.command('backfill-rollups')
+def backfill_rollups():
+    """Rebuild the /api/stats rollup tables from the rate_query history"""
+    keys, hours = rollups.rebuild_rollups()
+    print(f"Rebuilt rollups: {keys} (state, procedure_code) keys, {hours} hourly buckets")
+
+@app.cli.command('evict-cache')
+def evict_cache():
+    """Run one CachedRate eviction sweep with the configured policy and budgets"""
+    summary = cache_evictor.sweep()
+    if summary is None:
+        print("Another process is already sweeping")
+    else:
+        print(f"Evicted {summary['keys']} keys ({summary['rows']} rows, ~{summary['bytes']} bytes) "
+              f"in {summary['duration_s']}s; {summary['skipped']} skipped as recently used")
+
+@app.cli.command('warm-cache')
+@click.option('--limit', type=int, default=None, help='Number of hot keys to warm (default CACHE_WARM_TOP_N)')
+@click.option('--force', is_flag=True, help='Refetch every hot key from S3, even if it is not stale')
+def warm_cache_command(limit, force):
+    """Prefetch the most queried keys into CachedRate, e.g. from a deploy hook before traffic arrives"""
+    summary = cache_warmer.warm(newer_than=datetime.utcnow() if force else None, reason='cli', limit=limit)
+    print(f"Warmed {summary['keys']} hot keys: {summary['fetched']} fetched from S3, "
+          f"{summary['failed']} failed, in {summary['duration_s']}s")
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
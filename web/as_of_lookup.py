@@ -0,0 +1,141 @@
+from datetime import date
+
+from batch_lookup import query_keys
+from zip_index import parse_zip
+
+
+def parse_as_of_items(payload, max_items):
+    """Normalize an as-of request body into a list of lookup dicts
+
+    Accepts either a bare list or {"items": [...]} of objects with state,
+    procedure_code and service_date (YYYY-MM-DD), and optionally modifier,
+    schedule_type, region_id, zip, or carrier_code with locality_code.
+    Raises ValueError with a message suitable for a 400 response.
+    """
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        raise ValueError("Request body must be a non-empty list of lookups or {\"items\": [...]}")
+    if len(items) > max_items:
+        raise ValueError(f"Too many lookups in one batch ({len(items)} > {max_items})")
+
+    parsed = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"Item {index} must be an object")
+        if not item.get('state') or not item.get('procedure_code') or not item.get('service_date'):
+            raise ValueError(f"Item {index} is missing state, procedure_code or service_date")
+        try:
+            service_date = date.fromisoformat(str(item['service_date']))
+        except ValueError:
+            raise ValueError(f"Item {index} has an invalid service_date (expected YYYY-MM-DD)")
+        region_id = item.get('region_id')
+        if region_id is not None and (not isinstance(region_id, int) or isinstance(region_id, bool)):
+            raise ValueError(f"Item {index} has a non-integer region_id")
+        zip_code = item.get('zip')
+        if zip_code:
+            try:
+                zip_code = f"{parse_zip(zip_code):05d}"
+            except ValueError as e:
+                raise ValueError(f"Item {index}: {str(e)}")
+
+        parsed.append({
+            'state': str(item['state']).upper(),
+            'procedure_code': str(item['procedure_code']),
+            'service_date': service_date.isoformat(),
+            'modifier': str(item['modifier']) if item.get('modifier') else None,
+            'schedule_type': str(item['schedule_type']) if item.get('schedule_type') else None,
+            'region_id': region_id,
+            'zip': zip_code or None,
+            'carrier_code': str(item['carrier_code']) if item.get('carrier_code') else None,
+            'locality_code': str(item['locality_code']) if item.get('locality_code') else None,
+        })
+    return parsed
+
+
+def _cached_as_of(rates, service_date):
+    """Each provider's CachedRate row with the latest effective date on or before the service date"""
+    latest = {}
+    for rate in rates:
+        if rate['date'] <= service_date:
+            current = latest.get(rate['provider'])
+            if current is None or rate['date'] >= current['date']:
+                latest[rate['provider']] = rate
+    return list(latest.values())
+
+
+def lookup_as_of_batch(items, snapshot, resolver, include_cached=True):
+    """Price a batch of parsed items as of their service dates
+
+    WC and Medicare rates come from the fee schedule snapshot: two binary
+    searches per candidate key, however many years of schedules are loaded.
+    A WC lookup tries the item's region (or its ZIP's regions) before the
+    statewide rate, in every schedule type of the state unless one is
+    given. wc_matches holds each schedule type's rate; wc is that rate only
+    when exactly one schedule type prices the code, and None when the
+    match is ambiguous. Medicare needs a ZIP or an explicit carrier and
+    locality.
+    Cached provider rates are read straight from CachedRate and narrowed
+    to the rows in effect on the service date. Unlike the batch lookup, a
+    historical read logs no queries, counts no accesses and never fetches
+    missing or stale keys from S3.
+    """
+    regions, localities = [], []
+    for item in items:
+        location = resolver.resolve(item['zip']) if item['zip'] else None
+        regions.append([item['region_id']] if item['region_id'] is not None
+                       else location['region_ids'] if location else [])
+        localities.append((item['carrier_code'], item['locality_code']) if item['locality_code']
+                          else (location['carrier_code'], location['locality_code'])
+                          if location and location['locality_code'] else None)
+
+    # One flat batch of WC candidates, most specific region first within each item
+    owners, candidates = [], []
+    for index, item in enumerate(items):
+        schedules = ([item['schedule_type']] if item['schedule_type']
+                     else snapshot.state_schedules.get(item['state'], []))
+        for region_id in regions[index] + [None]:
+            for schedule in schedules:
+                owners.append((index, schedule))
+                candidates.append((item['state'], schedule, item['procedure_code'], item['service_date'],
+                                   item['modifier'], region_id))
+    wc_matches = [{} for _ in items]
+    if candidates:
+        columns = list(zip(*candidates))
+        found = snapshot.wc_as_of(*columns[:4], modifiers=columns[4], region_ids=columns[5],
+                                  statewide_fallback=False)
+        for (index, schedule), row_index in zip(owners, found.tolist()):
+            if row_index >= 0 and schedule not in wc_matches[index]:
+                wc_matches[index][schedule] = snapshot.wc_row(row_index)
+
+    medicare = [None] * len(items)
+    located = [index for index in range(len(items)) if localities[index]]
+    if located:
+        found = snapshot.medicare_as_of(
+            [items[index]['procedure_code'] for index in located],
+            [items[index]['service_date'] for index in located],
+            [localities[index][0] for index in located],
+            [localities[index][1] for index in located],
+            [items[index]['modifier'] for index in located]
+        )
+        for index, row_index in zip(located, found.tolist()):
+            if row_index >= 0:
+                medicare[index] = snapshot.medicare_row(row_index)
+
+    cached = [[] for _ in items]
+    if include_cached:
+        rows = query_keys(list(dict.fromkeys((item['state'], item['procedure_code']) for item in items)))
+        for index, item in enumerate(items):
+            rates = [rate.to_dict() for rate in rows.get((item['state'], item['procedure_code']), [])]
+            cached[index] = _cached_as_of(rates, item['service_date'])
+
+    return [{
+        'index': index,
+        'state': item['state'],
+        'procedure_code': item['procedure_code'],
+        'modifier': item['modifier'],
+        'service_date': item['service_date'],
+        'wc': next(iter(wc_matches[index].values())) if len(wc_matches[index]) == 1 else None,
+        'wc_matches': list(wc_matches[index].values()),
+        'medicare': medicare[index],
+        'cached_rates': cached[index],
+    } for index, item in enumerate(items)]
@@ -0,0 +1,115 @@
+from concurrent.futures import wait
+
+from models import CachedRate
+from access_counter import access_counter
+from rate_cache import rate_cache
+from refresh import refresh_scheduler
+
+# Max procedure codes per IN list when querying CachedRate
+QUERY_CHUNK_SIZE = 500
+
+
+def parse_batch_items(payload, max_items):
+    """Normalize a batch request body into a list of (state, procedure_code, modifier)
+
+    Accepts either a bare list or {"items": [...]}, where each item is a
+    [state, procedure_code(, modifier)] list or an object with those keys.
+    Raises ValueError with a message suitable for a 400 response.
+    """
+    items = payload.get('items') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        raise ValueError("Request body must be a non-empty list of lookups or {\"items\": [...]}")
+    if len(items) > max_items:
+        raise ValueError(f"Too many lookups in one batch ({len(items)} > {max_items})")
+
+    parsed = []
+    for index, item in enumerate(items):
+        if isinstance(item, dict):
+            state = item.get('state')
+            procedure_code = item.get('procedure_code')
+            modifier = item.get('modifier')
+        elif isinstance(item, (list, tuple)) and 2 <= len(item) <= 3:
+            state, procedure_code = item[0], item[1]
+            modifier = item[2] if len(item) == 3 else None
+        else:
+            raise ValueError(f"Item {index} must be [state, procedure_code(, modifier)] or an object")
+
+        if not state or not procedure_code:
+            raise ValueError(f"Item {index} is missing state or procedure_code")
+        parsed.append((str(state), str(procedure_code), str(modifier) if modifier else None))
+    return parsed
+
+
+def query_keys(keys):
+    """Fetch CachedRate rows for many (state, procedure_code) keys with a few set-based queries"""
+    codes_by_state = {}
+    for state, procedure_code in keys:
+        codes_by_state.setdefault(state, []).append(procedure_code)
+
+    rows = {}
+    for state, codes in codes_by_state.items():
+        for start in range(0, len(codes), QUERY_CHUNK_SIZE):
+            chunk = codes[start:start + QUERY_CHUNK_SIZE]
+            for rate in CachedRate.query.filter(
+                CachedRate.state == state,
+                CachedRate.procedure_code.in_(chunk)
+            ).order_by(CachedRate.id):
+                rows.setdefault((rate.state, rate.procedure_code), []).append(rate)
+    return rows
+
+
+def lookup_rates_batch(items):
+    """Resolve a list of (state, procedure_code, modifier) lookups in one pass
+
+    Keys already in the response cache are answered from memory. The rest are
+    read from CachedRate in bulk; keys with no rows are fetched from S3
+    concurrently through the refresh scheduler, and stale keys are refreshed
+    in the background. Results are returned in input order.
+
+    CachedRate is not split by modifier, so the modifier is echoed back but
+    does not narrow the rates returned.
+    """
+    keys = list(dict.fromkeys((state, procedure_code) for state, procedure_code, _ in items))
+
+    resolved = {}
+    for key in keys:
+        cached = rate_cache.get(*key)
+        if cached is not None:
+            resolved[key] = cached
+
+    remaining = [key for key in keys if key not in resolved]
+    rows = query_keys(remaining) if remaining else {}
+
+    missing = [key for key in remaining if key not in rows]
+    if missing:
+        futures = [refresh_scheduler.submit(*key, blocking=True) for key in missing]
+        wait(futures, timeout=refresh_scheduler.wait_timeout)
+        rows.update(query_keys(missing))
+
+    for key in remaining:
+        key_rows = rows.get(key, [])
+        row_ids = [rate.id for rate in key_rows]
+        results = [rate.to_dict() for rate in key_rows]
+        resolved[key] = (row_ids, results)
+
+        last_updated = max((rate.last_updated for rate in key_rows), default=None)
+        if key_rows and refresh_scheduler.is_stale(last_updated):
+            refresh_scheduler.submit(*key)
+        elif key_rows:
+            rate_cache.set(*key, (row_ids, results))
+
+    # One buffered RateQuery row per distinct key, written together on the next flush
+    missing = set(missing)
+    for key in keys:
+        access_counter.record(*key, resolved[key][0])
+    access_counter.log_queries(
+        (*key, len(resolved[key][1]), key not in missing) for key in keys
+    )
+
+    return [{
+        'index': index,
+        'state': state,
+        'procedure_code': procedure_code,
+        'modifier': modifier,
+        'rates': resolved[(state, procedure_code)][1]
+    } for index, (state, procedure_code, modifier) in enumerate(items)]
@@ -0,0 +1,122 @@
+import io
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from models import db, CachedRate
+
+# Parquet column -> cached_rate column
+PARQUET_COLUMNS = {
+    'provider': 'provider',
+    'rate': 'rate',
+    'date': 'effective_date',
+}
+
+COPY_COLUMNS = [
+    'state', 'procedure_code', 'provider', 'rate', 'effective_date',
+    'last_updated', 'access_count', 'last_accessed'
+]
+
+# Rows per multi-row INSERT: eight values a row stays under SQLite's 999
+# bound-variable limit on older builds, and larger chunks measured no faster
+INSERT_CHUNK_ROWS = 999 // len(COPY_COLUMNS)
+
+
+def _rate_columns(table):
+    """Pull the cached_rate columns out of an Arrow table, filling missing ones with nulls"""
+    columns = {}
+    for source, target in PARQUET_COLUMNS.items():
+        if source in table.column_names:
+            columns[target] = table.column(source).combine_chunks()
+        else:
+            columns[target] = pa.nulls(table.num_rows)
+    if pa.types.is_timestamp(columns['effective_date'].type):
+        columns['effective_date'] = columns['effective_date'].cast(pa.date32())
+    return columns
+
+
+def _copy_rows(state, procedure_code, columns, num_rows, now):
+    """Stream rows into cached_rate with PostgreSQL COPY"""
+    table = pa.table({
+        'state': pa.repeat(state, num_rows),
+        'procedure_code': pa.repeat(procedure_code, num_rows),
+        'provider': columns['provider'],
+        'rate': columns['rate'],
+        'effective_date': columns['effective_date'],
+        'last_updated': pa.repeat(pa.scalar(now, pa.timestamp('us')), num_rows),
+        'access_count': pa.repeat(0, num_rows),
+        'last_accessed': pa.repeat(pa.scalar(now, pa.timestamp('us')), num_rows),
+    })
+    buffer = io.BytesIO()
+    pa_csv.write_csv(table, buffer, pa_csv.WriteOptions(include_header=False))
+    buffer.seek(0)
+
+    dbapi_conn = db.session.connection().connection.dbapi_connection
+    with dbapi_conn.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {CachedRate.__tablename__} ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+
+
+def _insert_rows(state, procedure_code, columns, now):
+    """Insert the rows with multi-row INSERT statements of INSERT_CHUNK_ROWS rows each
+
+    Values go straight to the driver: dates are formatted by Arrow and the
+    constant columns are processed once, so no per-value bind processing runs.
+    """
+    dialect = db.engine.dialect
+    placeholder = '?' if dialect.paramstyle == 'qmark' else '%s'
+    process_timestamp = db.DateTime().bind_processor(dialect)
+    stamp = process_timestamp(now) if process_timestamp else now
+    constants = (state, procedure_code)
+    trailing = (stamp, 0, stamp)
+    row_sql = f"({', '.join([placeholder] * len(COPY_COLUMNS))})"
+
+    providers = columns['provider'].to_pylist()
+    rates = columns['rate'].cast(pa.float64()).to_pylist()
+    dates = columns['effective_date'].cast(pa.string()).to_pylist()
+    connection = db.session.connection()
+    for offset in range(0, len(providers), INSERT_CHUNK_ROWS):
+        chunk = zip(providers[offset:offset + INSERT_CHUNK_ROWS], rates[offset:offset + INSERT_CHUNK_ROWS],
+                    dates[offset:offset + INSERT_CHUNK_ROWS])
+        params = []
+        for row in chunk:
+            params += constants
+            params += row
+            params += trailing
+        rows = len(params) // len(COPY_COLUMNS)
+        connection.exec_driver_sql(
+            f"INSERT INTO {CachedRate.__tablename__} ({', '.join(COPY_COLUMNS)}) VALUES {', '.join([row_sql] * rows)}",
+            tuple(params)
+        )
+
+
+def replace_cached_rates(state, procedure_code, table):
+    """Replace every CachedRate row for (state, procedure_code) with the rows of an Arrow table
+
+    The delete and the insert run in one transaction, so readers see either the
+    old rows or the new ones. PostgreSQL is loaded with COPY; other backends get
+    multi-row INSERTs, chunked to stay within the bind-variable limit. Returns the number of rows loaded.
+    """
+    columns = _rate_columns(table)
+    now = datetime.utcnow()
+
+    try:
+        CachedRate.query.filter_by(
+            state=state,
+            procedure_code=procedure_code
+        ).delete(synchronize_session=False)
+
+        if db.engine.dialect.name == 'postgresql':
+            _copy_rows(state, procedure_code, columns, table.num_rows, now)
+        else:
+            _insert_rows(state, procedure_code, columns, now)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return table.num_rows
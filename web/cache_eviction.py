@@ -0,0 +1,222 @@
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, func, text
+
+from models import db, CachedRate
+from rate_cache import rate_cache
+from refresh import refresh_scheduler
+
+POLICIES = ('lru', 'lfu', 'none')
+# Rough per-row storage cost besides the provider string (ids, numbers, dates, index entries)
+ROW_OVERHEAD_BYTES = 96
+
+# Evicting a key touched since the candidates were read would throw away rows someone just used
+DELETE_KEY_SQL = text(
+    "DELETE FROM cached_rate WHERE state = :state AND procedure_code = :procedure_code "
+    "AND NOT EXISTS (SELECT 1 FROM cached_rate newer WHERE newer.state = :state "
+    "AND newer.procedure_code = :procedure_code AND newer.last_accessed > :seen)"
+).bindparams(bindparam('seen', type_=db.DateTime))
+
+
+class CacheEvictor:
+    """Background sweeper that keeps CachedRate within a row budget
+
+    Whole (state, procedure_code) keys are evicted, never single rows, so a
+    key is either complete or refetched from S3 on its next lookup. Each
+    sweep reads one row per key, picks victims (least recently or least
+    frequently used first), and deletes them in small transactions with a
+    pause in between, so readers and the access counter flush are never
+    blocked for long. Across gunicorn workers only one sweep runs at a time.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.policy = 'lru'
+        self.max_rows = 0
+        self.max_rows_per_state = 0
+        self.max_idle = None
+        self.interval = 300.0
+        self.batch_size = 50
+        self.pause = 0.05
+        self.sweeps = 0
+        self.keys_evicted = 0
+        self.rows_evicted = 0
+        self.bytes_reclaimed = 0
+        self.last_sweep = None
+        self.recent = deque(maxlen=50)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.policy = app.config.get('CACHE_EVICTION_POLICY', self.policy)
+        if self.policy not in POLICIES:
+            raise ValueError(f"CACHE_EVICTION_POLICY must be one of {', '.join(POLICIES)}, not {self.policy!r}")
+        self.max_rows = app.config.get('CACHE_MAX_ROWS', self.max_rows)
+        self.max_rows_per_state = app.config.get('CACHE_MAX_ROWS_PER_STATE', self.max_rows_per_state)
+        idle_hours = app.config.get('CACHE_MAX_IDLE_HOURS', 0)
+        self.max_idle = timedelta(hours=idle_hours) if idle_hours else None
+        self.interval = app.config.get('CACHE_EVICTION_INTERVAL', self.interval)
+        self.batch_size = app.config.get('CACHE_EVICTION_BATCH', self.batch_size)
+        self.pause = app.config.get('CACHE_EVICTION_PAUSE', self.pause)
+        app.extensions['cache_evictor'] = self
+        if self.enabled:
+            app.before_request(self._ensure_worker)
+
+    @property
+    def enabled(self):
+        return self.policy != 'none' and bool(self.max_rows or self.max_rows_per_state or self.max_idle)
+
+    def candidates(self):
+        """Keys to evict, in eviction order: [(state, procedure_code, last_accessed, rows, bytes, reason)]"""
+        keys = db.session.query(
+            CachedRate.state,
+            CachedRate.procedure_code,
+            func.count(),
+            func.max(CachedRate.last_accessed),
+            func.sum(func.coalesce(CachedRate.access_count, 0)),
+            func.sum(func.coalesce(func.length(CachedRate.provider), 0))
+        ).group_by(CachedRate.state, CachedRate.procedure_code).all()
+        db.session.commit()  # end the read transaction before deleting
+
+        oldest = datetime.min
+        if self.policy == 'lfu':
+            keys.sort(key=lambda key: (key[4], key[3] or oldest))
+        else:
+            keys.sort(key=lambda key: (key[3] or oldest, key[4]))
+
+        victims = {}
+
+        def evict(key, reason):
+            victims.setdefault((key[0], key[1]), (key, reason))
+
+        if self.max_idle is not None:
+            cutoff = datetime.utcnow() - self.max_idle
+            for key in keys:
+                if (key[3] or oldest) < cutoff:
+                    evict(key, 'idle')
+
+        if self.max_rows_per_state:
+            state_rows = {}
+            for key in keys:
+                if (key[0], key[1]) not in victims:
+                    state_rows[key[0]] = state_rows.get(key[0], 0) + key[2]
+            for key in keys:
+                if (key[0], key[1]) not in victims and state_rows[key[0]] > self.max_rows_per_state:
+                    evict(key, 'state_budget')
+                    state_rows[key[0]] -= key[2]
+
+        if self.max_rows:
+            total = sum(key[2] for key in keys if (key[0], key[1]) not in victims)
+            for key in keys:
+                if total <= self.max_rows:
+                    break
+                if (key[0], key[1]) not in victims:
+                    evict(key, 'row_budget')
+                    total -= key[2]
+
+        order = {(key[0], key[1]): i for i, key in enumerate(keys)}
+        return [
+            (key[0], key[1], key[3], key[2], key[2] * ROW_OVERHEAD_BYTES + key[5], reason)
+            for key, reason in sorted(victims.values(), key=lambda victim: order[(victim[0][0], victim[0][1])])
+        ]
+
+    def sweep(self):
+        """Run one eviction pass now; returns its summary (None if another worker is sweeping)"""
+        with refresh_scheduler.cross_process_lock('*', 'cache-eviction', blocking=False) as acquired:
+            if not acquired:
+                return None
+            start = time.perf_counter()
+            victims = self.candidates()
+            summary = {'keys': 0, 'rows': 0, 'bytes': 0, 'skipped': 0, 'reasons': {}}
+            for offset in range(0, len(victims), self.batch_size):
+                if offset:
+                    time.sleep(self.pause)
+                self._delete_batch(victims[offset:offset + self.batch_size], summary)
+            summary.update(
+                at=datetime.utcnow().isoformat(timespec='seconds'),
+                candidates=len(victims),
+                duration_s=round(time.perf_counter() - start, 3)
+            )
+        with self._lock:
+            self.sweeps += 1
+            self.keys_evicted += summary['keys']
+            self.rows_evicted += summary['rows']
+            self.bytes_reclaimed += summary['bytes']
+            self.last_sweep = summary
+        return summary
+
+    def _delete_batch(self, batch, summary):
+        evicted = []
+        try:
+            for state, procedure_code, seen, rows, size, reason in batch:
+                result = db.session.execute(DELETE_KEY_SQL, {
+                    'state': state, 'procedure_code': procedure_code, 'seen': seen
+                })
+                if result.rowcount:
+                    evicted.append((state, procedure_code, result.rowcount, size * result.rowcount // rows, reason))
+                else:
+                    summary['skipped'] += 1
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if self.app is not None:
+                self.app.logger.error(f"Error evicting cached rates: {str(e)}")
+            return
+
+        now = datetime.utcnow().isoformat(timespec='seconds')
+        for state, procedure_code, rows, size, reason in evicted:
+            rate_cache.invalidate(state, procedure_code)
+            summary['keys'] += 1
+            summary['rows'] += rows
+            summary['bytes'] += size
+            summary['reasons'][reason] = summary['reasons'].get(reason, 0) + 1
+            self.recent.append({'state': state, 'procedure_code': procedure_code, 'rows': rows,
+                                'reason': reason, 'at': now})
+
+    def stats(self):
+        with self._lock:
+            return {
+                'policy': self.policy,
+                'enabled': self.enabled,
+                'max_rows': self.max_rows,
+                'max_rows_per_state': self.max_rows_per_state,
+                'sweeps': self.sweeps,
+                'keys_evicted': self.keys_evicted,
+                'rows_evicted': self.rows_evicted,
+                'approx_bytes_reclaimed': self.bytes_reclaimed,
+                'last_sweep': self.last_sweep,
+                'recent_evictions': list(self.recent),
+            }
+
+    def _ensure_worker(self):
+        # Started lazily so each forked gunicorn worker gets its own sweeper
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='cache-evictor', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.app.app_context():
+                try:
+                    self.sweep()
+                except Exception as e:
+                    self.app.logger.error(f"Error in cache eviction sweep: {str(e)}")
+                finally:
+                    db.session.remove()
+
+
+cache_evictor = CacheEvictor()
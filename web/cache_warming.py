@@ -0,0 +1,268 @@
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from models import db, CachedRate, RateQuery
+from batch_lookup import QUERY_CHUNK_SIZE, query_keys
+from rate_cache import rate_cache
+from refresh import refresh_scheduler
+
+
+class CacheWarmer:
+    """Prefetch the most queried (state, procedure_code) keys into CachedRate and the response cache
+
+    Keys are ranked by how often they were looked up in rate_query over a
+    recent window. Missing or stale keys are fetched from S3 through the
+    refresh scheduler with a bounded number in flight, so warming never
+    crowds out the refreshes that live requests are waiting on, and the
+    scheduler's per-key locks keep gunicorn workers from fetching the same
+    key twice. Each worker then loads the hot keys into its own response cache.
+
+    A warm runs when a worker starts serving and again whenever the S3
+    publication marker (see last_publication in app.py) moves forward, in
+    which case rows loaded before the publication are refetched.
+    """
+
+    def __init__(self, app=None, published_fn=None):
+        self.app = None
+        self.published_fn = None
+        self.top_n = 200
+        self.window = timedelta(hours=168)
+        self.concurrency = 2
+        self.on_start = True
+        self.check_interval = 60.0
+        self.runs = 0
+        self.last_run = None
+        self.progress = None
+        self._published = None
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app, published_fn)
+
+    def init_app(self, app, published_fn=None):
+        self.app = app
+        self.published_fn = published_fn
+        self.top_n = app.config.get('CACHE_WARM_TOP_N', self.top_n)
+        self.window = timedelta(hours=app.config.get('CACHE_WARM_WINDOW_HOURS', 168))
+        self.concurrency = max(1, app.config.get('CACHE_WARM_CONCURRENCY', self.concurrency))
+        self.on_start = app.config.get('CACHE_WARM_ON_START', self.on_start)
+        self.check_interval = app.config.get('CACHE_WARM_CHECK_INTERVAL', self.check_interval)
+        app.extensions['cache_warmer'] = self
+        if self.top_n and (self.on_start or self.published_fn is not None):
+            app.before_request(self._ensure_worker)
+
+    def hot_keys(self, limit=None):
+        """Most queried keys in the window, most popular first: [(state, procedure_code, queries)]"""
+        since = datetime.utcnow() - self.window
+        queries = func.count()
+        return [tuple(row) for row in db.session.query(
+            RateQuery.state,
+            RateQuery.procedure_code,
+            queries
+        ).filter(
+            RateQuery.query_date >= since
+        ).group_by(
+            RateQuery.state, RateQuery.procedure_code
+        ).order_by(
+            queries.desc(), RateQuery.state, RateQuery.procedure_code
+        ).limit(limit or self.top_n)]
+
+    def warm(self, newer_than=None, reason='manual', limit=None):
+        """Warm the hot keys now and wait for it; returns the run summary (None if one is already running)
+
+        With newer_than, keys whose rows were loaded before that time are
+        refetched even if they are not stale yet.
+        """
+        with self._lock:
+            if self._running:
+                return None
+            self._running = True
+        try:
+            return self._warm(newer_than, reason, limit)
+        finally:
+            with self._lock:
+                self._running = False
+
+    def start(self, newer_than=None, reason='manual', limit=None):
+        """Warm in a background thread; returns False if a warm is already running"""
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+        threading.Thread(
+            target=self._warm_in_background, args=(newer_than, reason, limit),
+            name='cache-warming', daemon=True
+        ).start()
+        return True
+
+    def _warm_in_background(self, newer_than, reason, limit):
+        try:
+            with self.app.app_context():
+                try:
+                    self._warm(newer_than, reason, limit)
+                except Exception as e:
+                    self.app.logger.error(f"Error in cache warming: {str(e)}")
+                finally:
+                    db.session.remove()
+        finally:
+            with self._lock:
+                self._running = False
+
+    def _warm(self, newer_than, reason, limit):
+        start = time.perf_counter()
+        keys = [(state, procedure_code) for state, procedure_code, _ in self.hot_keys(limit)]
+        loaded = self._last_updated(keys)
+        db.session.commit()  # don't hold a read transaction open while fetching
+
+        due = [
+            key for key in keys
+            if refresh_scheduler.is_stale(loaded.get(key))
+            or (newer_than is not None and loaded[key] < newer_than)
+        ]
+        progress = {
+            'reason': reason,
+            'started_at': datetime.utcnow().isoformat(timespec='seconds'),
+            'keys': len(keys),
+            'to_fetch': len(due),
+            'fetched': 0,
+            'failed': 0,
+            'primed': 0,
+        }
+        with self._lock:
+            self.progress = progress
+        self.app.logger.info(f"Cache warming ({reason}): {len(due)} of {len(keys)} hot keys to fetch")
+
+        pending = {}
+        report_every = max(1, len(due) // 10)
+        for key in due:
+            if len(pending) >= self.concurrency:
+                self._collect(pending, progress, report_every)
+            # Blocking: if another worker is fetching the key, wait for it instead of skipping
+            future = refresh_scheduler.submit(*key, blocking=True, newer_than=newer_than)
+            pending[future] = key
+        while pending:
+            self._collect(pending, progress, report_every)
+
+        progress['primed'] = self._prime(keys)
+        progress['duration_s'] = round(time.perf_counter() - start, 3)
+        progress['finished_at'] = datetime.utcnow().isoformat(timespec='seconds')
+        with self._lock:
+            self.runs += 1
+            self.last_run = progress
+            self.progress = None
+        self.app.logger.info(
+            f"Cache warming ({reason}) done: {progress['fetched']} fetched, {progress['failed']} failed, "
+            f"{progress['primed']} primed in {progress['duration_s']}s"
+        )
+        return progress
+
+    def _collect(self, pending, progress, report_every):
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            state, procedure_code = pending.pop(future)
+            try:
+                ok = future.result()
+            except Exception as e:
+                self.app.logger.error(f"Error warming {state}/{procedure_code}: {str(e)}")
+                ok = False
+            progress['fetched' if ok else 'failed'] += 1
+            finished = progress['fetched'] + progress['failed']
+            if finished % report_every == 0 or finished == progress['to_fetch']:
+                self.app.logger.info(f"Cache warming ({progress['reason']}): {finished}/{progress['to_fetch']} keys fetched")
+
+    def _last_updated(self, keys):
+        """Most recent CachedRate.last_updated per key, for keys that have rows"""
+        codes_by_state = {}
+        for state, procedure_code in keys:
+            codes_by_state.setdefault(state, []).append(procedure_code)
+
+        loaded = {}
+        for state, codes in codes_by_state.items():
+            for offset in range(0, len(codes), QUERY_CHUNK_SIZE):
+                for procedure_code, last_updated in db.session.query(
+                    CachedRate.procedure_code,
+                    func.max(CachedRate.last_updated)
+                ).filter(
+                    CachedRate.state == state,
+                    CachedRate.procedure_code.in_(codes[offset:offset + QUERY_CHUNK_SIZE])
+                ).group_by(CachedRate.procedure_code):
+                    loaded[(state, procedure_code)] = last_updated
+        return loaded
+
+    def _prime(self, keys):
+        """Load the hottest keys that fit into this worker's response cache; returns how many"""
+        if not rate_cache.enabled:
+            return 0
+        keys = keys[:rate_cache.max_size]
+        rows = query_keys(keys)
+        db.session.commit()
+        primed = 0
+        # Least popular first, so the hottest keys are the last to be pushed out
+        for key in reversed(keys):
+            rates = rows.get(key)
+            if rates and not refresh_scheduler.is_stale(max(rate.last_updated for rate in rates)):
+                rate_cache.set(*key, ([rate.id for rate in rates], [rate.to_dict() for rate in rates]))
+                primed += 1
+        return primed
+
+    def status(self):
+        with self._lock:
+            return {
+                'top_n': self.top_n,
+                'window_hours': self.window.total_seconds() / 3600,
+                'concurrency': self.concurrency,
+                'running': self._running,
+                'runs': self.runs,
+                'in_progress': dict(self.progress) if self.progress else None,
+                'last_run': self.last_run,
+                'last_publication': self._published.isoformat(timespec='seconds') if self._published else None,
+            }
+
+    def _ensure_worker(self):
+        # Started lazily so each forked gunicorn worker warms its own response cache
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._running = False
+            self._thread = threading.Thread(target=self._run, name='cache-warmer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with self.app.app_context():
+            try:
+                if self.published_fn is not None:
+                    self._published = self.published_fn()
+                if self.on_start:
+                    # Also refetch rows loaded before a publication that happened while we were down
+                    self.warm(newer_than=self._published, reason='startup')
+            except Exception as e:
+                self.app.logger.error(f"Error in cache warming: {str(e)}")
+            finally:
+                db.session.remove()
+
+        while self.published_fn is not None and self.check_interval:
+            time.sleep(self.check_interval)
+            with self.app.app_context():
+                try:
+                    published = self.published_fn()
+                    if published is not None and (self._published is None or published > self._published):
+                        # If a manual warm is running, try again on the next check
+                        if self.warm(newer_than=published, reason='publication') is not None:
+                            self._published = published
+                except Exception as e:
+                    self.app.logger.error(f"Error in cache warming: {str(e)}")
+                finally:
+                    db.session.remove()
+
+
+cache_warmer = CacheWarmer()
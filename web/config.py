@@ -17,6 +17,49 @@ class Config:
     # Cache configuration
     CACHE_TYPE = 'simple'
     CACHE_DEFAULT_TIMEOUT = 300  # 5 minutes
+    CACHE_THRESHOLD = int(os.getenv('CACHE_THRESHOLD', 500))  # max (state, procedure_code) entries
+    
+    # CachedRate eviction (whole (state, procedure_code) keys; 0 disables a limit)
+    CACHE_EVICTION_POLICY = os.getenv('CACHE_EVICTION_POLICY', 'lru')  # lru, lfu or none
+    CACHE_MAX_ROWS = int(os.getenv('CACHE_MAX_ROWS', 0))
+    CACHE_MAX_ROWS_PER_STATE = int(os.getenv('CACHE_MAX_ROWS_PER_STATE', 0))
+    CACHE_MAX_IDLE_HOURS = float(os.getenv('CACHE_MAX_IDLE_HOURS', 0))  # evict keys not read for this long
+    CACHE_EVICTION_INTERVAL = float(os.getenv('CACHE_EVICTION_INTERVAL', 300))  # seconds between sweeps
+    CACHE_EVICTION_BATCH = int(os.getenv('CACHE_EVICTION_BATCH', 50))  # keys deleted per transaction
+    CACHE_EVICTION_PAUSE = float(os.getenv('CACHE_EVICTION_PAUSE', 0.05))  # seconds between batches
+    
+    # Cache warming (most queried keys in rate_query, at worker start and after each S3 publication)
+    CACHE_WARM_TOP_N = int(os.getenv('CACHE_WARM_TOP_N', 200))  # 0 disables warming
+    CACHE_WARM_WINDOW_HOURS = float(os.getenv('CACHE_WARM_WINDOW_HOURS', 168))  # rank by queries in this window
+    CACHE_WARM_CONCURRENCY = int(os.getenv('CACHE_WARM_CONCURRENCY', 2))  # S3 fetches in flight; keep below REFRESH_WORKERS
+    CACHE_WARM_ON_START = os.getenv('CACHE_WARM_ON_START', 'true').lower() != 'false'
+    CACHE_WARM_PUBLISH_KEY = os.getenv('CACHE_WARM_PUBLISH_KEY')  # S3 object rewritten by each data publication
+    CACHE_WARM_CHECK_INTERVAL = float(os.getenv('CACHE_WARM_CHECK_INTERVAL', 60))  # seconds between marker checks
+    
+    # Background S3 refresh
+    CACHE_REFRESH_AGE_HOURS = float(os.getenv('CACHE_REFRESH_AGE_HOURS', 24))
+    REFRESH_WORKERS = int(os.getenv('REFRESH_WORKERS', 4))
+    REFRESH_WAIT_TIMEOUT = float(os.getenv('REFRESH_WAIT_TIMEOUT', 30))  # seconds a cold request waits
+    REFRESH_LOCK_DIR = os.getenv('REFRESH_LOCK_DIR')  # flock directory for non-PostgreSQL backends
+    
+    # Batch lookups
+    RATES_BATCH_MAX_ITEMS = int(os.getenv('RATES_BATCH_MAX_ITEMS', 1000))
+    
+    # Reference data (SQLite database built by builder_scripts/ and utils/)
+    RATES_DATABASE = os.getenv('RATES_DATABASE')  # path to compensation_rates.db
+    ZIP_INDEX_CHECK_INTERVAL = float(os.getenv('ZIP_INDEX_CHECK_INTERVAL', 30))  # seconds between reload checks
+    FEE_SNAPSHOT_PATH = os.getenv('FEE_SNAPSHOT_PATH')  # written by utils/build_fee_snapshot.py; default RATES_DATABASE with .fees
+    FEE_SNAPSHOT_CHECK_INTERVAL = float(os.getenv('FEE_SNAPSHOT_CHECK_INTERVAL', 30))  # seconds between reload checks
+    
+    # Access count write-behind
+    ACCESS_COUNT_FLUSH_INTERVAL = float(os.getenv('ACCESS_COUNT_FLUSH_INTERVAL', 2))  # seconds
+    ACCESS_COUNT_FLUSH_THRESHOLD = int(os.getenv('ACCESS_COUNT_FLUSH_THRESHOLD', 5000))  # buffered rows
+    ACCESS_COUNT_MAX_BUFFERED_QUERIES = int(os.getenv('ACCESS_COUNT_MAX_BUFFERED_QUERIES', 100000))  # query log rows kept across failed flushes
+    
+    # Metrics (/metrics)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+    METRICS_SLOW_QUERY_MS = float(os.getenv('METRICS_SLOW_QUERY_MS', 250))  # log statements slower than this
+    METRICS_SLOW_QUERY_LOG_SIZE = int(os.getenv('METRICS_SLOW_QUERY_LOG_SIZE', 100))  # recent slow statements kept
     
     # Security
     SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-here') 
\ No newline at end of file
@@ -0,0 +1,410 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+# Must match utils/build_fee_snapshot.py, which writes the file
+MAGIC = b'FEESNAP2'
+ALIGN = 64
+KEY_FIELDS = ('state', 'schedule', 'code', 'modifier', 'region')
+MEDICARE_KEY_FIELDS = ('code', 'modifier', 'locality')
+DAY_OFFSET = 1 << 31
+
+
+def _positions(table, values):
+    """Index of each value in a sorted table, or -1 where it is missing"""
+    if len(table) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    positions = np.searchsorted(table, values)
+    clipped = np.minimum(positions, len(table) - 1)
+    return np.where((positions < len(table)) & (table[clipped] == values), clipped, -1)
+
+
+def _encode(values):
+    return np.array([str(value).encode('utf-8') for value in values], dtype=bytes)
+
+
+def _date(value):
+    return None if np.isnat(value) else str(value)
+
+
+def _number(value):
+    value = float(value)
+    return None if np.isnan(value) else value
+
+
+def mapping_memory(path):
+    """Resident / proportional / private bytes of this process's mappings of path (Linux only, else None)
+
+    Pages shared with other workers count fully in rss but only by share in
+    pss; private counts pages no other process has mapped (yet). The
+    mapping is read-only, so nothing here is ever a per-worker copy.
+    """
+    try:
+        with open('/proc/self/smaps') as smaps:
+            lines = smaps.readlines()
+    except OSError:
+        return None
+    path = os.path.realpath(path)
+    totals = {'rss': 0, 'pss': 0, 'private': 0}
+    # A replaced snapshot stays mapped as "<path> (deleted)" until its arrays are released
+    inside = False
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        if '-' in fields[0] and not fields[0].endswith(':'):
+            inside = len(fields) >= 6 and line.split(None, 5)[5].strip().startswith(path)
+        elif inside and fields[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+            key = {'Rss:': 'rss', 'Pss:': 'pss'}.get(fields[0], 'private')
+            totals[key] += int(fields[1]) * 1024
+    return totals
+
+
+class FeeSnapshot:
+    """Read-only, memory-mapped view of the WC fee schedule and Medicare rates
+
+    Key columns are interned into small ids that sort like the values they
+    stand for, and packed into one uint64 per row, so the rows are sorted by
+    (state, schedule, code, modifier, region) and any batch of keys resolves
+    with one vectorized binary search. Nothing is copied on load: the arrays
+    are views of a shared file mapping, so every gunicorn worker reads the
+    same page cache pages.
+
+    Besides the published rates, every version of each WC and Medicare rate
+    is kept with the [valid_from, valid_to) interval it applied for. Versions
+    are sorted by one uint64 per row, (key run << 32 | valid_from day), so an
+    as-of-date lookup is two binary searches: key -> run, then (run, date) ->
+    the latest version that started on or before the date.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self._map[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a fee schedule snapshot")
+        header_length = int.from_bytes(bytes(self._map[len(MAGIC):len(MAGIC) + 4]), 'little')
+        header_end = len(MAGIC) + 4 + header_length
+        header = json.loads(bytes(self._map[len(MAGIC) + 4:header_end]))
+        data_start = -(-header_end // ALIGN) * ALIGN
+
+        self.built_at = header.get('built_at')
+        self.states = header['states']
+        self.schedules = header['schedules']
+        self._state_ids = {state: i for i, state in enumerate(self.states)}
+        self._schedule_ids = {schedule: i for i, schedule in enumerate(self.schedules)}
+        self.bits = header['bits']
+
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.lib.format.descr_to_dtype(spec['dtype'])
+            arrays[name] = np.frombuffer(self._map, dtype=dtype, count=spec['count'], offset=data_start + spec['offset'])
+        self.rate_units = header['rate_units']
+        self.keys = arrays['keys']
+        self.published = arrays['published']
+        self.wc_keys = arrays['wc_keys']
+        self.wc_versions = arrays['wc_versions']
+        self.wc_rows = arrays['wc_rows']
+        self.medicare_keys = arrays['medicare_keys']
+        self.medicare_versions = arrays['medicare_versions']
+        self.medicare_rows = arrays['medicare_rows']
+        self.codes = arrays['codes']
+        self.modifiers = arrays['modifiers']
+        self.regions = arrays['regions']
+        self.localities = arrays['localities']
+        # Small tables also get dicts for the single-key path
+        self._modifier_ids = {modifier.decode('utf-8'): i for i, modifier in enumerate(self.modifiers.tolist())}
+        self._region_ids = {region_id: i for i, region_id in enumerate(self.regions.tolist())}
+        self.state_schedules = self._state_schedules()
+
+    def _state_schedules(self):
+        """Schedule types with rates in each state, from the (state, schedule) prefix of the sorted version keys"""
+        shift = sum(self.bits[field] for field in KEY_FIELDS[2:])
+        prefixes = self.wc_keys >> np.uint64(shift)
+        starts = np.ones(len(prefixes), dtype=bool)
+        starts[1:] = prefixes[1:] != prefixes[:-1]
+        schedule_mask = (1 << self.bits['schedule']) - 1
+        result = {}
+        for prefix in prefixes[starts].tolist():
+            result.setdefault(self.states[prefix >> self.bits['schedule']], []).append(self.schedules[prefix & schedule_mask])
+        return result
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _pack(self, ids, fields=KEY_FIELDS):
+        keys = np.zeros(len(ids[fields[0]]), dtype=np.uint64)
+        shift = 0
+        for field in reversed(fields):
+            keys |= ids[field].astype(np.uint64) << np.uint64(shift)
+            shift += self.bits[field]
+        return keys
+
+    def _ids(self, states, schedules, procedure_codes, modifiers):
+        """Interned ids for the non-region key fields; a missing value gives -1"""
+        return {
+            'state': np.array([self._state_ids.get(state, -1) for state in states], dtype=np.int64),
+            'schedule': np.array([self._schedule_ids.get(schedule, -1) for schedule in schedules], dtype=np.int64),
+            'code': _positions(self.codes, _encode(procedure_codes)),
+            'modifier': _positions(self.modifiers, _encode(modifier or '' for modifier in modifiers)),
+        }
+
+    def lookup_many(self, states, schedules, procedure_codes, modifiers=None, region_ids=None, statewide_fallback=True):
+        """Row index for each key (-1 if not found), resolved with one binary search over all keys
+
+        A key with a region that has no regional rate falls back to the
+        statewide (region 0) rate unless statewide_fallback is False.
+        """
+        count = len(procedure_codes)
+        modifiers = modifiers if modifiers is not None else [None] * count
+        region_ids = region_ids if region_ids is not None else [None] * count
+        ids = self._ids(states, schedules, procedure_codes, modifiers)
+        regions = np.array([region_id or 0 for region_id in region_ids], dtype=np.int64)
+        ids['region'] = _positions(self.regions, regions)
+
+        found = np.full(count, -1, dtype=np.int64)
+        known = np.all([ids[field] >= 0 for field in ('state', 'schedule', 'code', 'modifier')], axis=0)
+        for attempt in (ids['region'], np.zeros(count, dtype=np.int64)):
+            todo = known & (found < 0) & (attempt >= 0)
+            if todo.any():
+                keys = self._pack({field: values[todo] for field, values in dict(ids, region=attempt).items()})
+                positions = _positions(self.keys, keys)
+                found[np.flatnonzero(todo)] = positions
+            if not statewide_fallback:
+                break
+        return found
+
+    def find(self, state, schedule, procedure_code, modifier=None, region_id=None):
+        """Row index for one key (regional, else statewide), or -1; avoids the batch path's array setup"""
+        state_id = self._state_ids.get(state)
+        schedule_id = self._schedule_ids.get(schedule)
+        modifier_id = self._modifier_ids.get(modifier or '')
+        code = str(procedure_code).encode('utf-8')
+        code_id = int(self.codes.searchsorted(code))
+        if None in (state_id, schedule_id, modifier_id) or code_id == len(self.codes) or self.codes[code_id] != code:
+            return -1
+        prefix = (((state_id << self.bits['schedule'] | schedule_id) << self.bits['code'] | code_id)
+                  << self.bits['modifier'] | modifier_id) << self.bits['region']
+        for region in (self._region_ids.get(region_id or 0), 0):
+            if region is None:
+                continue
+            key = np.uint64(prefix | region)
+            index = int(self.keys.searchsorted(key))
+            if index < len(self.keys) and self.keys[index] == key:
+                return index
+        return -1
+
+    def lookup(self, state, schedule, procedure_code, modifier=None, region_id=None):
+        """The rate for one key (regional, else statewide) as a dict, or None"""
+        index = self.find(state, schedule, procedure_code, modifier, region_id)
+        return self.row(index) if index >= 0 else None
+
+    def rates_for_code(self, state, procedure_code, modifier=None, schedule=None):
+        """Every region's rate for a code in one state (optionally one schedule type), as dicts"""
+        schedules = [schedule] if schedule is not None else self.schedules
+        results = []
+        for schedule in schedules:
+            ids = self._ids([state], [schedule], [procedure_code], [modifier])
+            if any(ids[field][0] < 0 for field in ids):
+                continue
+            ids['region'] = np.zeros(1, dtype=np.int64)
+            low = self._pack(ids)[0]
+            high = low | np.uint64((1 << self.bits['region']) - 1)
+            start = int(np.searchsorted(self.keys, low, side='left'))
+            end = int(np.searchsorted(self.keys, high, side='right'))
+            results.extend(self.row(index) for index in range(start, end))
+        return results
+
+    # --- As of a date of service ---
+
+    def _as_of(self, keys, versions, rows, packed, days):
+        """Version row index per (packed key, day), or -1 if the key had no rate in force that day"""
+        runs = _positions(keys, packed)
+        found = np.full(len(packed), -1, dtype=np.int64)
+        todo = np.flatnonzero((runs >= 0) & ~np.isnat(days))
+        if len(todo) == 0 or len(versions) == 0:
+            return found
+        probes = (runs[todo].astype(np.uint64) << np.uint64(32)) | (days[todo].astype(np.int64) + DAY_OFFSET).astype(np.uint64)
+        positions = np.searchsorted(versions, probes, side='right') - 1
+        clipped = np.maximum(positions, 0)
+        valid_to = rows['valid_to'][clipped]
+        hit = ((positions >= 0) & ((versions[clipped] >> np.uint64(32)) == runs[todo].astype(np.uint64))
+               & (np.isnat(valid_to) | (days[todo] < valid_to)))
+        found[todo[hit]] = clipped[hit]
+        return found
+
+    def wc_as_of(self, states, schedules, procedure_codes, service_dates, modifiers=None, region_ids=None,
+                 statewide_fallback=True):
+        """wc_rows index of the rate in force on each service date (-1 if none)
+
+        Like lookup_many, a region without its own rate that day falls back
+        to the statewide rate unless statewide_fallback is False.
+        """
+        count = len(procedure_codes)
+        modifiers = modifiers if modifiers is not None else [None] * count
+        region_ids = region_ids if region_ids is not None else [None] * count
+        days = np.array(service_dates, dtype='datetime64[D]')
+        ids = self._ids(states, schedules, procedure_codes, modifiers)
+        ids['region'] = _positions(self.regions, np.array([region_id or 0 for region_id in region_ids], dtype=np.int64))
+
+        found = np.full(count, -1, dtype=np.int64)
+        known = np.all([ids[field] >= 0 for field in ('state', 'schedule', 'code', 'modifier')], axis=0)
+        for attempt in (ids['region'], np.zeros(count, dtype=np.int64)):
+            todo = np.flatnonzero(known & (found < 0) & (attempt >= 0))
+            if len(todo):
+                packed = self._pack({field: values[todo] for field, values in dict(ids, region=attempt).items()})
+                found[todo] = self._as_of(self.wc_keys, self.wc_versions, self.wc_rows, packed, days[todo])
+            if not statewide_fallback:
+                break
+        return found
+
+    def medicare_as_of(self, procedure_codes, service_dates, carrier_codes, locality_codes, modifiers=None):
+        """medicare_rows index of the rate in force on each service date (-1 if none)"""
+        count = len(procedure_codes)
+        modifiers = modifiers if modifiers is not None else [None] * count
+        localities = [f"{carrier_code or ''}\t{locality_code}" for carrier_code, locality_code in zip(carrier_codes, locality_codes)]
+        ids = {
+            'code': _positions(self.codes, _encode(procedure_codes)),
+            'modifier': _positions(self.modifiers, _encode(modifier or '' for modifier in modifiers)),
+            'locality': _positions(self.localities, _encode(localities)),
+        }
+        found = np.full(count, -1, dtype=np.int64)
+        todo = np.flatnonzero(np.all([values >= 0 for values in ids.values()], axis=0))
+        if len(todo):
+            packed = self._pack({field: values[todo] for field, values in ids.items()}, MEDICARE_KEY_FIELDS)
+            days = np.array(service_dates, dtype='datetime64[D]')[todo]
+            found[todo] = self._as_of(self.medicare_keys, self.medicare_versions, self.medicare_rows, packed, days)
+        return found
+
+    # --- Rows ---
+
+    def row(self, index):
+        """A published rate (index from find / lookup_many) as a dict"""
+        return self.wc_row(int(self.published[index]))
+
+    def wc_row(self, index):
+        row = self.wc_rows[index]
+        return {
+            'state_code': self.states[row['state']],
+            'schedule_type': self.schedules[row['schedule']],
+            'procedure_code': self.codes[row['code']].decode('utf-8'),
+            'modifier': self.modifiers[row['modifier']].decode('utf-8') or None,
+            'region_id': int(self.regions[row['region']]) or None,
+            'rate': _number(row['rate']),
+            'rate_unit': self.rate_units[row['rate_unit']] or None,
+            'is_by_report': bool(row['is_by_report']),
+            'effective_date': _date(row['effective_date']),
+            'valid_from': _date(row['valid_from']),
+            'valid_to': _date(row['valid_to']),
+            'fee_schedule_id': int(row['fee_schedule_id']),
+        }
+
+    def medicare_row(self, index):
+        row = self.medicare_rows[index]
+        carrier_code, locality_code = self.localities[row['locality']].decode('utf-8').split('\t', 1)
+        return {
+            'procedure_code': self.codes[row['code']].decode('utf-8'),
+            'modifier': self.modifiers[row['modifier']].decode('utf-8') or None,
+            'carrier_code': carrier_code or None,
+            'locality_code': locality_code,
+            'year': int(row['year']) or None,
+            'rate': _number(row['rate']),
+            'facility_rate': _number(row['facility_rate']),
+            'valid_from': _date(row['valid_from']),
+            'valid_to': _date(row['valid_to']),
+        }
+
+    def stats(self):
+        memory = mapping_memory(self.path)
+        return {
+            'path': self.path,
+            'built_at': self.built_at,
+            'rates': len(self.keys),
+            'wc_rate_versions': len(self.wc_rows),
+            'medicare_rates': len(self.medicare_rows),
+            'states': len(self.states),
+            'schedule_types': len(self.schedules),
+            'procedure_codes': len(self.codes),
+            'modifiers': len(self.modifiers) - 1,
+            'regions': len(self.regions) - 1,
+            'key_bits': self.bits,
+            'file_bytes': int(self._map.nbytes),
+            'worker_memory': memory,
+        }
+
+
+class FeeSnapshotStore:
+    """Holds the current FeeSnapshot and reopens it when the import pipeline writes a new file
+
+    Opening is just a mmap, so a reload happens inline on the first lookup
+    after the file changes; the old mapping lives until its last reader lets go.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.path = None
+        self.check_interval = 30
+        self.snapshot = None
+        self._signature = None
+        self._last_check = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.path = app.config.get('FEE_SNAPSHOT_PATH')
+        database = app.config.get('RATES_DATABASE')
+        if not self.path and database:
+            self.path = os.path.splitext(database)[0] + '.fees'
+        self.check_interval = app.config.get('FEE_SNAPSHOT_CHECK_INTERVAL', self.check_interval)
+        app.extensions['fee_snapshot'] = self
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def reload(self):
+        with self._lock:
+            signature = self._file_signature()
+            if signature is None:
+                raise RuntimeError(f"Fee schedule snapshot not found at {self.path}; run utils/build_fee_snapshot.py")
+            snapshot = FeeSnapshot(self.path)
+            self.snapshot = snapshot
+            self._signature = signature
+            if self.app is not None:
+                self.app.logger.info(f"Mapped fee schedule snapshot: {len(snapshot)} rates, "
+                                     f"{snapshot._map.nbytes / 1e6:.1f} MB")
+            return snapshot
+
+    def get(self):
+        if not self.path:
+            raise RuntimeError("FEE_SNAPSHOT_PATH (or RATES_DATABASE) is not configured")
+        now = time.monotonic()
+        if self.snapshot is None:
+            return self.reload()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            if self._file_signature() not in (None, self._signature):
+                return self.reload()
+        return self.snapshot
+
+    def memory(self):
+        """Snapshot file size plus this worker's rss / pss / private bytes of the mapping"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return {}
+        return dict(mapping_memory(snapshot.path) or {}, file=int(snapshot._map.nbytes))
+
+    def stats(self):
+        if self.snapshot is None:
+            return {'path': self.path, 'loaded': False}
+        return dict(self.snapshot.stats(), loaded=True)
+
+
+fee_snapshots = FeeSnapshotStore()
@@ -0,0 +1,243 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [per-bucket counts (last is +Inf), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    label_text = _labels(self.label_names, labels, [('le', _number(bound))])
+                    lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+                label_text = _labels(self.label_names, labels)
+                lines.append(f"{self.name}_sum{label_text} {_number(total)}")
+                lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """In-process request, SQL, S3 and cache metrics in the Prometheus text format
+
+    Recording is a dict update under a per-metric lock, so it is cheap enough
+    to leave on. Values are per process: under gunicorn each worker serves
+    its own /metrics, and Prometheus sums them across scrape targets.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.slow_query_seconds = 0.25
+        self._slow_queries = deque(maxlen=100)
+        self._gauges = []
+        self._listening = False
+
+        self.requests = Counter('http_requests_total', 'HTTP requests', ('route', 'method', 'status'))
+        self.request_seconds = Histogram('http_request_duration_seconds', 'HTTP request latency', ('route', 'method'))
+        self.sql_statements = Counter('sql_statements_total', 'SQL statements executed', ('route',))
+        self.sql_seconds = Histogram('sql_statement_duration_seconds', 'SQL statement latency', ('route',))
+        self.request_sql_statements = Histogram(
+            'http_request_sql_statements', 'SQL statements per HTTP request', ('route',), COUNT_BUCKETS
+        )
+        self.request_sql_seconds = Histogram(
+            'http_request_sql_duration_seconds', 'Total SQL time per HTTP request', ('route',)
+        )
+        self.slow_query_count = Counter('sql_slow_queries_total', 'SQL statements slower than the slow query threshold', ('route',))
+        self.s3_seconds = Histogram('s3_request_duration_seconds', 'S3 request latency', ('operation',))
+        self.s3_bytes = Histogram('s3_response_bytes', 'S3 response body size', ('operation',), SIZE_BUCKETS)
+        self.s3_errors = Counter('s3_errors_total', 'Failed S3 requests', ('operation',))
+        self.rate_lookups = Counter('rate_lookups_total', '/api/rates lookups by where the rows came from', ('source',))
+        self._metrics = [
+            self.requests, self.request_seconds, self.sql_statements, self.sql_seconds,
+            self.request_sql_statements, self.request_sql_seconds, self.slow_query_count,
+            self.s3_seconds, self.s3_bytes, self.s3_errors, self.rate_lookups,
+        ]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.slow_query_seconds = app.config.get('METRICS_SLOW_QUERY_MS', self.slow_query_seconds * 1000) / 1000
+        self._slow_queries = deque(maxlen=app.config.get('METRICS_SLOW_QUERY_LOG_SIZE', 100))
+        app.extensions['metrics'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        if not self._listening:
+            # Engine-class listeners cover every engine, including ones created after this call
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            self._listening = True
+
+    def gauge(self, name, help_text, fn):
+        """Report fn() (a number, or a {label value: number} dict with one 'key' label) on every scrape"""
+        self._gauges.append((name, help_text, fn))
+
+    # --- Requests ---
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_seconds = 0.0
+
+    def _after_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        route = _route()
+        self.request_seconds.observe(time.perf_counter() - start, route, request.method)
+        self.requests.inc(route, request.method, str(response.status_code))
+        self.request_sql_statements.observe(g.pop('metrics_sql_count', 0), route)
+        self.request_sql_seconds.observe(g.pop('metrics_sql_seconds', 0.0), route)
+        return response
+
+    # --- SQL ---
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        route = _route() if has_request_context() else 'background'
+        self.sql_statements.inc(route)
+        self.sql_seconds.observe(elapsed, route)
+        if has_request_context() and 'metrics_sql_count' in g:
+            g.metrics_sql_count += 1
+            g.metrics_sql_seconds += elapsed
+        if elapsed >= self.slow_query_seconds:
+            self._record_slow_query(route, statement, elapsed, executemany)
+
+    def _record_slow_query(self, route, statement, elapsed, executemany):
+        # Parameters are left out: they can carry user data
+        sql = ' '.join(statement.split())[:1000]
+        self.slow_query_count.inc(route)
+        self._slow_queries.append({
+            'at': datetime.utcnow().isoformat(timespec='seconds'),
+            'route': route,
+            'duration_ms': round(elapsed * 1000, 2),
+            'executemany': executemany,
+            'statement': sql,
+        })
+        if self.app is not None:
+            self.app.logger.warning(f"Slow query ({elapsed * 1000:.1f} ms) in {route}: {sql}")
+
+    def slow_queries(self):
+        """Most recent slow statements, newest first"""
+        return list(reversed(self._slow_queries))
+
+    # --- S3 and caches ---
+
+    @contextmanager
+    def track_s3(self, operation):
+        """Time an S3 call; set result['bytes'] inside the block to record the response size"""
+        result = {'bytes': None}
+        start = time.perf_counter()
+        try:
+            yield result
+        except Exception:
+            self.s3_errors.inc(operation)
+            raise
+        finally:
+            self.s3_seconds.observe(time.perf_counter() - start, operation)
+        if result['bytes'] is not None:
+            self.s3_bytes.observe(result['bytes'], operation)
+
+    def rate_lookup(self, source):
+        self.rate_lookups.inc(source)
+
+    # --- Exposition ---
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, help_text, fn in self._gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            value = fn()
+            if isinstance(value, dict):
+                for key, number in sorted(value.items()):
+                    lines.append(f'{name}{{key="{_escape(key)}"}} {_number(number)}')
+            else:
+                lines.append(f"{name} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+metrics = Metrics()
@@ -12,7 +12,7 @@ class User(db.Model):
 
 class RateQuery(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     state = db.Column(db.String(2), nullable=False)
     procedure_code = db.Column(db.String(20), nullable=False)
     query_date = db.Column(db.DateTime, default=datetime.utcnow)
@@ -42,8 +42,34 @@ class CachedRate(db.Model):
         db.Index('idx_cache_access', 'access_count', 'last_accessed'),
     )
 
+    def to_dict(self):
+        return {
+            'provider': self.provider,
+            'rate': float(self.rate),
+            'date': self.effective_date.isoformat()
+        }
+
     def increment_access(self):
         self.access_count += 1
         self.last_accessed = datetime.utcnow()
         db.session.add(self)
-        db.session.commit() 
\ No newline at end of file
+        db.session.commit() 
+
+
+class RateAccessRollup(db.Model):
+    """Running access totals per (state, procedure_code), maintained by the access counter flush"""
+    state = db.Column(db.String(2), primary_key=True)
+    procedure_code = db.Column(db.String(20), primary_key=True)
+    total_accesses = db.Column(db.BigInteger, nullable=False, default=0)
+    last_accessed = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_rollup_total_accesses', 'total_accesses'),
+    )
+
+
+class RateQueryHourly(db.Model):
+    """Per-hour RateQuery and cache-hit counters, maintained by the access counter flush"""
+    hour = db.Column(db.DateTime, primary_key=True)
+    total_queries = db.Column(db.BigInteger, nullable=False, default=0)
+    cache_hits = db.Column(db.BigInteger, nullable=False, default=0)
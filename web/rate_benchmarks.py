@@ -0,0 +1,32 @@
+BENCHMARK_FIELDS = [
+    'state_code', 'procedure_code', 'modifier', 'carrier_code', 'locality_code', 'region_id',
+    'fee_schedule_id', 'wc_rate', 'medicare_year', 'medicare_rate', 'pct_of_medicare',
+    'commercial_count', 'commercial_p25', 'commercial_p50', 'commercial_p75', 'refreshed_at',
+]
+
+
+def _to_dict(row):
+    result = dict(zip(BENCHMARK_FIELDS, row))
+    result['modifier'] = result['modifier'] or None
+    return result
+
+
+def benchmark_lookup(conn, state, procedure_code, modifier=None, location=None):
+    """rate_benchmark rows for a code, as one range probe of the primary key
+
+    With a resolved ZIP (`location` from ZipResolver.resolve) the probe is
+    narrowed to the ZIP's Medicare locality and to the statewide rate plus
+    the ZIP's WC regions; without one it returns every locality in the state.
+    """
+    sql = f"""
+        SELECT {', '.join(BENCHMARK_FIELDS)} FROM rate_benchmark
+        WHERE state_code = ? AND procedure_code = ? AND modifier = ?
+    """
+    params = [state, procedure_code, modifier or '']
+    if location is not None:
+        region_ids = [0, *location['region_ids']]
+        sql += f"""
+            AND carrier_code = ? AND locality_code = ? AND region_id IN ({','.join('?' * len(region_ids))})
+        """
+        params += [location['carrier_code'] or '', location['locality_code'] or '', *region_ids]
+    return [_to_dict(row) for row in conn.execute(sql, params)]
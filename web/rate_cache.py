@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RateCache:
+    """Size-bounded LRU cache with a TTL for /api/rates responses, keyed by (state, procedure_code)"""
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.max_size = 500
+        self.timeout = 300
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('CACHE_TYPE', 'simple') != 'null'
+        self.max_size = app.config.get('CACHE_THRESHOLD', self.max_size)
+        self.timeout = app.config.get('CACHE_DEFAULT_TIMEOUT', self.timeout)
+        app.extensions['rate_cache'] = self
+
+    def get(self, state, procedure_code):
+        """Return the cached value for a key, or None if it is missing or expired"""
+        if not self.enabled:
+            return None
+        key = (state, procedure_code)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, state, procedure_code, value):
+        if not self.enabled:
+            return
+        key = (state, procedure_code)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, state, procedure_code):
+        with self._lock:
+            self._entries.pop((state, procedure_code), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'timeout': self.timeout,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups * 100, 2) if lookups > 0 else 0
+            }
+
+
+rate_cache = RateCache()
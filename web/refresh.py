@@ -0,0 +1,177 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from models import db, CachedRate
+
+
+def _lock_id(state, procedure_code):
+    """Stable signed 64-bit id for a (state, procedure_code) advisory lock"""
+    digest = hashlib.sha1(f"{state}:{procedure_code}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+class RefreshScheduler:
+    """Single-flight S3 refreshes per (state, procedure_code) on a bounded worker pool
+
+    Within a process, concurrent callers for the same key share one Future. Across
+    gunicorn workers a PostgreSQL advisory lock (or a flock'd file on other
+    backends) makes sure only one worker downloads and reloads a key at a time.
+    """
+
+    def __init__(self, app=None, refresh_fn=None):
+        self.app = None
+        self.refresh_fn = None
+        self.max_age = timedelta(hours=24)
+        self.max_workers = 4
+        self.wait_timeout = 30
+        self.lock_dir = os.path.join(tempfile.gettempdir(), 'fs_app_refresh_locks')
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app, refresh_fn)
+
+    def init_app(self, app, refresh_fn):
+        self.app = app
+        self.refresh_fn = refresh_fn
+        self.max_age = timedelta(hours=app.config.get('CACHE_REFRESH_AGE_HOURS', 24))
+        self.max_workers = app.config.get('REFRESH_WORKERS', self.max_workers)
+        self.wait_timeout = app.config.get('REFRESH_WAIT_TIMEOUT', self.wait_timeout)
+        self.lock_dir = app.config.get('REFRESH_LOCK_DIR') or self.lock_dir
+        app.extensions['refresh_scheduler'] = self
+
+    def is_stale(self, last_updated):
+        return last_updated is None or (datetime.utcnow() - last_updated) > self.max_age
+
+    def last_updated(self, state, procedure_code):
+        """Most recent CachedRate.last_updated for the key, or None if it has no rows"""
+        return db.session.query(db.func.max(CachedRate.last_updated)).filter_by(
+            state=state,
+            procedure_code=procedure_code
+        ).scalar()
+
+    def _get_executor(self):
+        # Created lazily so each forked gunicorn worker gets its own pool
+        if self._executor is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._in_flight = {}
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='cache-refresh'
+            )
+        return self._executor
+
+    def submit(self, state, procedure_code, blocking=False, newer_than=None):
+        """Start a refresh for the key, or join the one already in flight; returns its Future
+
+        A blocking refresh waits for another worker's lock instead of skipping, so a
+        caller with no rows at all gets data once that worker is done. With newer_than,
+        rows loaded before that time are refetched even if they are not stale yet.
+        """
+        key = (state, procedure_code)
+        with self._lock:
+            executor = self._get_executor()
+            future = self._in_flight.get(key)
+            if future is None:
+                future = executor.submit(self._run, state, procedure_code, blocking, newer_than)
+                self._in_flight[key] = future
+                future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def refresh_now(self, state, procedure_code):
+        """Refresh the key and wait for it (up to REFRESH_WAIT_TIMEOUT seconds)"""
+        future = self.submit(state, procedure_code, blocking=True)
+        try:
+            return future.result(timeout=self.wait_timeout)
+        except Exception as e:
+            self.app.logger.error(f"Error waiting for refresh of {state}/{procedure_code}: {str(e)}")
+            return False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def _done(self, key, future):
+        with self._lock:
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def _run(self, state, procedure_code, blocking, newer_than=None):
+        with self.app.app_context():
+            try:
+                with self.cross_process_lock(state, procedure_code, blocking) as acquired:
+                    if not acquired:
+                        # Another worker is already refreshing this key
+                        return False
+                    # The key may have been refreshed while we waited for the lock
+                    last_updated = self.last_updated(state, procedure_code)
+                    if not self.is_stale(last_updated) and (newer_than is None or last_updated >= newer_than):
+                        return True
+                    return self.refresh_fn(state, procedure_code)
+            finally:
+                db.session.remove()
+
+    @contextmanager
+    def cross_process_lock(self, state, procedure_code, blocking=True):
+        """Hold the lock for the key across every worker process; yields whether it was acquired
+
+        A PostgreSQL advisory lock, or a file lock in lock_dir on other backends.
+        Other periodic jobs can lock a key of their own, e.g. ('*', job name).
+        """
+        if db.engine.dialect.name == 'postgresql':
+            with self._advisory_lock(state, procedure_code, blocking) as acquired:
+                yield acquired
+        else:
+            with self._file_lock(state, procedure_code, blocking) as acquired:
+                yield acquired
+
+    @contextmanager
+    def _advisory_lock(self, state, procedure_code, blocking):
+        lock_id = _lock_id(state, procedure_code)
+        with db.engine.connect() as conn:
+            if blocking:
+                conn.execute(text("SELECT pg_advisory_lock(:id)"), {'id': lock_id})
+                acquired = True
+            else:
+                acquired = conn.execute(
+                    text("SELECT pg_try_advisory_lock(:id)"), {'id': lock_id}
+                ).scalar()
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': lock_id})
+                conn.commit()
+
+    @contextmanager
+    def _file_lock(self, state, procedure_code, blocking):
+        os.makedirs(self.lock_dir, exist_ok=True)
+        path = os.path.join(self.lock_dir, f"{_lock_id(state, procedure_code) & 0xffffffffffffffff:016x}.lock")
+        with open(path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+            except BlockingIOError:
+                acquired = False
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+refresh_scheduler = RefreshScheduler()
@@ -0,0 +1,163 @@
+from collections import defaultdict
+
+from sqlalchemy import and_, insert, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, RateQuery, RateAccessRollup, RateQueryHourly
+
+
+def _truncate_hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _upsert_increment(model, rows, key_columns, increment_columns, replace_columns=()):
+    """INSERT rows, adding increment_columns onto any existing row with the same key"""
+    if not rows:
+        return
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(model.__table__)
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(model.__table__)
+    else:
+        _update_then_insert(model, rows, key_columns, increment_columns, replace_columns)
+        return
+
+    table = model.__table__
+    updates = {column: table.c[column] + stmt.excluded[column] for column in increment_columns}
+    updates.update({column: stmt.excluded[column] for column in replace_columns})
+    db.session.execute(
+        stmt.on_conflict_do_update(index_elements=key_columns, set_=updates),
+        rows
+    )
+
+
+def _update_then_insert(model, rows, key_columns, increment_columns, replace_columns):
+    """Portable upsert for backends without ON CONFLICT: UPDATE each key, INSERT the ones that matched nothing
+
+    Two workers inserting the same new key at once makes one flush fail on
+    the primary key; the access counter requeues it and the retry updates.
+    """
+    table = model.__table__
+    missing = []
+    for row in rows:
+        values = {column: table.c[column] + row[column] for column in increment_columns}
+        values.update({column: row[column] for column in replace_columns})
+        result = db.session.execute(
+            update(table).where(and_(*(table.c[column] == row[column] for column in key_columns))).values(values)
+        )
+        if not result.rowcount:
+            missing.append(row)
+    if missing:
+        db.session.execute(insert(table), missing)
+
+
+def apply_access_hits(pending, last_accessed):
+    """Fold flushed (state, procedure_code, row_id) hit counts into RateAccessRollup"""
+    totals = defaultdict(int)
+    latest = {}
+    for (state, procedure_code, row_id), hits in pending.items():
+        key = (state, procedure_code)
+        totals[key] += hits
+        accessed = last_accessed.get(row_id)
+        if accessed is not None and (key not in latest or latest[key] < accessed):
+            latest[key] = accessed
+
+    _upsert_increment(RateAccessRollup, [{
+        'state': state,
+        'procedure_code': procedure_code,
+        'total_accesses': hits,
+        'last_accessed': latest.get((state, procedure_code))
+    } for (state, procedure_code), hits in totals.items()],
+        key_columns=['state', 'procedure_code'],
+        increment_columns=['total_accesses'],
+        replace_columns=['last_accessed'])
+
+
+def apply_queries(queries):
+    """Fold flushed RateQuery log rows into the per-hour counters"""
+    counts = defaultdict(lambda: [0, 0])
+    for query in queries:
+        bucket = counts[_truncate_hour(query['query_date'])]
+        bucket[0] += 1
+        bucket[1] += 1 if query['cache_hit'] else 0
+
+    _upsert_increment(RateQueryHourly, [{
+        'hour': hour,
+        'total_queries': total,
+        'cache_hits': hits
+    } for hour, (total, hits) in counts.items()],
+        key_columns=['hour'],
+        increment_columns=['total_queries', 'cache_hits'])
+
+
+def top_rates(limit=10):
+    """Most accessed (state, procedure_code) keys, read off the total_accesses index"""
+    return RateAccessRollup.query.order_by(
+        RateAccessRollup.total_accesses.desc()
+    ).limit(limit).all()
+
+
+def query_totals(since=None):
+    """Total queries and cache hits, optionally only for hours at or after `since`"""
+    query = db.session.query(
+        db.func.coalesce(db.func.sum(RateQueryHourly.total_queries), 0),
+        db.func.coalesce(db.func.sum(RateQueryHourly.cache_hits), 0)
+    )
+    if since is not None:
+        query = query.filter(RateQueryHourly.hour >= _truncate_hour(since))
+    total_queries, cache_hits = query.one()
+    return int(total_queries), int(cache_hits)
+
+
+def _rebuild_hourly_portable():
+    """Per-hour counters computed in Python, for backends without a known hour-truncation function"""
+    counts = defaultdict(lambda: [0, 0])
+    for query_date, cache_hit in db.session.query(RateQuery.query_date, RateQuery.cache_hit).yield_per(10000):
+        bucket = counts[_truncate_hour(query_date)]
+        bucket[0] += 1
+        bucket[1] += 1 if cache_hit else 0
+    if counts:
+        db.session.execute(insert(RateQueryHourly.__table__), [
+            {'hour': hour, 'total_queries': total, 'cache_hits': hits}
+            for hour, (total, hits) in counts.items()
+        ])
+
+
+def rebuild_rollups():
+    """Recompute both rollup tables from the full rate_query history
+
+    Every RateQuery row stands for one hit on each of its result_count cached
+    rows, so SUM(result_count) reproduces the access totals the flush maintains.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        hour_expr = "date_trunc('hour', query_date)"
+    elif dialect == 'sqlite':
+        hour_expr = "strftime('%Y-%m-%d %H:00:00.000000', query_date)"
+    else:
+        hour_expr = None
+
+    rate_query = RateQuery.__tablename__
+    try:
+        RateAccessRollup.query.delete()
+        RateQueryHourly.query.delete()
+        db.session.execute(text(
+            f"INSERT INTO {RateAccessRollup.__tablename__} (state, procedure_code, total_accesses, last_accessed) "
+            f"SELECT state, procedure_code, SUM(COALESCE(result_count, 0)), MAX(query_date) "
+            f"FROM {rate_query} GROUP BY state, procedure_code"
+        ))
+        if hour_expr is None:
+            _rebuild_hourly_portable()
+        else:
+            db.session.execute(text(
+                f"INSERT INTO {RateQueryHourly.__tablename__} (hour, total_queries, cache_hits) "
+                f"SELECT {hour_expr}, COUNT(*), SUM(CASE WHEN cache_hit THEN 1 ELSE 0 END) "
+                f"FROM {rate_query} GROUP BY {hour_expr}"
+            ))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return RateAccessRollup.query.count(), RateQueryHourly.query.count()
@@ -0,0 +1,169 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LAT = 69.0
+# Grid cell edge in degrees; ~17 miles of latitude keeps each cell to a few dozen ZIPs
+CELL_DEGREES = 0.25
+LAT_CELLS = int(180 / CELL_DEGREES)
+LON_CELLS = int(360 / CELL_DEGREES)
+# Max ZIPs per IN list when querying commercial_rate
+QUERY_CHUNK_SIZE = 500
+
+
+def haversine_miles(lat, lon, lats, lons):
+    """Great-circle distance in miles from one point to arrays of points"""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _cell_rows(lats):
+    return np.clip(((lats + 90) / CELL_DEGREES).astype(np.int64), 0, LAT_CELLS - 1)
+
+
+def _cell_cols(lons):
+    return np.clip(((lons + 180) / CELL_DEGREES).astype(np.int64), 0, LON_CELLS - 1)
+
+
+class CentroidIndex:
+    """Grid index over ZIP centroids for k-nearest and radius queries
+
+    Points are bucketed into CELL_DEGREES cells and stored sorted by cell key
+    (row * LON_CELLS + col), so the cells of one grid row inside a bounding box
+    form a single contiguous key range found with two binary searches. Exact
+    distances are then computed only for those candidates.
+    """
+
+    def __init__(self, zip_codes, lats, lons):
+        keys = _cell_rows(lats) * LON_CELLS + _cell_cols(lons)
+        order = np.argsort(keys, kind='stable')
+        self.zip_codes = np.asarray(zip_codes, dtype=object)[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.keys = keys[order]
+        self.positions = {zip_code: i for i, zip_code in enumerate(self.zip_codes)}
+
+    @classmethod
+    def build(cls, conn):
+        """Load every zip_code row with a centroid"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(zip_code)")}
+        if not {'latitude', 'longitude'} <= columns:
+            return cls([], np.zeros(0), np.zeros(0))
+        rows = conn.execute("""
+            SELECT zip_code, latitude, longitude FROM zip_code
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """).fetchall()
+        return cls(
+            [row[0] for row in rows],
+            np.array([row[1] for row in rows], dtype=np.float64),
+            np.array([row[2] for row in rows], dtype=np.float64),
+        )
+
+    def __len__(self):
+        return len(self.zip_codes)
+
+    def centroid(self, zip_code):
+        """(lat, lon) of a ZIP, or None if it has no centroid"""
+        i = self.positions.get(zip_code)
+        if i is None:
+            return None
+        return float(self.lats[i]), float(self.lons[i])
+
+    def _candidates(self, lat, lon, miles):
+        """Indexes of the points in the cells overlapping the bounding box of the circle"""
+        dlat = miles / MILES_PER_DEGREE_LAT
+        lat_lo, lat_hi = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        widest = max(abs(lat_lo), abs(lat_hi))
+        cos_lat = math.cos(math.radians(widest)) if widest < 89.9 else 0.0
+        dlon = miles / (MILES_PER_DEGREE_LAT * cos_lat) if cos_lat else 360.0
+
+        if dlon >= 180:
+            col_ranges = [(0, LON_CELLS - 1)]
+        else:
+            lon_lo, lon_hi = lon - dlon, lon + dlon
+            col_ranges = []
+            # Split the box where it crosses the antimeridian
+            if lon_lo < -180:
+                col_ranges.append((int(_cell_cols(np.array(lon_lo + 360))), LON_CELLS - 1))
+                lon_lo = -180.0
+            if lon_hi >= 180:
+                col_ranges.append((0, int(_cell_cols(np.array(lon_hi - 360)))))
+                lon_hi = 180.0 - 1e-9
+            col_ranges.append((int(_cell_cols(np.array(lon_lo))), int(_cell_cols(np.array(lon_hi)))))
+
+        row_lo, row_hi = int(_cell_rows(np.array(lat_lo))), int(_cell_rows(np.array(lat_hi)))
+        bounds = []
+        for row in range(row_lo, row_hi + 1):
+            for col_lo, col_hi in col_ranges:
+                bounds.append((row * LON_CELLS + col_lo, row * LON_CELLS + col_hi + 1))
+        if not bounds:
+            return np.zeros(0, dtype=np.int64)
+        bounds = np.array(bounds)
+        starts = np.searchsorted(self.keys, bounds[:, 0], side='left')
+        ends = np.searchsorted(self.keys, bounds[:, 1], side='left')
+        return np.concatenate([np.arange(s, e) for s, e in zip(starts, ends) if e > s] or [np.zeros(0, dtype=np.int64)])
+
+    def within(self, lat, lon, miles):
+        """[(zip_code, distance_miles)] within `miles` of a point, nearest first"""
+        candidates = self._candidates(lat, lon, miles)
+        distances = haversine_miles(lat, lon, self.lats[candidates], self.lons[candidates])
+        keep = distances <= miles
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return [(self.zip_codes[i], float(d)) for i, d in zip(candidates[order], distances[order])]
+
+    def nearest(self, lat, lon, k=10):
+        """[(zip_code, distance_miles)] for the k nearest centroids to a point
+
+        Searches a radius that doubles until it holds at least k points; any
+        point outside that radius is farther than every point inside it.
+        """
+        k = min(k, len(self))
+        if k <= 0:
+            return []
+        miles = 10.0
+        while True:
+            found = self.within(lat, lon, miles)
+            if len(found) >= k or miles > math.pi * EARTH_RADIUS_MILES:
+                return found[:k]
+            miles *= 2
+
+    def memory_bytes(self):
+        return self.lats.nbytes + self.lons.nbytes + self.keys.nbytes + self.zip_codes.nbytes
+
+
+def commercial_rates_near(conn, centroids, zip_code, procedure_code, miles=25, limit=100):
+    """commercial_rate rows for a procedure within `miles` of a ZIP, nearest first
+
+    Returns None if the ZIP has no centroid.
+    """
+    origin = centroids.centroid(zip_code)
+    if origin is None:
+        return None
+    nearby = centroids.within(*origin, miles)
+    distances = dict(nearby)
+
+    results = []
+    zip_codes = [zip_code for zip_code, _ in nearby]
+    for start in range(0, len(zip_codes), QUERY_CHUNK_SIZE):
+        chunk = zip_codes[start:start + QUERY_CHUNK_SIZE]
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f"""
+            SELECT zip_code, modifier, provider, payer, rate, effective_date
+            FROM commercial_rate
+            WHERE procedure_code = ? AND zip_code IN ({placeholders})
+        """, (procedure_code, *chunk)):
+            results.append({
+                'zip_code': row[0],
+                'modifier': row[1],
+                'provider': row[2],
+                'payer': row[3],
+                'rate': row[4],
+                'effective_date': row[5],
+                'distance_miles': round(distances[row[0]], 2),
+            })
+    results.sort(key=lambda result: result['distance_miles'])
+    return results[:limit]
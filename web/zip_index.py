@@ -0,0 +1,264 @@
+import glob
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from spatial_index import CentroidIndex
+
+ZIP_SLOTS = 100000
+
+
+def parse_zip(zip_code):
+    """Return the numeric ZIP for '30303', '30303-1234', '303031234' or 1001; raises ValueError
+
+    Short numeric values are ZIPs that lost their leading zeros (01001 -> 1001).
+    """
+    text = str(zip_code).strip().split('-')[0]
+    if len(text) == 9:
+        text = text[:5]
+    if not text.isdigit() or len(text) > 5:
+        raise ValueError(f"Invalid ZIP code: {zip_code!r}")
+    return int(text)
+
+
+def connect_readonly(path):
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+
+def _table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def partition_files(database):
+    """Per-state partition files written by utils/state_partitions.py, in states/ next to the rates database"""
+    return sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(database)), 'states', '[A-Z][A-Z].db')))
+
+
+class ZipIndex:
+    """Immutable ZIP -> state / WC regions / Medicare locality index
+
+    Every 5-digit ZIP owns one slot in flat arrays:
+      state_ids      uint8   index into `states` (0 = unknown)
+      locality_ids   uint16  index into `localities` of (carrier_code, locality_code) (0 = unknown)
+      region_offsets int64   CSR offsets into region_ids for the ZIP's WC regions
+    That is about 1 MB for the fixed arrays plus 8 bytes per ZIP/region pair
+    (region ids of partitioned states go past int32),
+    and a lookup is a handful of array reads.
+    """
+
+    def __init__(self, states, state_ids, localities, locality_ids, region_offsets, region_ids):
+        self.states = states
+        self.state_ids = state_ids
+        self.localities = localities
+        self.locality_ids = locality_ids
+        self.region_offsets = region_offsets
+        self.region_ids = region_ids
+        self.zip_count = int(np.count_nonzero(state_ids | locality_ids | np.diff(region_offsets)))
+
+    @classmethod
+    def build(cls, conn, partitions=()):
+        """Build the index from zip_code, zip_region_map and medicare_locality_map
+
+        `partitions` are the per-state partition files; their zip_region_map
+        rows are read alongside the shared database's.
+        """
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        states = [None]
+        state_lookup = {}
+        state_ids = np.zeros(ZIP_SLOTS, dtype=np.uint8)
+        localities = [(None, None)]
+        locality_lookup = {}
+        locality_ids = np.zeros(ZIP_SLOTS, dtype=np.uint16)
+
+        def intern_state(state_code):
+            if state_code not in state_lookup:
+                state_lookup[state_code] = len(states)
+                states.append(state_code)
+            return state_lookup[state_code]
+
+        def slots(rows):
+            for row in rows:
+                try:
+                    yield (parse_zip(row[0]),) + tuple(row[1:])
+                except ValueError:
+                    continue
+
+        if 'zip_code' in tables:
+            for slot, state_code in slots(conn.execute(
+                    "SELECT zip_code, state_code FROM zip_code WHERE state_code IS NOT NULL")):
+                state_ids[slot] = intern_state(state_code)
+
+        if 'medicare_locality_map' in tables:
+            columns = _table_columns(conn, 'medicare_locality_map')
+            carrier = 'carrier_code' if 'carrier_code' in columns else 'NULL'
+            state = 'state_code' if 'state_code' in columns else 'NULL'
+            # Several quarters can be loaded side by side; read oldest first so the latest wins
+            order = 'ORDER BY year_qtr' if 'year_qtr' in columns else ''
+            for slot, carrier_code, locality_code, state_code in slots(conn.execute(
+                    f"SELECT zip_code, {carrier}, locality_code, {state} FROM medicare_locality_map {order}")):
+                key = (carrier_code, locality_code)
+                if key not in locality_lookup:
+                    locality_lookup[key] = len(localities)
+                    localities.append(key)
+                locality_ids[slot] = locality_lookup[key]
+                if state_code and not state_ids[slot]:
+                    state_ids[slot] = intern_state(state_code)
+
+        counts = np.zeros(ZIP_SLOTS, dtype=np.int64)
+        pairs = []
+        if 'zip_region_map' in tables:
+            pairs.extend(slots(conn.execute("SELECT zip_code, region_id FROM zip_region_map")))
+        for path in partitions:
+            part = connect_readonly(path)
+            try:
+                pairs.extend(slots(part.execute("SELECT zip_code, region_id FROM zip_region_map")))
+            finally:
+                part.close()
+        pairs.sort()
+        for slot, _ in pairs:
+            counts[slot] += 1
+        region_offsets = np.zeros(ZIP_SLOTS + 1, dtype=np.int64)
+        np.cumsum(counts, out=region_offsets[1:])
+        region_ids = np.array([region_id for _, region_id in pairs], dtype=np.int64)
+
+        return cls(states, state_ids, localities, locality_ids, region_offsets, region_ids)
+
+    def lookup(self, zip_code):
+        """Resolve one ZIP; returns None if nothing is known about it"""
+        slot = parse_zip(zip_code)
+        state_id = self.state_ids[slot]
+        locality_id = self.locality_ids[slot]
+        start, end = self.region_offsets[slot], self.region_offsets[slot + 1]
+        if not state_id and not locality_id and start == end:
+            return None
+        carrier_code, locality_code = self.localities[locality_id]
+        return {
+            'zip_code': f"{slot:05d}",
+            'state_code': self.states[state_id],
+            'region_ids': self.region_ids[start:end].tolist(),
+            'carrier_code': carrier_code,
+            'locality_code': locality_code,
+        }
+
+    def lookup_many(self, zip_codes):
+        """Resolve a batch of ZIPs; unknown or invalid ZIPs map to None"""
+        results = []
+        for zip_code in zip_codes:
+            try:
+                results.append(self.lookup(zip_code))
+            except ValueError:
+                results.append(None)
+        return results
+
+    def memory_bytes(self):
+        arrays = (self.state_ids, self.locality_ids, self.region_offsets, self.region_ids)
+        return sum(array.nbytes for array in arrays)
+
+    def stats(self):
+        return {
+            'zip_count': self.zip_count,
+            'states': len(self.states) - 1,
+            'localities': len(self.localities) - 1,
+            'zip_region_pairs': int(len(self.region_ids)),
+            'memory_bytes': self.memory_bytes(),
+        }
+
+
+class ZipResolver:
+    """Holds the current ZipIndex and CentroidIndex and swaps in rebuilt ones when the rates database changes
+
+    Readers always see a complete index: a reload builds the new indexes off to
+    the side and replaces each reference in one assignment.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.database = None
+        self.check_interval = 30
+        self.index = None
+        self.centroids = None
+        self._signature = None
+        self._last_check = 0
+        self._reload_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.database = app.config.get('RATES_DATABASE')
+        self.check_interval = app.config.get('ZIP_INDEX_CHECK_INTERVAL', self.check_interval)
+        app.extensions['zip_resolver'] = self
+        if self.database and os.path.exists(self.database):
+            self.reload()
+
+    def _database_signature(self):
+        signature = []
+        for path in (self.database, f"{self.database}-wal", *partition_files(self.database)):
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reload(self):
+        """Rebuild the ZIP and centroid indexes from the rates database and swap them in"""
+        with self._reload_lock:
+            signature = self._database_signature()
+            start = time.perf_counter()
+            conn = connect_readonly(self.database)
+            try:
+                index = ZipIndex.build(conn, partition_files(self.database))
+                centroids = CentroidIndex.build(conn)
+            finally:
+                conn.close()
+            self.index = index
+            self.centroids = centroids
+            self._signature = signature
+            if self.app is not None:
+                self.app.logger.info(
+                    f"Loaded ZIP index: {index.zip_count} ZIPs, {index.memory_bytes() / 1e6:.1f} MB; "
+                    f"{len(centroids)} centroids, {centroids.memory_bytes() / 1e6:.1f} MB "
+                    f"in {time.perf_counter() - start:.2f}s"
+                )
+            return index
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval or not self.database:
+            return
+        self._last_check = now
+        if self.index is None or self._database_signature() != self._signature:
+            if not self._reload_lock.locked():
+                threading.Thread(target=self._reload_quietly, name='zip-index-reload', daemon=True).start()
+
+    def _reload_quietly(self):
+        try:
+            self.reload()
+        except Exception as e:
+            if self.app is not None:
+                self.app.logger.error(f"Error reloading ZIP index: {str(e)}")
+
+    def get_index(self):
+        self._maybe_reload()
+        if self.index is None:
+            if not self.database:
+                raise RuntimeError("RATES_DATABASE is not configured")
+            return self.reload()
+        return self.index
+
+    def get_centroids(self):
+        self.get_index()
+        return self.centroids
+
+    def resolve(self, zip_code):
+        return self.get_index().lookup(zip_code)
+
+    def resolve_many(self, zip_codes):
+        return self.get_index().lookup_many(zip_codes)
+
+
+zip_resolver = ZipResolver()